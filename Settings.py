@@ -6,8 +6,18 @@ State_Store_Provider = "Mongodb_State_Store"
 
 
 ## USer defined
+## Provider is one of "mongodb", "sqlite" or "memory". Writes reach the
+## provider in batches of BatchSize or every FlushInterval seconds
 Mongodb_State_Store = {
-    "Provider": "autopilot.statestore.mongodb",
+    "Provider": "mongodb",
     "Connection": "",
+    "Database": "autopilot",
+    "Collection": "state",
 }
 
+Sqlite_State_Store = {
+    "Provider": "sqlite",
+    "Path": "/var/lib/autopilot/state.db",
+    "BatchSize": 64,
+    "FlushInterval": 1.0,
+}
@@ -69,9 +69,12 @@ class StackDeployHandler(Handler):
             }
             initial_workflow_state[target_role_group][role] = {}
 
-            tasks.append(InstallRoleTask(apenv=self.apenv, wf_id=wf_id, inf=None,
-                                         properties=properties,
-                                         workflow_state=initial_workflow_state))
+            task = InstallRoleTask(apenv=self.apenv, wf_id=wf_id, inf=None,
+                                   properties=properties,
+                                   workflow_state=initial_workflow_state)
+            if headers.get("stream_progress"):
+                task.result.add_listener(self._progress_listener(process_future, wf_id, role))
+            tasks.append(task)
 
         self.log.info("Executing workflow for message of type: {0}. Domain: {1}. Workflow Id: {2}"
                       .format(self.message_type, headers.get("domain"), wf_id))
@@ -103,4 +106,12 @@ class StackDeployHandler(Handler):
                 process_future(result=rm, exception=Exception())
 
         WorkflowExecutor(apenv=self.apenv, model=model).execute().on_complete(executor_callback)
-        return process_future
\ No newline at end of file
+        return process_future
+
+    def _progress_listener(self, process_future, wf_id, role):
+        """
+        Report task state changes as progress events on the process future
+        """
+        def _progress(task, state):
+            process_future.progress(dict(wf_id=wf_id, role=role, task=task.name, state=state))
+        return _progress
\ No newline at end of file
@@ -5,6 +5,10 @@ import yaml
 from autopilot.common import utils
 from autopilot.common import exception
 from autopilot.common import logger
+from autopilot.common import process
+from autopilot.agent.installers.gitcache import get_git_cache
+
+SafeYamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 
 class InstallProvider(object):
@@ -25,28 +29,61 @@ class GitInstallProvider(InstallProvider):
     """
     LOG_SOURCE = "GitInstallProvider"
 
-    def __init__(self, apenv, role, role_group_name, stack_spec, repo_base_dir):
+    # lines of install output kept for error reports
+    TAIL_LINES = 200
+
+    def __init__(self, apenv, role, role_group_name, stack_spec, repo_base_dir, wf_id=None):
         InstallProvider.__init__(self, apenv, role, role_group_name, stack_spec, repo_base_dir)
         self.log = logger.get_logger("GitInstallProvider")
-
-    def run(self, blocking=True, timeout=120):
+        self.wf_id = wf_id
+        # install output is streamed to the workflow log as it is produced
+        self.wflog = logger.get_workflow_logger("InstallOutput")
+        self.output_tail = logger.OutputTail(max_lines=apenv.get("INSTALL_OUTPUT_TAIL_LINES", self.TAIL_LINES))
+
+    def run(self, blocking=True, timeout=None):
+        """
+        Clones the role and runs its install. timeout (seconds) is the
+        limit for the install itself. None waits for as long as it takes
+        """
         git_url = self.stack_spec.deploy.git
         branch = self.stack_spec.deploy.branch
-        git_command = "git clone {0} {1} -b {2}".format(git_url, self.repo_base_dir, branch)
-        self.log.info("Cloning from git. Command: {0}".format(git_command))
-        (return_code, out, error) = utils.subprocess_cmd(git_command, blocking=blocking)
-        if return_code:
-            self.log.error("Error cloning: Return Code: {0}. Error: {1}".format(return_code, error))
-            raise exception.GitInstallProviderException("git clone failed: Command: {0} Return Code: {1} Error: {2}"
-                                                        .format(git_command, return_code, error))
+        git_cache = get_git_cache(self.apenv)
+        if git_cache:
+            self.log.info("Cloning from git cache. Url: {0} Branch: {1}".format(git_url, branch))
+            git_cache.clone(git_url, branch, self.repo_base_dir, blocking=blocking)
+        else:
+            git_command = "git clone {0} {1} -b {2}".format(git_url, self.repo_base_dir, branch)
+            self.log.info("Cloning from git. Command: {0}".format(git_command))
+            (return_code, out, error) = utils.subprocess_cmd(git_command, blocking=blocking)
+            if return_code:
+                self.log.error("Error cloning: Return Code: {0}. Error: {1}".format(return_code, error))
+                raise exception.GitInstallProviderException("git clone failed: Command: {0} Return Code: {1} Error: {2}"
+                                                            .format(git_command, return_code, error))
 
         (return_code, out, error) = self._install(blocking=blocking, timeout=timeout)
         if return_code:
-            self.log.error("Installation failed: Return Code: {0}. Error: {1}".format(return_code, error))
-            raise exception.GitInstallProviderException("Installation failed. \n Error: {0}"
-                                                        .format(error))
-
-        self.log.info("Installation done. Output: {0}".format(out))
+            tail = "\n".join(part for part in (self.output_tail.text(), error) if part)
+            self.log.error("Installation failed: Return Code: {0}. Output tail: {1}".format(return_code, tail))
+            raise exception.GitInstallProviderException("Installation failed. Return Code: {0} \n Output tail: {1}"
+                                                        .format(return_code, tail))
+
+        self.log.info("Installation done for role: {0}".format(self.role))
+
+    def _output_streams(self):
+        """
+        Line callbacks for the install process, how many lines the process
+        runner itself should keep (none, the tail has them) and resource limits
+        """
+        return dict(on_stdout=logger.OutputStreamLogger(self.wflog, self.wf_id, self.role, "stdout",
+                                                        tail=self.output_tail),
+                    on_stderr=logger.OutputStreamLogger(self.wflog, self.wf_id, self.role, "stderr",
+                                                        tail=self.output_tail),
+                    output_lines=0,
+                    preexec_fn=self._limits())
+
+    def _limits(self):
+        # optional per role caps from ROLE_INSTALL_LIMITS (cpu_seconds, memory_bytes, nice)
+        return process.limits_preexec(**(self.apenv.get("ROLE_INSTALL_LIMITS") or {}))
 
     def _build_env(self, role_dir):
         d = dict(target=self.role, working_dir=role_dir)
@@ -68,20 +105,23 @@ class GitInstallProvider(InstallProvider):
             return SafePythonModuleRunner().run(ap_env_json=self._build_env(role_dir=role_dir),
                                                 working_dir=role_dir,
                                                 module_name=module_name,
-                                                blocking=blocking, timeout=timeout)
+                                                blocking=blocking, timeout=timeout,
+                                                **self._output_streams())
         else:
             # shell for now
             self.log.info("Installing from shell file setup.sh")
             return SafeShellModuleRunner().run(ap_env_json=self._build_env(role_dir=role_dir),
                                                working_dir=role_dir,
                                                module_name=meta.get("script", "setup.sh"),
-                                               blocking=blocking, timeout=timeout)
+                                               blocking=blocking, timeout=timeout,
+                                               **self._output_streams())
 
     def _read_metafile(self, role_dir, metafile):
         metafile_path = utils.path_join(role_dir, metafile)
         if metafile.strip() and utils.path_exists(metafile_path):
             self.log.info("Reading metafile at: {0}".format(metafile_path))
-            return yaml.load(open(metafile_path)).get("meta")
+            with open(metafile_path) as f:
+                return (yaml.load(f, Loader=SafeYamlLoader) or {}).get("meta")
         else:
             return {}
 
@@ -94,15 +134,17 @@ class SafeShellModuleRunner(object):
     def __init__(self):
         self.log = logger.get_logger("SafeShellModuleRunner")
 
-    # todo: use timeout
-    def run(self, ap_env_json, working_dir, module_name, blocking=True, timeout=None):
+    def run(self, ap_env_json, working_dir, module_name, blocking=True, timeout=None,
+            on_stdout=None, on_stderr=None, output_lines=None, preexec_fn=None):
         env_tmp_file = os.path.join(working_dir, 'apenv.json')
         with open(env_tmp_file, 'w') as f:
             f.write(ap_env_json)
             f.write("\n")
         command = "./" + module_name
         self.log.info("Running command: {0} from repo root dir: {1}".format(command, working_dir))
-        return utils.subprocess_cmd(command, working_dir=working_dir, blocking=blocking)
+        return utils.subprocess_cmd(command, working_dir=working_dir, blocking=blocking, timeout=timeout,
+                                    on_stdout=on_stdout, on_stderr=on_stderr, output_lines=output_lines,
+                                    preexec_fn=preexec_fn)
 
 
 class SafePythonModuleRunner(object):
@@ -113,14 +155,17 @@ class SafePythonModuleRunner(object):
     def __init__(self):
         self.log = logger.get_logger("SafePythonModuleRunner")
 
-    # todo: use timeout
-    def run(self, ap_env_json, working_dir, module_name, blocking=True, timeout=None):
+    def run(self, ap_env_json, working_dir, module_name, blocking=True, timeout=None,
+            on_stdout=None, on_stderr=None, output_lines=None, preexec_fn=None):
         env_tmp_file = os.path.join(working_dir, 'apenv.json')
         with open(env_tmp_file, 'w') as f:
             f.write(ap_env_json)
-        command = "python -c \"import test; import json; import os; env=json.load(open('{1}')); import {2}; {2}.install(env=env)\"".format(ap_env_json, env_tmp_file, module_name)
+        # unbuffered so install output reaches on_stdout line by line instead of at exit
+        command = "python -u -c \"import test; import json; import os; env=json.load(open('{1}')); import {2}; {2}.install(env=env)\"".format(ap_env_json, env_tmp_file, module_name)
         self.log.info("Running python command: {0} from working_dir: {1}".format(command, working_dir))
-        return utils.subprocess_cmd(command, working_dir=working_dir, blocking=blocking)
+        return utils.subprocess_cmd(command, working_dir=working_dir, blocking=blocking, timeout=timeout,
+                                    on_stdout=on_stdout, on_stderr=on_stderr, output_lines=output_lines,
+                                    preexec_fn=preexec_fn)
 
 
 class YumRunner(object):
@@ -0,0 +1,156 @@
+#! /usr/bin/python
+import os
+import time
+import hashlib
+import threading
+from autopilot.common import utils
+from autopilot.common import exception
+from autopilot.common import logger
+
+
+class GitCache(object):
+    """
+    Local cache of bare git mirrors keyed by git url.
+    A mirror is created once with clone --mirror and brought up to date with
+    an incremental fetch (skipped if it was fetched in the last
+    fetch_interval seconds). Role working copies are local clones of the
+    mirror, which hardlink the objects instead of going over the network.
+    Least recently used mirrors are removed once the cache grows past max_bytes.
+    Mirrors that are being cloned from or fetched are never removed
+    """
+    LAST_USED_FILE = "autopilot_last_used"
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, fetch_interval=60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fetch_interval = fetch_interval
+        self.lock = threading.Lock()
+        self.evict_lock = threading.Lock()
+        self.url_locks = {}
+        self.fetched = {}
+        # mirror path -> bytes on disk. Measured when the mirror changes
+        self.sizes = {}
+        self.log = logger.get_logger("GitCache")
+        utils.mkdir(self.cache_dir)
+
+    def mirror_path(self, git_url):
+        return utils.path_join(self.cache_dir, hashlib.sha1(git_url).hexdigest() + ".git")
+
+    def clone(self, git_url, branch, dest, blocking=True):
+        """
+        Create a working copy of branch at dest from the cached mirror.
+        origin of the working copy points to git_url
+        """
+        url_lock = self._url_lock(git_url)
+        with url_lock:
+            mirror = self.update(git_url, blocking=blocking)
+            self._git("git clone --local {0} {1} -b {2}".format(mirror, dest, branch), blocking=blocking)
+        self._git("git remote set-url origin {0}".format(git_url), working_dir=dest, blocking=blocking)
+        self.evict(keep=[mirror])
+
+    def update(self, git_url, blocking=True):
+        """
+        Make sure the mirror for git_url exists and is recent. Returns its path
+        """
+        mirror = self.mirror_path(git_url)
+        if not utils.path_exists(mirror):
+            self.log.info("Creating git mirror for {0} at {1}".format(git_url, mirror))
+            self._git("git clone --mirror {0} {1}".format(git_url, mirror), blocking=blocking)
+            self.fetched[git_url] = time.time()
+            self.sizes[mirror] = self._disk_usage(mirror)
+        elif time.time() - self.fetched.get(git_url, 0) > self.fetch_interval:
+            self.log.info("Fetching updates for git mirror {0}".format(git_url))
+            self._git("git fetch --prune origin", working_dir=mirror, blocking=blocking)
+            self.fetched[git_url] = time.time()
+            self.sizes[mirror] = self._disk_usage(mirror)
+        self._touch(mirror)
+        return mirror
+
+    def evict(self, keep=[]):
+        """
+        Remove least recently used mirrors until the cache fits in max_bytes.
+        Mirrors whose url lock is held (a clone or fetch in progress) are skipped
+        """
+        with self.evict_lock:
+            mirrors = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                path = utils.path_join(self.cache_dir, name)
+                if not os.path.isdir(path):
+                    continue
+                size = self.sizes.get(path)
+                if size is None:
+                    # left by an earlier process
+                    size = self.sizes[path] = self._disk_usage(path)
+                total += size
+                mirrors.append((self._last_used(path), path, size))
+
+            with self.lock:
+                url_locks = dict((self.mirror_path(url), lock) for (url, lock) in self.url_locks.items())
+            for (last_used, path, size) in sorted(mirrors):
+                if total <= self.max_bytes:
+                    break
+                if path in keep:
+                    continue
+                url_lock = url_locks.get(path)
+                if url_lock is not None and not url_lock.acquire(False):
+                    continue
+                try:
+                    self.log.info("Evicting git mirror {0}. Size: {1}".format(path, size))
+                    utils.rmtree(path)
+                    self.sizes.pop(path, None)
+                    total -= size
+                finally:
+                    if url_lock is not None:
+                        url_lock.release()
+
+    def _url_lock(self, git_url):
+        with self.lock:
+            return self.url_locks.setdefault(git_url, threading.Lock())
+
+    def _git(self, command, working_dir=None, blocking=True):
+        (return_code, out, error) = utils.subprocess_cmd(command, working_dir=working_dir, blocking=blocking)
+        if return_code:
+            self.log.error("Git command failed: {0}. Return Code: {1}. Error: {2}".format(command, return_code, error))
+            raise exception.GitInstallProviderException("git command failed: Command: {0} Return Code: {1} Error: {2}"
+                                                        .format(command, return_code, error))
+        return out
+
+    def _touch(self, mirror):
+        with open(utils.path_join(mirror, self.LAST_USED_FILE), 'w') as f:
+            f.write(str(time.time()))
+
+    def _last_used(self, mirror):
+        path = utils.path_join(mirror, self.LAST_USED_FILE)
+        if utils.path_exists(path):
+            return os.path.getmtime(path)
+        return 0
+
+    def _disk_usage(self, path):
+        size = 0
+        for (root, dirs, files) in os.walk(path):
+            for f in files:
+                try:
+                    size += os.lstat(os.path.join(root, f)).st_size
+                except OSError:
+                    pass
+        return size
+
+
+_caches = {}
+
+
+def get_git_cache(apenv):
+    """
+    Returns the GitCache configured by GIT_CACHE_DIR or None if caching is off
+    """
+    cache_dir = apenv.get("GIT_CACHE_DIR")
+    if not cache_dir:
+        return None
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = GitCache(cache_dir,
+                         max_bytes=apenv.get("GIT_CACHE_MAX_BYTES", 2 * 1024 ** 3),
+                         fetch_interval=apenv.get("GIT_CACHE_FETCH_INTERVAL", 60))
+        _caches[cache_dir] = cache
+    return cache
@@ -4,4 +4,43 @@ import os
 import sys
 
 STATUS_DIR = "/var/lib/autopilot/stacks/"
-WORKING_DIR = "/var/data/autopilot/stacks/"
\ No newline at end of file
+WORKING_DIR = "/var/data/autopilot/stacks/"
+
+# taskpool shares. The global pool is split into a pool per domain and
+# a pool per workflow within the domain
+TASKPOOL_SIZE = 100
+DOMAIN_POOL_SIZE = 50
+WORKFLOW_POOL_SIZE = 20
+WORKFLOW_POOL_WEIGHT = 1
+
+# local git mirror cache used by the git install provider
+GIT_CACHE_DIR = "/var/cache/autopilot/git/"
+GIT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+GIT_CACHE_FETCH_INTERVAL = 60
+
+# role installs running at the same time and optional resource caps for the
+# install processes. Caps apply to each process the install starts, not to the
+# install as a whole. e.g. dict(cpu_seconds=3600, memory_bytes=2 * 1024 ** 3, nice=10)
+ROLE_INSTALL_CONCURRENCY = 4
+ROLE_INSTALL_LIMITS = None
+# seconds a role install may run before it is killed. None for no limit
+ROLE_INSTALL_TIMEOUT = None
+
+# log sinks: "console", "file" (LOG_DIR/autopilot.log) and "workflow" (LOG_DIR/workflows/<wf_id>.log)
+# files rotate at LOG_MAX_BYTES and/or every LOG_ROTATE_INTERVAL seconds, rotated
+# segments are gzip compressed when LOG_COMPRESS is set. File writes go through a
+# bounded queue drained by a writer thread when LOG_ASYNC is set
+LOG_LEVEL = "DEBUG"
+LOG_DIR = "/var/log/autopilot/"
+LOG_SINKS = ["file", "workflow"]
+LOG_MAX_BYTES = 50 * 1024 ** 2
+LOG_ROTATE_INTERVAL = None
+LOG_BACKUP_COUNT = 5
+LOG_COMPRESS = True
+LOG_ASYNC = True
+LOG_QUEUE_SIZE = 10000
+LOG_WORKFLOW_MAX_OPEN = 32
+
+# spans and metric snapshots are appended here as JSON lines when set.
+# The agent server always serves GET /metrics in the Prometheus text format
+METRICS_FILE = None
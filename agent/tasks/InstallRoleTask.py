@@ -1,7 +1,9 @@
 #! /usr/bin/python
 
+from autopilot.agent import settings
 from autopilot.common import logger
 from autopilot.common import utils
+from autopilot.common.asyncpool import taskpool
 from autopilot.common.exception import AutopilotException
 from autopilot.workflows.tasks.task import Task, TaskState
 from autopilot.agent.installers.InstallProviders import GitInstallProvider
@@ -28,23 +30,34 @@ class InstallRoleTask(Task):
         self.role_status_dir = properties.get("role_status_dir")
 
     def on_run(self, callback):
+        """
+        Installs run on the role install pool so that at most
+        ROLE_INSTALL_CONCURRENCY roles install at the same time on this agent
+        """
         self.log.info("Installing target role {0} for role_group {1}"
                       .format(self.target_role, self.target_role_group), self.wf_id)
+        install_pool = taskpool.sub_pool("role_install",
+                                         size=self.apenv.get("ROLE_INSTALL_CONCURRENCY",
+                                                             settings.ROLE_INSTALL_CONCURRENCY))
+        install_pool.spawn(self._install, args=dict(callback=callback))
 
+    def _install(self, callback):
         try:
             self.log.info("Running GitInstaller for role: {0}. Working dir: {1}"
                           .format(self.target_role, self.role_working_dir), self.wf_id)
 
             GitInstallProvider(self.apenv, self.target_role, self.target_role_group,
-                               self.stack, self.role_working_dir).run()
+                               self.stack, self.role_working_dir, wf_id=self.wf_id)\
+                .run(timeout=self.apenv.get("ROLE_INSTALL_TIMEOUT", settings.ROLE_INSTALL_TIMEOUT))
 
             self._update_current_version_file()
 
             callback(TaskState.Done, ["Task {0} done".format(self.name)], [])
 
         except Exception as ex:
+            # runs on its own greenlet so report the error through the callback
             self.log.error("InstallRole raised error", wf_id=self.wf_id, exc_info=ex)
-            raise
+            callback(TaskState.Error, [], [ex])
 
     def _update_current_version_file(self):
         version_file_path = utils.path_join(self.role_working_dir, "current")
@@ -3,7 +3,11 @@
 import gevent
 from gevent import monkey
 monkey.patch_all(subprocess=True)
+import time
+from collections import deque, OrderedDict
 import gevent.event
+from autopilot.common import metrics
+from autopilot.agent import settings
 from gevent import pool
 from gevent.queue import Queue
 from gevent.event import AsyncResult
@@ -18,8 +22,13 @@ class CallableFuture(AsyncResult):
         def successful(self):
             return self.exception is None
 
+    # progress events kept for listeners that attach late
+    progress_backlog_size = 1000
+
     def __init__(self):
         AsyncResult.__init__(self)
+        self.progress_listeners = []
+        self.progress_backlog = deque(maxlen=CallableFuture.progress_backlog_size)
 
     def __call__(self, result, exception=None):
         AsyncResult.__call__(self, CallableFuture.ValueWrapper(result=result, exception=exception))
@@ -27,6 +36,22 @@ class CallableFuture(AsyncResult):
     def on_complete(self, callback):
         self.rawlink(callback=callback)
 
+    def progress(self, event):
+        """
+        Report an intermediate event to the on_progress listeners.
+        Events are buffered until the first listener attaches
+        """
+        if not self.progress_listeners:
+            self.progress_backlog.append(event)
+        for listener in self.progress_listeners:
+            listener(event)
+
+    def on_progress(self, callback):
+        self.progress_listeners.append(callback)
+        # replay what was reported before anyone listened (e.g. during process())
+        while self.progress_backlog:
+            callback(self.progress_backlog.popleft())
+
 
 class GeventPool(object):
     """
@@ -35,6 +60,9 @@ class GeventPool(object):
     def __init__(self, size):
         self.capacity = size
         self.pool = pool.Pool(self.capacity)
+        # root of the sub pool hierarchy. Bounded by the gevent pool itself
+        self.root = SubPool(gpool=self, parent=None, name="taskpool", size=None)
+        self._dispatching = False
 
     def callable_future(self):
         return CallableFuture()
@@ -47,7 +75,57 @@ class GeventPool(object):
         Schedule func in the gevent pool. callback() once func returns
         """
         sp = GeventPool.SpawnContext(gpool=self.pool, func=func, args=args, finalcb=callback, delay=delay)
-        return sp.spawn()
+        gr = sp.spawn()
+        # a global slot frees up once this is done. Let queued sub pool work in
+        gr.rawlink(lambda g: self.dispatch())
+        return gr
+
+    def sub_pool(self, name, size=None, weight=1):
+        """
+        Returns a bounded sub pool. Sub pools queue work instead of blocking
+        and share the global capacity in proportion to their weights
+        """
+        return self.root.sub_pool(name=name, size=size, weight=weight)
+
+    def workflow_pool(self, domain, wf_id, size=None, weight=1, domain_size=None):
+        """
+        Returns the pool for a workflow nested under the pool for its domain (tenant).
+        Sizes default to DOMAIN_POOL_SIZE and WORKFLOW_POOL_SIZE in the settings
+        """
+        domain_pool = self.sub_pool(name=domain or "default", size=domain_size or settings.DOMAIN_POOL_SIZE)
+        return domain_pool.sub_pool(name=wf_id, size=size or settings.WORKFLOW_POOL_SIZE, weight=weight)
+
+    def stats(self):
+        """
+        Queue depth, wait times and running counts for the whole hierarchy
+        """
+        d = self.root.stats()
+        d.update(capacity=self.capacity, free=self.pool.free_count())
+        return d
+
+    def dispatch(self):
+        """
+        Start queued sub pool work while global slots are free
+        """
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            while self.pool.free_count() > 0:
+                item = self.root.pick()
+                if item is None:
+                    break
+                (node, gr, queued_at) = item
+                node.started(queued_at)
+                self.pool.start(gr)
+                # linked after start so the gevent pool discards the greenlet first
+                gr.rawlink(lambda g, n=node: self._finished(n))
+        finally:
+            self._dispatching = False
+
+    def _finished(self, node):
+        node.finished()
+        self.dispatch()
 
     def doyield(self, seconds=0):
         gevent.sleep(seconds=seconds)
@@ -93,5 +171,149 @@ class GeventPool(object):
                 if self.finalcb:
                     self.finalcb(None, e)
 
-# todo: size should come from settings
-taskpool = GeventPool(100)
+class SubPool(object):
+    """
+    A bounded share of the GeventPool.
+    Work that cannot start right away is queued. The GeventPool hands queued work
+    out in weighted fair order: every sibling pool with queued work has a virtual
+    finish time that advances by 1/weight per started item, and the lowest goes next
+    """
+    def __init__(self, gpool, parent, name, size=None, weight=1):
+        self.gpool = gpool
+        self.parent = parent
+        self.name = name
+        self.capacity = size
+        self.weight = float(weight)
+        self.running = 0
+        self.queue = deque()
+        self.children = OrderedDict()
+        self.vfinish = 0.0
+        self.vclock = 0.0
+        self.queue_vfinish = 0.0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # release() was called while busy. Done once the last item finishes
+        self.release_pending = False
+
+    def sub_pool(self, name, size=None, weight=1):
+        self.release_pending = False
+        child = self.children.get(name)
+        if child is None:
+            child = SubPool(gpool=self.gpool, parent=self, name=name, size=size, weight=weight)
+            child.vfinish = self.vclock
+            self.children[name] = child
+        return child
+
+    def spawn(self, func, args={}, callback=None):
+        """
+        Queue func. Returns a greenlet that starts once this pool, its parents
+        and the global pool have a free slot
+        """
+        gr = gevent.Greenlet(func, **args)
+        if callback:
+            gr.link(GeventPool.SpawnContext(gpool=None, func=func, args=args, finalcb=callback)._linkcb)
+        self.release_pending = False
+        self._attach()
+        self.queue.append((gr, time.time()))
+        self.gpool.dispatch()
+        return gr
+
+    def release(self):
+        """
+        Detach this pool from its parent once it is idle. A busy pool is
+        detached when its running work has finished. Callers are often
+        still inside that work (e.g. the callback of the last task).
+        Spawning on a released pool attaches it again
+        """
+        if self.parent is None:
+            return
+        if self.running or self.queue_depth():
+            self.release_pending = True
+            return
+        self.release_pending = False
+        if self.parent.children.get(self.name) is self:
+            self.parent.children.pop(self.name)
+        if not self.parent.children:
+            self.parent.release()
+
+    def queue_depth(self):
+        depth = len(self.queue)
+        for child in self.children.values():
+            depth += child.queue_depth()
+        return depth
+
+    def has_capacity(self):
+        return self.capacity is None or self.running < self.capacity
+
+    def pick(self):
+        """
+        Returns (pool, greenlet, queued_at) for the next item to start or None
+        """
+        if not self.has_capacity():
+            return None
+        flows = []
+        if self.queue:
+            flows.append((self.queue_vfinish, None))
+        for child in self.children.values():
+            if child.queue_depth():
+                flows.append((child.vfinish, child))
+        flows.sort(key=lambda f: f[0])
+        for (vfinish, child) in flows:
+            if child is None:
+                (gr, queued_at) = self.queue.popleft()
+                item = (self, gr, queued_at)
+                self.vclock = max(self.vclock, vfinish)
+                self.queue_vfinish = max(self.queue_vfinish, self.vclock) + 1.0
+                return item
+            item = child.pick()
+            if item is not None:
+                self.vclock = max(self.vclock, vfinish)
+                child.vfinish = max(child.vfinish, self.vclock) + 1.0 / child.weight
+                return item
+        return None
+
+    def started(self, queued_at):
+        waited = time.time() - queued_at
+        self.waits += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        metrics.registry.observe("taskpool_wait_seconds", waited)
+        node = self
+        while node is not None:
+            node.running += 1
+            node = node.parent
+
+    def finished(self):
+        node = self
+        while node is not None:
+            node.running -= 1
+            node = node.parent
+        node = self
+        while node is not None:
+            parent = node.parent
+            if node.release_pending and not node.running:
+                node.release()
+            node = parent
+
+    def stats(self):
+        return dict(name=self.name,
+                    capacity=self.capacity,
+                    weight=self.weight,
+                    running=self.running,
+                    queue_depth=self.queue_depth(),
+                    waits=self.waits,
+                    wait_total=self.wait_total,
+                    wait_max=self.wait_max,
+                    wait_avg=self.wait_total / self.waits if self.waits else 0.0,
+                    children=[c.stats() for c in self.children.values()])
+
+    def _attach(self):
+        node = self
+        while node.parent is not None:
+            if node.parent.children.get(node.name) is not node:
+                node.parent.children[node.name] = node
+            node = node.parent
+
+
+taskpool = GeventPool(settings.TASKPOOL_SIZE)
@@ -0,0 +1,95 @@
+#! /usr/bin/python
+
+import time
+import threading
+from collections import OrderedDict
+from gevent.event import AsyncResult
+
+
+class TTLCache(object):
+    """
+    Bounded LRU cache whose entries expire ttl seconds after they are stored.
+    Safe to share between greenlets/threads. Concurrent get_or_load calls
+    for the same key share one load
+    """
+    def __init__(self, maxsize=128, ttl=300, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.entries = OrderedDict()
+        # key -> AsyncResult of the load in progress
+        self.loading = {}
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] <= self.timer():
+                self.misses += 1
+                return default
+            # re-insert to mark as most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (self.timer() + self.ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def get_or_load(self, key, load):
+        """
+        Returns the cached value for key or stores and returns load().
+        Callers that miss while another caller loads key wait for that
+        load and get its value or its exception
+        """
+        marker = object()
+        value = self.get(key, default=marker)
+        if value is not marker:
+            return value
+        with self.lock:
+            pending = self.loading.get(key)
+            loader = pending is None
+            if loader:
+                pending = self.loading[key] = AsyncResult()
+        if not loader:
+            return pending.get()
+        try:
+            value = self.put(key, load())
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set(value)
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """
+        Drop every entry whose key satisfies predicate(key)
+        """
+        with self.lock:
+            for key in [k for k in self.entries.keys() if predicate(k)]:
+                self.entries.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        marker = object()
+        return self.get(key, default=marker) is not marker
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,142 @@
+#! /usr/bin/python
+
+import requests
+import requests.adapters
+from autopilot.common import logger
+from autopilot.common.exception import AgentClientException
+from autopilot.common.asyncpool import taskpool
+from autopilot.protocol.message import Message
+
+
+class AgentClient(object):
+    """
+    Controller side client for sending messages to agents.
+    Each agent host gets a keep-alive requests.Session whose connection pool
+    holds up to connections_per_host connections, so concurrent messages to
+    a host are multiplexed over reused connections instead of paying a TCP
+    and HTTP setup per message. At most max_in_flight requests run at once
+    across all hosts on a taskpool sub pool; the rest are queued
+    """
+    def __init__(self, serializer, port=9191, max_in_flight=32, connections_per_host=4,
+                 connect_timeout=5, timeout=60, name="agent_client"):
+        self.serializer = serializer
+        self.port = port
+        self.connections_per_host = connections_per_host
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.pool = taskpool.sub_pool(name, size=max_in_flight)
+        self.sessions = {}
+        self.log = logger.get_logger("AgentClient")
+
+    def send(self, host, message, timeout=None):
+        """
+        Send message to the agent on host. Returns a CallableFuture resolved
+        with the response Message or an AgentClientException. Progress
+        messages streamed by the agent are reported through future.progress
+        """
+        future = taskpool.callable_future()
+        self.pool.spawn(self._send, args=dict(host=host, message=message, future=future,
+                                              timeout=timeout or self.timeout))
+        return future
+
+    def send_all(self, messages, timeout=None):
+        """
+        Send a list of (host, message) pairs. Returns the futures in the same order
+        """
+        return [self.send(host, message, timeout=timeout) for (host, message) in messages]
+
+    def ping(self, host, timeout=None):
+        """
+        True if an agent answers on host. Any http response counts
+        """
+        try:
+            self._session(host).get(self._url(host), timeout=(self.connect_timeout, timeout or self.connect_timeout))
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    def wait_for_agents(self, hosts, timeout=300, interval=5):
+        """
+        Yield until an agent answers on every host or timeout expires.
+        Returns the hosts that did not answer
+        """
+        pending = list(hosts)
+        waited = 0
+        while pending:
+            futures = [(host, taskpool.spawn(self.ping, args=dict(host=host))) for host in pending]
+            pending = [host for (host, g) in futures if not g.get()]
+            if not pending or waited >= timeout:
+                break
+            taskpool.doyield(interval)
+            waited += interval
+        return pending
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+        self.pool.release()
+
+    def _send(self, host, message, future, timeout):
+        try:
+            response = self._session(host).post(self._url(host), data=self._dumps(message),
+                                                timeout=(self.connect_timeout, timeout), stream=True)
+        except requests.exceptions.RequestException as e:
+            self.log.error("Failed to send message {0} to {1}: {2}".format(message.identifier, host, e))
+            future(None, exception=AgentClientException("Failed to reach agent on {0}".format(host),
+                                                        host=host, inner_exception=e))
+            return
+        try:
+            if response.status_code != 200:
+                future(None, exception=AgentClientException(
+                    "Agent on {0} returned {1}".format(host, response.status_code),
+                    host=host, status_code=response.status_code))
+                return
+            result = None
+            for rm in self._read_messages(response.raw):
+                if rm.type == "progress":
+                    future.progress(rm.data)
+                else:
+                    result = rm
+            if result is None or result.type == "error":
+                future(None, exception=AgentClientException(
+                    "Agent on {0} failed to process message {1}".format(host, message.identifier),
+                    host=host, status_code=response.status_code))
+            else:
+                future(result)
+        except requests.exceptions.RequestException as e:
+            future(None, exception=AgentClientException("Failed reading response from {0}".format(host),
+                                                        host=host, inner_exception=e))
+        finally:
+            # hands the connection back to the host pool
+            response.close()
+
+    def _read_messages(self, stream):
+        while True:
+            try:
+                rm = self.serializer.load(stream)
+            except ValueError:
+                # end of stream for line based serializers
+                return
+            if type(rm) is not Message:
+                return
+            yield rm
+
+    def _dumps(self, message):
+        import StringIO
+        stream = StringIO.StringIO()
+        self.serializer.dump(stream=stream, message=message)
+        return stream.getvalue()
+
+    def _url(self, host):
+        return "http://{0}:{1}".format(host, self.port)
+
+    def _session(self, host):
+        session = self.sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.connections_per_host,
+                                                    pool_block=True)
+            session.mount("http://", adapter)
+            self.sessions[host] = session
+        return session
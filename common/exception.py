@@ -27,6 +27,17 @@ class InvalidTargetRoleGroup(AgentException):
         AgentException.__init__(self, msg, inner_exception=inner_exception)
 
 
+class AgentClientException(AgentException):
+    """
+    Raised when a message to a remote agent fails. status_code is None when
+    no http response was received
+    """
+    def __init__(self, msg, host=None, status_code=None, inner_exception=None):
+        AgentException.__init__(self, msg, inner_exception=inner_exception)
+        self.host = host
+        self.status_code = status_code
+
+
 class WorkflowException(AutopilotException):
     """
     Base class for workflow related exceptions
@@ -71,6 +82,16 @@ class AWSPropogationException(AWSOperationException):
     def __init__(self, msg, inner_exception=None, instances=None):
         AWSOperationException.__init__(self, msg, inner_exception=inner_exception, instances=instances)
 
+
+class AWSWaiterTimeout(AWSOperationException):
+    """
+    Raised when AWS resources do not reach the awaited condition in time.
+    pending lists the ids that were not ready
+    """
+    def __init__(self, msg, inner_exception=None, instances=None, pending=None):
+        AWSOperationException.__init__(self, msg, inner_exception=inner_exception, instances=instances)
+        self.pending = pending or []
+
 class SSHError(AutopilotException):
     """Base class for all SSH related errors"""
 
@@ -161,6 +182,13 @@ class ValidationError(AutopilotException):
     """Base class for validation related errors"""
 
 
+class SpecValidationError(ValidationError):
+    """Raised when a spec does not match its schema. errors lists every problem"""
+    def __init__(self, errors):
+        ValidationError.__init__(self, "Invalid spec: {0}".format("; ".join(errors)), errors=errors)
+        self.errors = errors
+
+
 class ClusterReceiptError(AutopilotException):
     """Raised when creating/loading a cluster receipt fails"""
 
@@ -1,7 +1,14 @@
 #! /usr/bin python
 
+import os
+import gzip
+import json
+import time
+import shutil
 import logging
+import threading
 import logging.handlers
+from collections import deque, OrderedDict
 
 
 class NullHandler(logging.Handler):
@@ -32,30 +39,323 @@ class ApLogger(object):
         self.logger.critical(msg, exc_info=exc_info)
 
 
+class StructuredMessage(object):
+    """
+    Log message with fields. The text is only built when a handler formats
+    the record: msg is a format string filled from the fields
+    """
+    __slots__ = ("wf_id", "msg", "fields")
+
+    def __init__(self, wf_id, msg, fields=None):
+        self.wf_id = wf_id
+        self.msg = msg
+        self.fields = fields
+
+    def text(self):
+        if self.fields:
+            try:
+                return self.msg.format(**self.fields)
+            except (KeyError, IndexError, ValueError):
+                return self.msg
+        return self.msg
+
+    def to_dict(self):
+        d = dict(wf_id=self.wf_id, msg=self.text())
+        if self.fields:
+            d.update(self.fields)
+        return d
+
+    def __str__(self):
+        return str(self.to_dict())
+
+
 class WfLogger(object):
     """
     Workflow Logger
+    Extra keyword tags (e.g. role, stream) are structured fields of the record
+    and can be referenced from msg, e.g. info("begin group {groupid}", wf_id, groupid=gid).
+    Nothing is built when the level is disabled
     """
     def __init__(self, pylogger):
         self.logger = pylogger
 
-    def debug(self, msg, wf_id=None, exc_info=False):
-        self.logger.debug(self._format_msg(wf_id, msg), exc_info=exc_info)
+    def debug(self, msg, wf_id=None, exc_info=False, **tags):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(self._format_msg(wf_id, msg, tags), exc_info=exc_info)
+
+    def info(self, msg, wf_id, **tags):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(self._format_msg(wf_id, msg, tags))
+
+    def warning(self, msg, wf_id=None, exc_info=False, **tags):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(self._format_msg(wf_id, msg, tags), exc_info=exc_info)
+
+    def error(self, msg, wf_id=None, exc_info=True, **tags):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(self._format_msg(wf_id, msg, tags), exc_info=exc_info)
+
+    def critical(self, msg, wf_id=None, exc_info=True, **tags):
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            self.logger.critical(self._format_msg(wf_id, msg, tags), exc_info=exc_info)
+
+    def _format_msg(self, wf_id, msg, tags=None):
+        return StructuredMessage(wf_id, msg, tags)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per record. Fields of structured messages become keys
+    """
+    def format(self, record):
+        d = dict(ts=record.created, level=record.levelname, logger=record.name)
+        if isinstance(record.msg, StructuredMessage):
+            d.update(record.msg.to_dict())
+        else:
+            d.update(msg=record.getMessage())
+        if record.exc_info:
+            d.update(exc=self.formatException(record.exc_info))
+        return json.dumps(d, default=str)
+
+
+def _native_thread():
+    """
+    Returns (start_new_thread, sleep) that are not patched by gevent so the
+    log writer is a real OS thread and disk writes never run on the hub
+    """
+    try:
+        from gevent import monkey
+        return monkey.get_original("thread", "start_new_thread"), monkey.get_original("time", "sleep")
+    except ImportError:
+        import thread
+        return thread.start_new_thread, time.sleep
+
+
+class NativeRLock(object):
+    """
+    Reentrant lock on an unpatched thread lock. Owners are greenlets so
+    greenlets on the hub do not share ownership
+    """
+    def __init__(self, allocate_lock, get_owner):
+        self._block = allocate_lock()
+        self._get_owner = get_owner
+        self._owner = None
+        self._count = 0
+
+    def acquire(self, blocking=1):
+        me = self._get_owner()
+        if self._owner is me:
+            self._count += 1
+            return True
+        if not self._block.acquire(blocking):
+            return False
+        self._owner = me
+        self._count = 1
+        return True
+
+    def release(self):
+        self._count -= 1
+        if not self._count:
+            self._owner = None
+            self._block.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *args):
+        self.release()
+
 
-    def info(self, msg, wf_id):
-        self.logger.info(self._format_msg(wf_id, msg))
+def _native_rlock():
+    """
+    Lock for handlers the log writer thread drives. gevent's locks park on
+    the hub, which the writer thread cannot do
+    """
+    try:
+        from gevent import monkey
+        from greenlet import getcurrent
+        return NativeRLock(monkey.get_original("thread", "allocate_lock"), getcurrent)
+    except ImportError:
+        return threading.RLock()
+
+
+class AsyncQueueHandler(logging.Handler):
+    """
+    Hands records to a bounded queue. A background writer thread passes them
+    to the target handler, so callers never wait on disk.
+    Records are dropped (and counted) when the queue is full
+    """
+    def __init__(self, target, maxsize=10000, poll_interval=0.05):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.target.lock = _native_rlock()
+        self.maxsize = maxsize
+        self.poll_interval = poll_interval
+        # deque append/popleft are atomic so no lock is shared with the writer
+        self.records = deque()
+        self.dropped = 0
+        self.closing = False
+        self.stopped = False
+        start_new_thread, self._sleep = _native_thread()
+        start_new_thread(self._drain, ())
+
+    def emit(self, record):
+        if len(self.records) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.records.append(record)
 
-    def warning(self, msg, wf_id=None, exc_info=False):
-        self.logger.warning(self._format_msg(wf_id, msg), exc_info=exc_info)
+    def _drain(self):
+        while True:
+            try:
+                record = self.records.popleft()
+            except IndexError:
+                if self.closing:
+                    break
+                self._sleep(self.poll_interval)
+                continue
+            try:
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
+        self.target.flush()
+        self.stopped = True
 
-    def error(self, msg, wf_id=None, exc_info=True):
-        self.logger.error(self._format_msg(wf_id, msg), exc_info=exc_info)
+    def flush(self):
+        self.target.flush()
 
-    def critical(self, msg, wf_id=None, exc_info=True):
-        self.logger.critical(self._format_msg(wf_id, msg), exc_info=exc_info)
+    def close(self, timeout=5):
+        self.closing = True
+        waited = 0
+        while not self.stopped and waited < timeout:
+            self._sleep(self.poll_interval)
+            waited += self.poll_interval
+        self.target.close()
+        logging.Handler.close(self)
 
-    def _format_msg(self, wf_id, msg):
-        return dict(wf_id=wf_id, msg=msg)
+
+class RotatingSink(logging.handlers.BaseRotatingHandler):
+    """
+    File sink rotated by size (max_bytes) and/or age (interval seconds).
+    Rotated segments are kept as filename.1 .. filename.backup_count,
+    gzip compressed when compress is set
+    """
+    def __init__(self, filename, max_bytes=0, interval=None, backup_count=5, compress=True, timer=time.time):
+        logging.handlers.BaseRotatingHandler.__init__(self, filename, "a", None, True)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.timer = timer
+        self.rollover_at = self.timer() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at and self.timer() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.seek(0, 2)
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if self.backup_count > 0:
+            suffix = ".gz" if self.compress else ""
+            for i in range(self.backup_count - 1, 0, -1):
+                src = "{0}.{1}{2}".format(self.baseFilename, i, suffix)
+                if os.path.exists(src):
+                    os.rename(src, "{0}.{1}{2}".format(self.baseFilename, i + 1, suffix))
+            if os.path.exists(self.baseFilename):
+                self._rotate(self.baseFilename, "{0}.1{1}".format(self.baseFilename, suffix))
+        elif os.path.exists(self.baseFilename):
+            os.remove(self.baseFilename)
+        if self.interval:
+            self.rollover_at = self.timer() + self.interval
+
+    def _rotate(self, source, dest):
+        if not self.compress:
+            os.rename(source, dest)
+            return
+        with open(source, "rb") as fin:
+            with gzip.open(dest, "wb") as fout:
+                shutil.copyfileobj(fin, fout)
+        os.remove(source)
+
+
+class WorkflowFileHandler(logging.Handler):
+    """
+    Writes each workflow's records to log_dir/<wf_id>.log.
+    Records without a wf_id are ignored. At most max_open files are
+    kept open, the least recently written one is closed first
+    """
+    def __init__(self, log_dir, max_open=32, **sink_args):
+        logging.Handler.__init__(self)
+        self.log_dir = log_dir
+        self.max_open = max_open
+        self.sink_args = sink_args
+        self.sinks = OrderedDict()
+
+    def emit(self, record):
+        wf_id = record.msg.wf_id if isinstance(record.msg, StructuredMessage) else None
+        if not wf_id:
+            return
+        sink = self.sinks.pop(wf_id, None)
+        if sink is None:
+            sink = RotatingSink(os.path.join(self.log_dir, "{0}.log".format(wf_id)), **self.sink_args)
+            # created on the writer thread when the handler is async
+            sink.lock = _native_rlock()
+            sink.setFormatter(self.formatter)
+            if len(self.sinks) >= self.max_open:
+                self.sinks.popitem(last=False)[1].close()
+        self.sinks[wf_id] = sink
+        sink.handle(record)
+
+    def flush(self):
+        for sink in self.sinks.values():
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
+        self.sinks.clear()
+        logging.Handler.close(self)
+
+
+class OutputTail(object):
+    """
+    Ring buffer with the last max_lines lines of process output
+    """
+    def __init__(self, max_lines=200):
+        self.lines = deque(maxlen=max_lines)
+
+    def append(self, line):
+        self.lines.append(line)
+
+    def text(self):
+        return "\n".join(self.lines)
+
+
+class OutputStreamLogger(object):
+    """
+    Line callback for process output. Each line goes to the workflow logger
+    as it arrives, tagged with wf_id, role and stream, and into the shared tail
+    """
+    def __init__(self, wflogger, wf_id, role, stream, tail=None):
+        self.wflogger = wflogger
+        self.wf_id = wf_id
+        self.role = role
+        self.stream = stream
+        self.tail = tail
+
+    def __call__(self, line):
+        line = line.rstrip("\n")
+        if self.tail is not None:
+            self.tail.append("[{0}] {1}".format(self.stream, line))
+        # output is data, never a format string
+        self.wflogger.info(msg="{line}", wf_id=self.wf_id, role=self.role, stream=self.stream, line=line)
 
 
 def get_logger(name=None):
@@ -79,20 +379,81 @@ def get_test_logger():
     testlogger.addHandler(ch)
     return  testlogger
 
-def _setup_parent_logger(console=False):
-    logger = get_logger()
-    logger.setLevel(logging.DEBUG)
-    if console:
-        ch = logging.StreamHandler()
-    else:
-        ch = logging.FileHandler('/tmp/autopilot.log')
-    ch.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s')
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
-    return logger
+# handlers installed by configure
+_sinks = []
+
+
+def configure(settings=None):
+    """
+    Installs the log sinks on the root logger from settings, a dict, ApEnv
+    or settings module (see agent/settings.py for the LOG_* keys).
+    Calling it again replaces the sinks installed before.
+    On import the sinks are configured from the agent settings
+    """
+    settings = settings or {}
+    if not hasattr(settings, "get"):
+        settings = vars(settings)
+    root = get_logger()
+    for handler in _sinks:
+        root.removeHandler(handler)
+        handler.close()
+    del _sinks[:]
+
+    level = settings.get("LOG_LEVEL", "DEBUG")
+    root.setLevel(getattr(logging, level) if isinstance(level, basestring) else level)
+    log_dir = settings.get("LOG_DIR", "/var/log/autopilot/")
+    sink_args = dict(max_bytes=settings.get("LOG_MAX_BYTES", 50 * 1024 ** 2),
+                     interval=settings.get("LOG_ROTATE_INTERVAL"),
+                     backup_count=settings.get("LOG_BACKUP_COUNT", 5),
+                     compress=settings.get("LOG_COMPRESS", True))
+    for name in settings.get("LOG_SINKS", ["file"]):
+        if name == "console":
+            sink = logging.StreamHandler()
+            sink.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+        elif name == "file":
+            _makedirs(log_dir)
+            sink = RotatingSink(os.path.join(log_dir, "autopilot.log"), **sink_args)
+            sink.setFormatter(JsonLinesFormatter())
+        elif name == "workflow":
+            wf_dir = os.path.join(log_dir, "workflows")
+            _makedirs(wf_dir)
+            sink = WorkflowFileHandler(wf_dir, max_open=settings.get("LOG_WORKFLOW_MAX_OPEN", 32), **sink_args)
+            sink.setFormatter(JsonLinesFormatter())
+        else:
+            raise ValueError("Unknown log sink: {0}".format(name))
+        if name != "console" and settings.get("LOG_ASYNC", True):
+            sink = AsyncQueueHandler(sink, maxsize=settings.get("LOG_QUEUE_SIZE", 10000))
+        root.addHandler(sink)
+        _sinks.append(sink)
+    return root
+
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+# LOG_DIR is used when LOG_DIR in the agent settings cannot be written (e.g. a developer machine)
+FALLBACK_LOG_DIR = "/tmp/autopilot/"
+
+
+def _configure_default():
+    """
+    Sinks from the agent settings until configure is called
+    """
+    from autopilot.agent import settings
+    settings = dict((k, v) for (k, v) in vars(settings).items() if k.startswith("LOG_"))
+    try:
+        _makedirs(settings["LOG_DIR"])
+        writable = os.access(settings["LOG_DIR"], os.W_OK)
+    except OSError:
+        writable = False
+    if not writable:
+        settings["LOG_DIR"] = FALLBACK_LOG_DIR
+    configure(settings)
+
 
-_setup_parent_logger()
+_configure_default()
 log = ApLogger(get_logger("Autopilot"))
 wflog = get_workflow_logger("Workflow")
 aglog = ApLogger(get_logger("Agent"))
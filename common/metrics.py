@@ -0,0 +1,289 @@
+#! /usr/bin/python
+
+import json
+import time
+from collections import deque, OrderedDict
+
+# upper bounds in seconds. Deploy steps range from milliseconds to tens of minutes
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600)
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return dict(value=self.value)
+
+
+class Histogram(object):
+    """
+    Count, sum, min, max and cumulative bucket counts of observed values
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for (bound, count) in zip(self.buckets, self.bucket_counts):
+            total += count
+            yield (bound, total)
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.sum, min=self.min, max=self.max,
+                    buckets=[[bound, count] for (bound, count) in self.cumulative()])
+
+
+class Span(object):
+    """
+    A timed unit of work: a task run or rollback, a group or a workflow.
+    finish() observes the duration in the <name>_seconds histogram and
+    records the span in the trace of its workflow
+    """
+    def __init__(self, registry, name, wf_id=None, **labels):
+        self.registry = registry
+        self.name = name
+        self.wf_id = wf_id
+        self.labels = labels
+        self.start = registry.timer()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end or self.registry.timer()) - self.start
+
+    def finish(self, **labels):
+        if self.end is not None:
+            return self
+        self.end = self.registry.timer()
+        self.labels.update(labels)
+        self.registry.observe("{0}_seconds".format(self.name), self.duration, **self.labels)
+        self.registry.record_span(self)
+        return self
+
+    def serialize(self):
+        return dict(name=self.name, wf_id=self.wf_id, start=self.start, end=self.end, duration=self.duration, labels=self.labels)
+
+
+class MetricsSink(object):
+    """
+    Export target. record_span is called for every finished span and
+    export with a snapshot of all metrics when the registry is exported
+    """
+    def record_span(self, span):
+        pass
+
+    def export(self, snapshot):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySink(MetricsSink):
+    """
+    Keeps the last max_spans spans and the last snapshot in memory
+    """
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+        self.snapshot = None
+
+    def record_span(self, span):
+        self.spans.append(span.serialize())
+
+    def export(self, snapshot):
+        self.snapshot = snapshot
+
+
+class FileSink(MetricsSink):
+    """
+    Appends spans and snapshots to path as JSON lines
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stream = None
+
+    def record_span(self, span):
+        self._write(dict(type="span", span=span.serialize()))
+
+    def export(self, snapshot):
+        self._write(dict(type="snapshot", ts=time.time(), metrics=snapshot))
+        self.stream.flush()
+
+    def _write(self, d):
+        if self.stream is None:
+            self.stream = open(self.path, "a")
+        self.stream.write(json.dumps(d, default=str))
+        self.stream.write("\n")
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+
+class MetricsRegistry(object):
+    """
+    In process registry of counters, histograms and spans.
+    Metrics are keyed by name and labels. Spans of the last max_traces
+    workflows are kept for trace(wf_id)
+    """
+    def __init__(self, max_traces=64, max_spans_per_trace=5000, timer=time.time):
+        self.timer = timer
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self.traces = OrderedDict()
+        self.sinks = []
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = Counter()
+        counter.inc(amount)
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def span(self, name, wf_id=None, **labels):
+        """
+        Returns a started Span. Call finish() on it when the work is done
+        """
+        return Span(self, name, wf_id=wf_id, **labels)
+
+    def record_span(self, span):
+        if span.wf_id:
+            trace = self.traces.pop(span.wf_id, None)
+            if trace is None:
+                trace = deque(maxlen=self.max_spans_per_trace)
+                while len(self.traces) >= self.max_traces:
+                    self.traces.popitem(last=False)
+            trace.append(span)
+            self.traces[span.wf_id] = trace
+        for sink in self.sinks:
+            sink.record_span(span)
+
+    def trace(self, wf_id):
+        """
+        Finished spans of a workflow in the order they finished
+        """
+        return [span.serialize() for span in self.traces.get(wf_id, [])]
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+        sink.close()
+
+    def snapshot(self):
+        return dict(counters=[dict(name=name, labels=dict(labels), **c.snapshot())
+                              for ((name, labels), c) in self.counters.items()],
+                    histograms=[dict(name=name, labels=dict(labels), **h.snapshot())
+                                for ((name, labels), h) in self.histograms.items()])
+
+    def export(self):
+        """
+        Push a snapshot to all sinks
+        """
+        if self.sinks:
+            snapshot = self.snapshot()
+            for sink in self.sinks:
+                sink.export(snapshot)
+
+    def clear(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.traces.clear()
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+
+def to_prometheus_text(metrics_registry, prefix="autopilot_"):
+    """
+    Prometheus text exposition format (version 0.0.4) of the registry
+    """
+    lines = []
+    typed = set()
+    # all samples of a metric have to be listed together
+    for ((name, labels), counter) in sorted(metrics_registry.counters.items(), key=lambda kv: kv[0]):
+        name = prefix + name
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {0} counter".format(name))
+        lines.append("{0}{1} {2}".format(name, _labels(labels), counter.value))
+    for ((name, labels), histogram) in sorted(metrics_registry.histograms.items(), key=lambda kv: kv[0]):
+        name = prefix + name
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {0} histogram".format(name))
+        for (bound, count) in histogram.cumulative():
+            lines.append("{0}_bucket{1} {2}".format(name, _labels(labels, le=repr(float(bound))), count))
+        lines.append("{0}_bucket{1} {2}".format(name, _labels(labels, le="+Inf"), histogram.count))
+        lines.append("{0}_sum{1} {2}".format(name, _labels(labels), repr(histogram.sum)))
+        lines.append("{0}_count{1} {2}".format(name, _labels(labels), histogram.count))
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(k, _escape(v)) for (k, v) in items) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def configure(settings=None):
+    """
+    Adds the sinks from settings (a dict, ApEnv or settings module) to the
+    registry. METRICS_FILE appends spans and snapshots to a file
+    """
+    settings = settings or {}
+    if not hasattr(settings, "get"):
+        settings = vars(settings)
+    path = settings.get("METRICS_FILE")
+    if path:
+        registry.add_sink(FileSink(path))
+    return registry
+
+
+def _configure_default():
+    """
+    Sinks from the agent settings, like the log sinks
+    """
+    from autopilot.agent import settings
+    configure(settings)
+
+
+registry = MetricsRegistry()
+_configure_default()
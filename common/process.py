@@ -0,0 +1,147 @@
+#! /usr/bin/python
+
+import os
+import signal
+import resource
+import subprocess
+from collections import deque
+import gevent
+from autopilot.common.asyncpool import taskpool
+
+# return code reported when a process was killed because it timed out
+TIMEOUT_RETURN_CODE = -9999
+
+
+class ProcessResult(object):
+    def __init__(self, return_code, out, error, timed_out=False):
+        self.return_code = return_code
+        self.out = out
+        self.error = error
+        self.timed_out = timed_out
+
+    def as_tuple(self):
+        return (self.return_code, self.out, self.error)
+
+
+class ProcessRunner(object):
+    """
+    Runs a shell command without blocking the gevent hub.
+    stdout and stderr are read line by line as they are produced and passed
+    to on_stdout/on_stderr. The future returned by start() is resolved with a
+    ProcessResult as soon as the process exits and its output is read. If
+    timeout expires the process group gets SIGTERM and, after kill_grace
+    seconds, SIGKILL if anything in it still runs or holds the output open.
+    output_lines bounds how many of the last lines of each stream are kept
+    for the result (None keeps everything)
+    """
+    def __init__(self, command, working_dir=None, timeout=None, on_stdout=None, on_stderr=None,
+                 kill_grace=5, env=None, preexec_fn=None, output_lines=None):
+        self.command = command
+        self.working_dir = working_dir
+        self.timeout = timeout
+        self.on_stdout = on_stdout
+        self.on_stderr = on_stderr
+        self.kill_grace = kill_grace
+        self.env = env
+        self.preexec_fn = preexec_fn
+        self.output_lines = output_lines
+        self.process = None
+        self.readers = []
+        self.timed_out = False
+        self.future = taskpool.callable_future()
+
+    def start(self):
+        def _preexec():
+            # own process group so the whole shell pipeline can be signalled
+            os.setsid()
+            if self.preexec_fn:
+                self.preexec_fn()
+
+        try:
+            self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            shell=True, cwd=self.working_dir, env=self.env,
+                                            preexec_fn=_preexec, close_fds=True)
+        except Exception as ex:
+            self.future(None, exception=ex)
+            return self.future
+        gevent.spawn(self._run)
+        return self.future
+
+    def _run(self):
+        out = deque(maxlen=self.output_lines)
+        error = deque(maxlen=self.output_lines)
+        self.readers = [gevent.spawn(self._read, self.process.stdout, out, self.on_stdout),
+                        gevent.spawn(self._read, self.process.stderr, error, self.on_stderr)]
+        timer = gevent.spawn_later(self.timeout, self._expire) if self.timeout else None
+        try:
+            return_code = self.process.wait()
+            # children of the shell can hold the pipes after it exits. The timer still applies
+            gevent.joinall(self.readers)
+        finally:
+            if timer:
+                timer.kill()
+        error = "".join(error)
+        if self.timed_out:
+            error += "Process terminated since it timed out after {0} seconds".format(self.timeout)
+            return_code = TIMEOUT_RETURN_CODE
+        self.future(ProcessResult(return_code, "".join(out), error, timed_out=self.timed_out))
+
+    def _read(self, stream, lines, callback):
+        try:
+            for line in iter(stream.readline, ""):
+                lines.append(line)
+                if callback:
+                    try:
+                        callback(line)
+                    except Exception:
+                        # a failing listener must not stall the pipe
+                        pass
+        finally:
+            stream.close()
+
+    def _expire(self):
+        self.timed_out = True
+        self._signal(signal.SIGTERM)
+        gevent.sleep(self.kill_grace)
+        # the shell can be gone while a child that ignores SIGTERM holds the pipes
+        if self.process.poll() is None or not all(r.ready() for r in self.readers):
+            self._signal(signal.SIGKILL)
+            # a process that left the group can keep the pipes open. Stop reading
+            gevent.joinall(self.readers, timeout=self.kill_grace)
+            gevent.killall(self.readers)
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except OSError:
+            # already gone
+            pass
+
+
+def limits_preexec(cpu_seconds=None, memory_bytes=None, nice=None):
+    """
+    Returns a preexec_fn that applies resource limits to the child process
+    or None if no limit is set. The limits are per process: processes it
+    starts inherit them but each gets its own cpu_seconds and memory_bytes
+    """
+    if not (cpu_seconds or memory_bytes or nice):
+        return None
+
+    def _apply():
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+        if memory_bytes:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        if nice:
+            os.nice(nice)
+    return _apply
+
+
+def run_async(command, working_dir=None, timeout=None, on_stdout=None, on_stderr=None,
+              kill_grace=5, env=None, preexec_fn=None, output_lines=None):
+    """
+    Start command and return a CallableFuture resolved with a ProcessResult
+    """
+    return ProcessRunner(command, working_dir=working_dir, timeout=timeout, on_stdout=on_stdout,
+                         on_stderr=on_stderr, kill_grace=kill_grace, env=env,
+                         preexec_fn=preexec_fn, output_lines=output_lines).start()
@@ -2,22 +2,82 @@
 
 from gevent import pywsgi
 from autopilot.common import logger
+from autopilot.common import metrics
 from autopilot.common.asyncpool import taskpool
 from autopilot.protocol.message import Message
 
+# bytes buffered before a chunk is pushed to the client
+CHUNK_SIZE = 64 * 1024
+
+
+class ResponseWriter(object):
+    """
+    File like object handed to the serializer. Output is pushed to the
+    response queue in chunk_size pieces as it is produced instead of being
+    buffered whole. A response that fits in one chunk is sent with a
+    Content-Length, larger ones go out with chunked transfer encoding
+    """
+    def __init__(self, queue, start_response, chunk_size=CHUNK_SIZE):
+        self.queue = queue
+        self.start_response = start_response
+        self.chunk_size = chunk_size
+        self.status = '200 OK'
+        self.content_type = None
+        self.started = False
+        self.closed = False
+        self.buffer = []
+        self.buffered = 0
+
+    def start(self, status=None, content_length=None):
+        if self.started:
+            return
+        self.started = True
+        headers = []
+        if content_length is not None:
+            headers.append(('Content-Length', str(content_length)))
+        if self.content_type:
+            headers.append(('Content-Type', self.content_type))
+        self.start_response(status or self.status, headers)
+
+    def write(self, data):
+        if not data:
+            return
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.start()
+        if self.buffered:
+            self.queue.put(item="".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.started:
+            self.start(content_length=self.buffered)
+        self.flush()
+        self.queue.put(item=StopIteration)
+
 
 class Server(object):
     """
     Server interface
+    GET /metrics returns the metrics registry in the Prometheus text format
     """
-    def __init__(self, serializer, handler_resolver, settings={}):
+    def __init__(self, serializer, handler_resolver, settings={}, metrics_registry=None):
         self.handler_resolver = handler_resolver
         self.serializer = serializer
         self.host = settings.get("host", "localhost")
         self.port = settings.get("port", 9191)
         self.running = False
         self.gserver = Server.GeventServer(serializer=self.serializer,
-                                           handler_resolver=self.handler_resolver)
+                                           handler_resolver=self.handler_resolver,
+                                           metrics_registry=metrics_registry or metrics.registry)
 
     def start(self):
         if self.running:
@@ -30,10 +90,17 @@ class Server(object):
         self.running = False
 
     class GeventServer(object):
-        def __init__(self, serializer, handler_resolver):
+        """
+        A request message with the header "stream_progress" set gets a
+        streamed response. Every progress event the handler reports is sent
+        as a "progress" message as soon as it happens and the final response
+        message comes last. Messages are separated by serializer.separator
+        """
+        def __init__(self, serializer, handler_resolver, metrics_registry=None):
             self.log = logger.get_logger("GeventServer")
             self.serializer = serializer
             self.handler_resolver = handler_resolver
+            self.metrics_registry = metrics_registry or metrics.registry
             self.instance = None
 
         def start(self, host, port):
@@ -49,42 +116,55 @@ class Server(object):
         def handle_request(self, env, start_response):
             self.log.info("GEventServer received raw request on pywsgi handler")
             response_future = taskpool.new_queue()
+            writer = ResponseWriter(queue=response_future, start_response=start_response)
+            if env.get("REQUEST_METHOD") == "GET" and env.get("PATH_INFO") == "/metrics":
+                writer.content_type = "text/plain; version=0.0.4"
+                writer.write(metrics.to_prometheus_text(self.metrics_registry))
+                writer.close()
+                return response_future
+
+            def write_progress(event):
+                self.serializer.dump(stream=writer, message=Message(type="progress", data=event))
+                writer.write(self.serializer.separator)
+                # progress is useless if it waits for the chunk to fill up
+                writer.flush()
 
             def finish_response(handler_future):
-                import StringIO
-                stream = StringIO.StringIO()
                 message = handler_future.value
                 if handler_future.exception:
                     erx = handler_future.exception
                     self.log.error(msg="Response message contains an exception. {0}".format(erx.message),
                                 exc_info=erx)
-                    start_response('500 Internal Server Error', [])
+                    if writer.started:
+                        # status is already out. Report the error in the stream
+                        self.serializer.dump(stream=writer, message=Message(type="error", data=str(erx)))
+                    else:
+                        writer.start(status='500 Internal Server Error')
                 else:
-                    start_response('200 OK', [])
                     self.log.info("Finishing response for message id:{0} and type: {1} ".format(message.identifier, message.type))
-                    self.serializer.dump(stream=stream, message=message)
-                    stream.pos = 0
-                    response_future.put(item=stream.readline())
-
-                response_future.put(item=StopIteration)
+                    self.serializer.dump(stream=writer, message=message)
+                writer.close()
 
             # try to deserialize the message.
             # If it fails we throw a bad request
             request_message = self.serializer.load(env['wsgi.input'])
             if type(request_message) is not Message:
-                start_response('400 Bad Request', [])
+                writer.start(status='400 Bad Request')
                 self.log.error(msg="Failed to deserialize request message. Bailing out")
-                response_future.put(item=StopIteration)
+                writer.close()
             else:
                 try:
+                    stream_progress = (request_message.headers or {}).get("stream_progress")
                     # execute handler
                     process_future = self.handler_resolver(request_message.type).process(message=request_message)
+                    if stream_progress:
+                        process_future.on_progress(callback=write_progress)
                     process_future.on_complete(callback=finish_response)
                 except Exception as ex:
-                    start_response('500 Internal Server error', [])
+                    writer.start(status='500 Internal Server error')
                     self.log.error(msg="Unhandled exception when processing message. Message id: {0}. Message type: {1}. Exception: {2}"
                                    .format(request_message.identifier, request_message.type, ex.message),
                                 exc_info=ex)
-                    response_future.put(item=StopIteration)
+                    writer.close()
 
-            return response_future
\ No newline at end of file
+            return response_future
@@ -5,6 +5,7 @@
 import os
 import shutil
 from autopilot.common.asyncpool import taskpool
+from autopilot.common import process
 
 import re
 import sys
@@ -23,44 +24,36 @@ from datetime import datetime
 import iptools
 import iso8601
 import decorator
-import subprocess
 from autopilot.common.logger import log
 from autopilot.common import exception
 
 
-def subprocess_cmd(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                   working_dir=None, blocking=True, max_tries=12, interval=5):
+def subprocess_cmd(command, working_dir=None, blocking=True, timeout=None,
+                   on_stdout=None, on_stderr=None, preexec_fn=None, output_lines=None):
     """
-    Launches a process using subprocess module
-    if blocking is False then polls for process status via gevent yield
+    Launches a shell command and returns (return_code, out, error)
+    The process runs on the gevent hub so only the calling greenlet waits.
+    Output is streamed line by line to on_stdout/on_stderr. If timeout
+    expires the process is terminated (then killed) and the return code is
+    process.TIMEOUT_RETURN_CODE. output_lines limits the returned output to
+    the last lines of each stream. blocking is kept for existing callers;
+    both modes yield to other greenlets while waiting
     """
-    def _inner_async_poll_process_completion(process, max_tries=30, interval=2):
-        ret_code = process.poll()
-        tries = 1
-        while ret_code is None and tries < max_tries:
-            taskpool.doyield(interval)
-            ret_code = process.poll()
-            tries += 1
+    return process.run_async(command, working_dir=working_dir, timeout=timeout,
+                             on_stdout=on_stdout, on_stderr=on_stderr, preexec_fn=preexec_fn,
+                             output_lines=output_lines).get().as_tuple()
 
-        if ret_code is None:
-            try:
-                # timeout terminate the process
-                process.terminate()
-            except Exception as ex:
-                pass
 
-            return (-9999, None, "Install process terminated since we timed out")
-
-        # we either succeeded or failed but the process did terminate gracefully
-        (out, error) = process.communicate()
-        return (ret_code, out, error)
-
-    process = subprocess.Popen(command, stdout=stdout, stderr=stderr, shell=True, cwd=working_dir)
-    if not blocking:
-        return _inner_async_poll_process_completion(process, max_tries=max_tries, interval=interval)
-    (out, error) = process.communicate()
-    retcode = process.wait()
-    return (retcode, out, error)
+def backoff_delays(initial=1, maximum=30, factor=2, jitter=0.5):
+    """
+    Generates exponentially growing delays (in seconds) capped at maximum.
+    Each delay is reduced by a random fraction of up to jitter so that
+    concurrent pollers do not hit an API in lock step
+    """
+    delay = initial
+    while True:
+        yield delay * (1 - random.random() * jitter)
+        delay = min(maximum, delay * factor)
 
 
 def ipy_shell(local_ns=None):
@@ -22,21 +22,13 @@ class AwsInfProvisionResponseContext(AWSInfResponseContext):
     """
     Response Context object to track AWS instance provisioning requests
     """
-    def __init__(self, spec, reservation=None):
+    def __init__(self, spec, reservation=None, ec2_conn=None):
         AWSInfResponseContext.__init__(self, spec=spec)
         self.reservation = reservation
+        self.ec2_conn = ec2_conn
         self.log = logger.get_logger("AwsInfProvisionResponseContext")
 
-    def all_instances_in_state(self, state="running"):
-        for instance in self.reservation.instances:
-            instance.update()
-            # if any instance is pending return True
-            self.log.debug("Instance {0} in state {1}".format(instance.id, instance.state))
-            if instance.state != state:
-                return False
-        return True
-
-    def close_on_instances_ready(self, timeout=180, interval=10):
+    def close_on_instances_ready(self, timeout=180, interval=2):
         """
         Close when all instances are running
         """
@@ -50,21 +42,20 @@ class AwsInfProvisionResponseContext(AWSInfResponseContext):
             self.close(new_errors=[exception.AWSInstanceProvisionTimeout(self.reservation.instances)])
             return False
 
-    def yield_until_instances_in_state(self, state="running", timeout=180, interval=10):
+    def yield_until_instances_in_state(self, state="running", timeout=180, interval=2):
         """
         Yield until all instances are in a specified state
+        The shared waiter polls all pending waits with one describe call per tick
         """
         self.log.debug("yield_until_instances_in_state: {0} {1}".format(timeout, interval))
-        max_tries = timeout/interval
-        attempt = 0
-        while attempt < max_tries:
-            self.log.debug("yield_until_instances_in_state. Try count {0} out of {1}".format(attempt, max_tries))
-            attempt += 1
-            if not self.all_instances_in_state(state=state):
-                taskpool.doyield(seconds=interval)
-            else:
-                return True
-        return False
+        try:
+            self.ec2_conn.waiter.wait_for("instance", self.reservation.instances,
+                                          condition=lambda instance: instance.state == state,
+                                          timeout=timeout, interval=interval)
+            return True
+        except exception.AWSWaiterTimeout as e:
+            self.log.debug("Instances not in state {0}: {1}".format(state, e.pending))
+            return False
 
 
 class AWSInf(Inf):
@@ -174,7 +165,7 @@ class AWSInf(Inf):
         tags = instance_spec.get('tags', {})
 
         self.log.info("Provision Instances: {0} for domain:{1}".format(instance_count, domain_name))
-        rc = AwsInfProvisionResponseContext(spec=instance_spec)
+        rc = AwsInfProvisionResponseContext(spec=instance_spec, ec2_conn=self.ec2_conn)
         try:
 
             # create a security group
@@ -206,11 +197,25 @@ class AWSInf(Inf):
         # return the context
         return rc
 
+    def terminate_instances(self, domain_spec, stack_spec, instances):
+        """
+        Terminate instances. Does not wait for the instances to shut down
+        """
+        rc = AWSInfResponseContext(spec=dict(instances=instances))
+        instance_ids = [instance.get("instance_id") for instance in instances]
+        self.log.info("Terminate Instances: {0} for domain:{1}".format(instance_ids, domain_spec.get("domain")))
+        try:
+            self.ec2_conn.terminate_instances(instance_ids)
+        except Exception, e:
+            self.log.debug(msg="Failed terminating instances", exc_info=e)
+            rc.errors.append(e)
+        rc.close()
+        return rc
 
     def _fill_instance_details(self, instances, instance_spec):
         instance_spec['instances'] = []
+        self.ec2_conn.update_instances(instances)
         for instance in instances:
-            instance.update()
             instance_spec['instances'].append({'instance_id': instance.id,
                                                'public_dns_name': instance.public_dns_name,
                                                'private_dns_name': instance.private_dns_name,
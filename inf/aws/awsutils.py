@@ -21,10 +21,13 @@ EC2/S3 Utility Classes
 
 import os
 import re
+import copy
 import time
 import base64
 import string
+import hashlib
 import tempfile
+import threading
 from autopilot.common.asyncpool import taskpool
 
 import boto
@@ -38,11 +41,109 @@ from boto.connection import HAVE_HTTPS_CONNECTION
 from autopilot.common import sshutils
 from autopilot.common import utils
 from autopilot.common import exception
+from autopilot.common.cache import TTLCache
 from autopilot.common.utils import print_timing
 from autopilot.common import logger
 
 from autopilot.inf.aws import static
 from autopilot.inf.aws import awsimage
+from autopilot.inf.aws import awswaiter
+
+
+# seconds a pooled connection may sit unused before it is closed
+CONNECTION_IDLE_TIMEOUT = 300
+
+
+class ConnectionRegistry(object):
+    """
+    Process wide registry of boto connections keyed by authenticator,
+    credentials and connection arguments (region, host, port etc).
+    EasyAWS objects built for the same account share one connection and its
+    underlying http connection pool instead of doing a fresh TLS handshake.
+    Access is serialized with a lock which gevent makes greenlet safe.
+    Connections not asked for in idle_timeout seconds are closed and dropped.
+    Users get the connection from the registry on every use so a busy
+    connection never looks idle
+    """
+    def __init__(self, idle_timeout=CONNECTION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.RLock()
+        self.connections = {}
+        self.log = logger.get_logger("ConnectionRegistry")
+
+    @staticmethod
+    def key(connection_authenticator, aws_access_key_id, aws_secret_access_key, kwargs):
+        # secrets are not kept in the key
+        secret = hashlib.sha1(aws_secret_access_key or "").hexdigest()
+        # RegionInfo does not compare by value so use its endpoint
+        args = tuple(sorted((k, str(getattr(v, 'endpoint', v))) for (k, v) in kwargs.items()))
+        authenticator = "{0}.{1}".format(getattr(connection_authenticator, '__module__', ''),
+                                         getattr(connection_authenticator, '__name__', connection_authenticator))
+        return (authenticator, aws_access_key_id, secret, args)
+
+    def get(self, key, connect):
+        """
+        Returns the pooled connection for key. connect is called to
+        create one if there is none
+        """
+        with self.lock:
+            self.evict_idle()
+            entry = self.connections.get(key)
+            if entry is None:
+                entry = dict(conn=connect())
+                self.connections[key] = entry
+            entry["last_used"] = time.time()
+            return entry["conn"]
+
+    def evict(self, key):
+        """
+        Close and drop the connection for key. The next get creates a new one
+        """
+        with self.lock:
+            entry = self.connections.pop(key, None)
+        if entry:
+            self._close(entry["conn"])
+
+    def replace(self, key, conn, connect):
+        """
+        Swap conn for a new connection if it is still the pooled one for key.
+        conn is not closed. Calls already running on it are left to finish
+        """
+        with self.lock:
+            entry = self.connections.get(key)
+            if entry is not None and entry["conn"] is conn:
+                self.connections.pop(key)
+        return self.get(key, connect)
+
+    def evict_idle(self):
+        now = time.time()
+        with self.lock:
+            idle = [key for (key, entry) in self.connections.items()
+                    if now - entry["last_used"] > self.idle_timeout]
+            entries = [self.connections.pop(key) for key in idle]
+        for entry in entries:
+            self._close(entry["conn"])
+
+    def clear(self):
+        with self.lock:
+            entries = self.connections.values()
+            self.connections = {}
+        for entry in entries:
+            self._close(entry["conn"])
+
+    def _close(self, conn):
+        try:
+            close = getattr(conn, "close", None)
+            if close:
+                close()
+        except Exception as e:
+            self.log.debug("Failed to close connection {0}: {1}".format(conn, e))
+
+    def __len__(self):
+        return len(self.connections)
+
+
+connections = ConnectionRegistry()
 
 
 class EasyAWS(object):
@@ -58,52 +159,107 @@ class EasyAWS(object):
         Providing only the keys will default to using Amazon EC2
 
         kwargs are passed to the connection_authenticator's constructor
+        Connections are shared through the process wide connection registry
         """
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.connection_authenticator = connection_authenticator
+        # a connection given by the caller. Otherwise the pooled one is used
         self._conn = None
         self._kwargs = kwargs
+        self._key = ConnectionRegistry.key(connection_authenticator, aws_access_key_id,
+                                           aws_secret_access_key, kwargs)
         self.log = logger.get_logger("EasyAWS")
 
     def reload(self):
+        """
+        Connect again (e.g. after the connection went bad). The bad connection
+        is dropped from the registry but not closed since other EasyAWS
+        objects may still be using it
+        """
+        bad = self.conn
         self._conn = None
-        return self.conn
+        return connections.replace(self._key, bad, self._connect)
 
     @property
     def conn(self):
-        if self._conn is None:
-            self.log.info('creating self._conn w/ connection_authenticator ' +
-                          'kwargs = %s' % self._kwargs)
-            validate_certs = self._kwargs.get('validate_certs', True)
-            if validate_certs:
-                if not HAVE_HTTPS_CONNECTION:
-                    raise exception.AWSError(
-                        "Failed to validate AWS SSL certificates. "
-                        "SSL certificate validation is only supported "
-                        "on Python>=2.6.\n\nSet AWS_VALIDATE_CERTS=False in "
-                        "the [aws info] section of your config to skip SSL "
-                        "certificate verification and suppress this error AT "
-                        "YOUR OWN RISK.")
-            if not boto_config.has_section('Boto'):
-                boto_config.add_section('Boto')
-            # Hack to get around the fact that boto ignores validate_certs
-            # if https_validate_certificates is declared in the boto config
-            boto_config.setbool('Boto', 'https_validate_certificates',
-                                validate_certs)
-            self._conn = self.connection_authenticator(
-                self.aws_access_key_id, self.aws_secret_access_key,
-                **self._kwargs)
-            self._conn.https_validate_certificates = validate_certs
-        return self._conn
-
-    def add_tags(self, aws_object, tags):
-        if tags:
-            for (tag, val) in tags.items():
-                aws_object.add_tag(tag, val)
+        if self._conn is not None:
+            return self._conn
+        # not cached here. Every use marks the pooled connection as used
+        return connections.get(self._key, self._connect)
+
+    def _connect(self):
+        self.log.info('creating self._conn w/ connection_authenticator ' +
+                      'kwargs = %s' % self._kwargs)
+        validate_certs = self._kwargs.get('validate_certs', True)
+        if validate_certs:
+            if not HAVE_HTTPS_CONNECTION:
+                raise exception.AWSError(
+                    "Failed to validate AWS SSL certificates. "
+                    "SSL certificate validation is only supported "
+                    "on Python>=2.6.\n\nSet AWS_VALIDATE_CERTS=False in "
+                    "the [aws info] section of your config to skip SSL "
+                    "certificate verification and suppress this error AT "
+                    "YOUR OWN RISK.")
+        if not boto_config.has_section('Boto'):
+            boto_config.add_section('Boto')
+        # Hack to get around the fact that boto ignores validate_certs
+        # if https_validate_certificates is declared in the boto config
+        boto_config.setbool('Boto', 'https_validate_certificates',
+                            validate_certs)
+        conn = self.connection_authenticator(
+            self.aws_access_key_id, self.aws_secret_access_key,
+            **self._kwargs)
+        conn.https_validate_certificates = validate_certs
+        return conn
+
+    # resource ids sent in a single CreateTags call
+    TAG_BATCH_SIZE = 500
+
+    def add_tags(self, aws_objects, tags):
+        """
+        Tag one or more boto objects with a bulk CreateTags call
+        and mirror the tags on the local objects
+        """
+        if not tags or not aws_objects:
+            return
+        if not isinstance(aws_objects, (list, tuple)):
+            aws_objects = [aws_objects]
+        self.create_tags([aws_object.id for aws_object in aws_objects], tags)
+        for aws_object in aws_objects:
+            if getattr(aws_object, 'tags', None) is not None:
+                aws_object.tags.update(tags)
+
+    def create_tags(self, resource_ids, tags, max_tries=6, interval=1):
+        """
+        Apply tags to resource_ids with one CreateTags call per batch.
+        Newly created resources may not be visible to the API yet so
+        *.NotFound errors are retried with backoff
+        """
+        if not tags or not resource_ids:
+            return
+        for i in range(0, len(resource_ids), self.TAG_BATCH_SIZE):
+            batch = resource_ids[i:i + self.TAG_BATCH_SIZE]
+            delays = utils.backoff_delays(initial=interval)
+            attempt = 1
+            while True:
+                try:
+                    self.conn.create_tags(batch, tags)
+                    break
+                except boto.exception.EC2ResponseError as e:
+                    if not (e.error_code or "").endswith(".NotFound") or attempt >= max_tries:
+                        raise
+                    self.log.debug("create_tags: {0} for {1}. Try count {2} out of {3}"
+                                   .format(e.error_code, batch, attempt, max_tries))
+                    attempt += 1
+                    taskpool.doyield(seconds=next(delays))
 
 
 class EasyEC2(EasyAWS):
+    # AMI metadata shared by all EasyEC2 objects. Keyed by account and region
+    _image_cache = TTLCache(maxsize=256, ttl=600)
+    _bdmap_cache = TTLCache(maxsize=256, ttl=600)
+
     def __init__(self, aws_access_key_id, aws_secret_access_key,
                  aws_ec2_path='/', aws_s3_host=None, aws_s3_path='/',
                  aws_port=None, aws_region_name=None, aws_is_secure=True,
@@ -129,7 +285,8 @@ class EasyEC2(EasyAWS):
                     aws_proxy_user=aws_proxy_user,
                     aws_proxy_pass=aws_proxy_pass,
                     aws_validate_certs=aws_validate_certs)
-        self.s3 = EasyS3(aws_access_key_id, aws_secret_access_key, **kwds)
+        self._s3_kwds = kwds
+        self._s3 = None
         self._regions = None
         self._account_attrs = None
         self._account_attrs_region = None
@@ -137,6 +294,13 @@ class EasyEC2(EasyAWS):
     def __repr__(self):
         return '<EasyEC2: %s (%s)>' % (self.region.name, self.region.endpoint)
 
+    @property
+    def s3(self):
+        # most workflows never touch S3 so connect on first use
+        if self._s3 is None:
+            self._s3 = EasyS3(self.aws_access_key_id, self.aws_secret_access_key, **self._s3_kwds)
+        return self._s3
+
     def _fetch_account_attrs(self):
         acct_attrs = self._account_attrs
         if not acct_attrs or self._account_attrs_region != self.region.name:
@@ -230,11 +394,11 @@ class EasyEC2(EasyAWS):
     def _wait_for_group_deletion_propagation(self, group):
         if isinstance(group, boto.ec2.placementgroup.PlacementGroup):
             while self.get_placement_group_or_none(group.name):
-                time.sleep(5)
+                taskpool.doyield(5)
         else:
             assert isinstance(group, boto.ec2.securitygroup.SecurityGroup)
             while self.get_group_or_none(group.name):
-                time.sleep(5)
+                taskpool.doyield(5)
 
     def delete_group(self, group=None, group_id=None, retry_count=0):
         """
@@ -415,7 +579,7 @@ class EasyEC2(EasyAWS):
         pg = self.get_placement_group_or_none(name)
         while not pg:
             self.log.info("Waiting for placement group %s..." % name)
-            time.sleep(3)
+            taskpool.doyield(3)
             pg = self.get_placement_group_or_none(name)
         return pg
 
@@ -464,34 +628,7 @@ class EasyEC2(EasyAWS):
         Convenience method for running spot or flat-rate instances
         """
         if not block_device_map:
-            img = self.get_image(image_id)
-            instance_store = img.root_device_type == 'instance-store'
-            if instance_type == 'm1.small' and img.architecture == "i386":
-                # Needed for m1.small + 32bit AMI (see gh-329)
-                instance_store = True
-            use_ephemeral = instance_type != 't1.micro'
-            bdmap = self.create_block_device_map(
-                add_ephemeral_drives=use_ephemeral,
-                num_ephemeral_drives=24,
-                instance_store=instance_store)
-            # Prune drives from runtime block device map that may override EBS
-            # volumes specified in the AMIs block device map
-            for dev in img.block_device_mapping:
-                bdt = img.block_device_mapping.get(dev)
-                if not bdt.ephemeral_name and dev in bdmap:
-                    self.log.debug("EBS volume already mapped to %s by AMI" % dev)
-                    self.log.debug("Removing %s from runtime block device map" % dev)
-                    bdmap.pop(dev)
-            if img.root_device_name in img.block_device_mapping:
-                self.log.debug("Forcing delete_on_termination for AMI: %s" % img.id)
-                root = img.block_device_mapping[img.root_device_name]
-                # specifying the AMI's snapshot in the custom block device
-                # mapping when you dont own the AMI causes an error on launch
-                root.snapshot_id = None
-                root.delete_on_termination = True
-                bdmap[img.root_device_name] = root
-            block_device_map = bdmap
-
+            block_device_map = self.get_block_device_map(image_id, instance_type)
 
         shared_kwargs = dict(instance_type=instance_type,
                              key_name=key_name, min_count=min_count, max_count=max_count,
@@ -530,9 +667,7 @@ class EasyEC2(EasyAWS):
 
         # apply tags if given.
         if reservation and tags:
-            for instance in reservation.instances:
-                for (key, value) in tags.items():
-                    instance.add_tag(key, value)
+            self.add_tags(reservation.instances, tags)
 
         return reservation
 
@@ -554,43 +689,30 @@ class EasyEC2(EasyAWS):
         #     self.conn.create_network_interface()
         pass
 
-    def _wait_for_propagation(self, obj_ids, fetch_func, id_filter, obj_name,
+    @property
+    def waiter(self):
+        return awswaiter.waiter_for(self)
+
+    def _wait_for_propagation(self, resource_type, obj_ids, obj_name,
                               max_retries=60, interval=5):
         """
-        Wait for a list of object ids to appear in the AWS API. Requires a
-        function that fetches the objects and also takes a filters kwarg. The
-        id_filter specifies the id filter to use for the objects and
+        Wait for a list of object ids to appear in the AWS API.
         obj_name describes the objects for log messages.
         """
-        filters = {id_filter: obj_ids}
-        num_objs = len(obj_ids)
-        num_reqs = 0
-        reqs_ids = []
-        max_retries = max(1, max_retries)
-        interval = max(1, interval)
-        for i in range(max_retries + 1):
-            reqs = fetch_func(filters=filters)
-            reqs_ids = [req.id for req in reqs]
-            num_reqs = len(reqs)
-            if num_reqs != num_objs:
-                self.log.debug("%d: only %d/%d %s have " "propagated - sleeping..." %
-                               (i, num_reqs, num_objs, obj_name))
-                if i != max_retries:
-                    taskpool.doyield(interval)
-            else:
-                return
-
-        missing = [oid for oid in obj_ids if oid not in reqs_ids]
-        raise exception.AWSPropogationException(
-            "Failed to fetch %d/%d %s after %d seconds: %s" %
-            (num_reqs, num_objs, obj_name, max_retries * interval,
-             ', '.join(missing)))
+        timeout = max(1, max_retries) * max(1, interval)
+        try:
+            self.waiter.wait_for(resource_type, obj_ids, timeout=timeout, interval=interval)
+        except exception.AWSWaiterTimeout as e:
+            raise exception.AWSPropogationException(
+                "Failed to fetch %d/%d %s after %d seconds: %s" %
+                (len(obj_ids) - len(e.pending), len(obj_ids), obj_name, timeout,
+                 ', '.join(e.pending)), inner_exception=e)
 
     def wait_for_propagation(self, instances=None, spot_requests=None,
                              max_retries=60, interval=5):
         """
         Wait for newly created instances and/or spot_requests to register in
-        the AWS API by repeatedly calling get_all_{instances, spot_requests}.
+        the AWS API. The waiter batches the describe calls with other pending waits.
         Calling this method directly after creating new instances or spot
         requests before operating on them helps to avoid eventual consistency
         errors about instances or spot requests not existing.
@@ -598,14 +720,13 @@ class EasyEC2(EasyAWS):
         if spot_requests:
             spot_ids = [getattr(s, 'id', s) for s in spot_requests]
             self._wait_for_propagation(
-                spot_ids, self.get_all_spot_requests,
-                'spot-instance-request-id', 'spot requests',
+                "spot_request", spot_ids, 'spot requests',
                 max_retries=max_retries, interval=interval)
         if instances:
             instance_ids = [getattr(i, 'id', i) for i in instances]
             self._wait_for_propagation(
-                instance_ids, self.get_all_instances, 'instance-id',
-                'instances', max_retries=max_retries, interval=interval)
+                "instance", instance_ids, 'instances',
+                max_retries=max_retries, interval=interval)
 
     def create_image(self, instance_id, name, description=None,
                      no_reboot=False):
@@ -613,9 +734,63 @@ class EasyEC2(EasyAWS):
                                       description=description,
                                       no_reboot=no_reboot)
 
+    def get_block_device_map(self, image_id, instance_type):
+        """
+        Returns the runtime block device map for launching image_id as
+        instance_type. Memoized per (image_id, instance_type) so a stack
+        launching many role groups from one AMI describes it once
+        """
+        key = (self._cache_scope(), image_id, instance_type)
+        bdmap = self._bdmap_cache.get_or_load(
+            key, lambda: self._create_runtime_block_device_map(image_id, instance_type))
+        # callers get their own copy of the cached map and its block devices
+        return copy.deepcopy(bdmap)
+
+    def _create_runtime_block_device_map(self, image_id, instance_type):
+        img = self.get_cached_image(image_id)
+        instance_store = img.root_device_type == 'instance-store'
+        if instance_type == 'm1.small' and img.architecture == "i386":
+            # Needed for m1.small + 32bit AMI (see gh-329)
+            instance_store = True
+        use_ephemeral = instance_type != 't1.micro'
+        bdmap = self.create_block_device_map(
+            add_ephemeral_drives=use_ephemeral,
+            num_ephemeral_drives=24,
+            instance_store=instance_store)
+        # Prune drives from runtime block device map that may override EBS
+        # volumes specified in the AMIs block device map
+        for dev in img.block_device_mapping:
+            bdt = img.block_device_mapping.get(dev)
+            if not bdt.ephemeral_name and dev in bdmap:
+                self.log.debug("EBS volume already mapped to %s by AMI" % dev)
+                self.log.debug("Removing %s from runtime block device map" % dev)
+                bdmap.pop(dev)
+        if img.root_device_name in img.block_device_mapping:
+            self.log.debug("Forcing delete_on_termination for AMI: %s" % img.id)
+            # copy so that the cached image keeps its own mapping
+            root = copy.copy(img.block_device_mapping[img.root_device_name])
+            # specifying the AMI's snapshot in the custom block device
+            # mapping when you dont own the AMI causes an error on launch
+            root.snapshot_id = None
+            root.delete_on_termination = True
+            bdmap[img.root_device_name] = root
+        return bdmap
+
+    def invalidate_image_cache(self, image_id=None):
+        """
+        Drop cached metadata for image_id or for all images
+        """
+        if image_id is None:
+            self._image_cache.clear()
+            self._bdmap_cache.clear()
+        else:
+            self._image_cache.invalidate_if(lambda key: key[1] == image_id)
+            self._bdmap_cache.invalidate_if(lambda key: key[1] == image_id)
+
     def register_image(self, name, description=None, image_location=None,
                        architecture=None, kernel_id=None, ramdisk_id=None,
                        root_device_name=None, block_device_map=None):
+        self.invalidate_image_cache()
         return self.conn.register_image(name=name, description=description,
                                         image_location=image_location,
                                         architecture=architecture,
@@ -733,6 +908,20 @@ class EasyEC2(EasyAWS):
             instances.extend(insts)
         return instances
 
+    def update_instances(self, instances):
+        """
+        Refresh instance objects with a single DescribeInstances call
+        instead of calling update() on each of them
+        """
+        if not instances:
+            return instances
+        instance_ids = [instance.id for instance in instances]
+        fresh = dict((i.id, i) for i in self.get_all_instances(filters={'instance-id': instance_ids}))
+        for instance in instances:
+            if instance.id in fresh:
+                instance._update(fresh[instance.id])
+        return instances
+
     def get_instance(self, instance_id):
         try:
             return self.get_all_instances(
@@ -912,6 +1101,7 @@ class EasyEC2(EasyAWS):
     @print_timing("Removing image")
     def remove_image(self, image_name, pretend=True, keep_image_data=True):
         img = self.get_image(image_name)
+        self.invalidate_image_cache(img.id)
         if pretend:
             self.log.info('Pretending to deregister AMI: %s' % img.id)
         else:
@@ -1051,6 +1241,21 @@ class EasyEC2(EasyAWS):
     def get_images(self, filters=None):
         return self.conn.get_all_images(filters=filters)
 
+    def get_cached_image(self, image_id):
+        """
+        Same as get_image but served from the image metadata cache
+        """
+        return self._image_cache.get_or_load((self._cache_scope(), image_id),
+                                             lambda: self.get_image(image_id))
+
+    def _cache_scope(self):
+        """
+        Images can be private to an account. Cached metadata is only
+        shared between connections of the same account and region
+        """
+        region = self._kwargs.get('region')
+        return (self.aws_access_key_id, getattr(region, 'endpoint', region))
+
     def get_image(self, image_id):
         """
         Return image object representing an AMI.
@@ -1283,46 +1488,35 @@ class EasyEC2(EasyAWS):
             pass
 
     def wait_for_volume(self, volume, status=None, state=None,
-                        refresh_interval=5, log_func=None):
+                        refresh_interval=5, log_func=None, timeout=600):
+        """
+        Yield until volume has the given status and/or attachment state
+        """
+        log_func = log_func or self.log.info
         if status:
-            log_func("Waiting for %s to become '%s'..." % (volume.id, status),
-                     extra=dict(__nonewline__=True))
-            s = spinner.Spinner()
-            s.start()
-            while volume.update() != status:
-                time.sleep(refresh_interval)
-            s.stop()
+            log_func("Waiting for %s to become '%s'..." % (volume.id, status))
         if state:
-            log_func("Waiting for %s to transition to: %s... " %
-                     (volume.id, state), extra=dict(__nonewline__=True))
-            if not status:
-                volume.update()
-            s = spinner.Spinner()
-            s.start()
-            while volume.attachment_state() != state:
-                time.sleep(refresh_interval)
-                volume.update()
-            s.stop()
-
-    def wait_for_snapshot(self, snapshot, refresh_interval=30):
+            log_func("Waiting for %s to transition to: %s... " % (volume.id, state))
+
+        def _ready(v):
+            return (not status or v.status == status) and (not state or v.attachment_state() == state)
+        self.waiter.wait_for("volume", [volume], condition=_ready,
+                             timeout=timeout, interval=refresh_interval)
+
+    def wait_for_snapshot(self, snapshot, refresh_interval=30, timeout=3600):
+        """
+        Yield until snapshot is completed. Progress is logged as it changes
+        """
         snap = snapshot
         self.log.info("Waiting for snapshot to complete: %s" % snap.id)
-        widgets = ['%s: ' % snap.id, '',
-                   progressbar.Bar(marker=progressbar.RotatingMarker()),
-                   '', progressbar.Percentage(), ' ', progressbar.ETA()]
-        pbar = progressbar.ProgressBar(widgets=widgets, maxval=100).start()
-        while snap.status != 'completed':
-            try:
-                progress = int(snap.update().replace('%', ''))
-                if not pbar.finished:
-                    pbar.update(progress)
-            except ValueError:
-                time.sleep(5)
-                continue
-            if snap.status != 'completed':
-                time.sleep(refresh_interval)
-        if not pbar.finished:
-            pbar.finish()
+        progress = dict(last=None)
+
+        def _log_progress(s):
+            if s.progress != progress["last"]:
+                progress["last"] = s.progress
+                self.log.info("%s: %s" % (s.id, s.progress))
+        self.waiter.wait_for("snapshot", [snap], condition=lambda s: s.status == 'completed',
+                             timeout=timeout, interval=refresh_interval, on_update=_log_progress)
 
     def create_snapshot(self, vol, description=None, wait_for_snapshot=False,
                         refresh_interval=30):
@@ -1530,8 +1724,15 @@ class EasyVPC(EasyAWS):
         super(EasyVPC, self).__init__(aws_access_key_id, aws_secret_access_key,
                                       boto.connect_vpc, **kwargs)
 
-        self.ec2_conn = self._get_ec2(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
-                                      aws_region_name="us-east-1")
+        self._ec2_conn = None
+
+    @property
+    def ec2_conn(self):
+        if self._ec2_conn is None:
+            self._ec2_conn = self._get_ec2(aws_access_key_id=self.aws_access_key_id,
+                                           aws_secret_access_key=self.aws_secret_access_key,
+                                           aws_region_name="us-east-1")
+        return self._ec2_conn
 
     def create_vpc(self, cidr_block,  new_internet_gateway=True, tags=None):
         """
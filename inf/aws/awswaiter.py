@@ -0,0 +1,198 @@
+#! /usr/bin/python
+
+import time
+from autopilot.common import utils
+from autopilot.common import logger
+from autopilot.common import exception
+from autopilot.common.asyncpool import taskpool
+
+
+class AWSWait(object):
+    """
+    A pending wait on a list of resources of one type
+    """
+    def __init__(self, resource_type, resources, condition, timeout, interval, on_update=None):
+        self.resource_type = resource_type
+        # accept boto objects or plain ids
+        self.resources = resources
+        self.ids = [getattr(r, 'id', r) for r in resources]
+        self.condition = condition
+        self.deadline = time.time() + timeout
+        self.timeout = timeout
+        self.interval = interval
+        self.on_update = on_update
+        self.future = taskpool.callable_future()
+
+    def check(self, found):
+        """
+        Refresh the caller's objects from found (id -> fresh resource) and
+        return True once every resource exists and satisfies the condition
+        """
+        ready = True
+        for (index, rid) in enumerate(self.ids):
+            fresh = found.get(rid)
+            if fresh is None:
+                # not propagated yet
+                ready = False
+                continue
+            resource = self.resources[index]
+            if resource is not rid and hasattr(resource, '_update'):
+                resource._update(fresh)
+            else:
+                resource = fresh
+            if self.on_update:
+                self.on_update(resource)
+            if not self.condition(resource):
+                ready = False
+        return ready
+
+    def pending(self, found):
+        return [rid for rid in self.ids if rid not in found or not self.condition(found[rid])]
+
+    def result(self, found):
+        return [r if r is not rid else found[rid] for (r, rid) in zip(self.resources, self.ids)]
+
+
+class AWSWaiter(object):
+    """
+    Multiplexes every pending wait on an EC2 connection. Each tick issues one
+    filtered describe call per resource type covering all pending waits of
+    that type, refreshes the waiting objects and resolves the futures of the
+    waits that are done. A single greenlet polls while waits are pending.
+    The tick starts at the smallest requested interval and backs off up to
+    max_interval while nothing new is registered
+    """
+    # resource type -> (describe method on EasyEC2, id filter)
+    describers = {
+        "instance": ("get_all_instances", "instance-id"),
+        "volume": ("get_volumes", "volume-id"),
+        "snapshot": ("get_snapshots", "snapshot-id"),
+        "spot_request": ("get_all_spot_requests", "spot-instance-request-id"),
+    }
+
+    def __init__(self, ec2, max_interval=30):
+        self.ec2 = ec2
+        self.max_interval = max_interval
+        self.waits = []
+        self.running = False
+        self.delays = None
+        self.log = logger.get_logger("AWSWaiter")
+
+    def wait(self, resource_type, resources, condition=None, timeout=600, interval=5, on_update=None):
+        """
+        Returns a CallableFuture resolved with the refreshed resources once
+        they all exist and satisfy condition(resource), or with an
+        AWSWaiterTimeout exception. condition defaults to existence
+        """
+        if resource_type not in self.describers:
+            raise exception.AWSOperationException("Unknown resource type for waiter: {0}".format(resource_type))
+        w = AWSWait(resource_type, list(resources), condition or (lambda r: True),
+                    timeout=timeout, interval=max(0.1, interval), on_update=on_update)
+        if not w.ids:
+            w.future([])
+            return w.future
+        self.waits.append(w)
+        # restart the backoff so the new wait is polled at its own interval
+        self.delays = None
+        if not self.running:
+            self.running = True
+            taskpool.spawn(self._run)
+        return w.future
+
+    def wait_for(self, resource_type, resources, condition=None, timeout=600, interval=5, on_update=None):
+        """
+        Same as wait but yields the calling greenlet until done.
+        Returns the resources or raises AWSWaiterTimeout
+        """
+        return self.wait(resource_type, resources, condition=condition, timeout=timeout,
+                         interval=interval, on_update=on_update).get()
+
+    def _run(self):
+        try:
+            while self.waits:
+                try:
+                    self._tick()
+                except Exception as e:
+                    self.log.warning("Waiter tick failed: {0}. Retrying next tick".format(e))
+                    self._expire()
+                if not self.waits:
+                    break
+                if self.delays is None:
+                    self.delays = utils.backoff_delays(initial=min(w.interval for w in self.waits),
+                                                       maximum=self.max_interval)
+                # never sleep past the closest deadline
+                until_deadline = min(w.deadline for w in self.waits) - time.time()
+                taskpool.doyield(seconds=max(0, min(next(self.delays), until_deadline)))
+        finally:
+            self.running = False
+            # the poller was killed. Nothing else would resolve the pending waits
+            (waits, self.waits) = (self.waits, [])
+            for w in waits:
+                w.future(None, exception=exception.AWSOperationException(
+                    "Waiter stopped while waiting for {0}: {1}".format(w.resource_type, ", ".join(w.ids))))
+
+    def _tick(self):
+        by_type = {}
+        for w in self.waits:
+            by_type.setdefault(w.resource_type, []).append(w)
+
+        for (resource_type, waits) in by_type.items():
+            ids = sorted(set(rid for w in waits for rid in w.ids))
+            found = self._describe(resource_type, ids)
+            if found is None:
+                # describe failed. Only deadlines are checked this tick
+                found = {}
+                check = False
+            else:
+                check = True
+            now = time.time()
+            for w in waits:
+                try:
+                    if check and w.check(found):
+                        self.waits.remove(w)
+                        w.future(w.result(found))
+                    elif now >= w.deadline:
+                        self.waits.remove(w)
+                        self._timeout(w, found)
+                except Exception as e:
+                    # a failing condition or on_update callback only fails its own wait
+                    self.waits.remove(w)
+                    w.future(None, exception=e)
+
+    def _expire(self):
+        now = time.time()
+        for w in [w for w in self.waits if now >= w.deadline]:
+            self.waits.remove(w)
+            self._timeout(w, {})
+
+    def _timeout(self, w, found):
+        pending = w.pending(found)
+        w.future(None, exception=exception.AWSWaiterTimeout(
+            "Timed out after {0} seconds waiting for {1}: {2}".format(
+                w.timeout, w.resource_type, ", ".join(pending)), pending=pending))
+
+    def _describe(self, resource_type, ids):
+        (method, id_filter) = self.describers[resource_type]
+        try:
+            resources = getattr(self.ec2, method)(filters={id_filter: ids})
+            return dict((r.id, r) for r in resources)
+        except Exception as e:
+            # EC2ResponseError, BotoServerError, socket and ssl errors. Deadlines still apply
+            self.log.warning("Describe {0} failed: {1}. Retrying next tick".format(resource_type, e))
+            return None
+
+
+# one waiter per pooled connection so waits from all workflows are batched together
+_waiters = {}
+
+
+def waiter_for(ec2):
+    """
+    Returns the shared AWSWaiter for the connection used by ec2 (an EasyEC2)
+    """
+    key = ec2._key
+    waiter = _waiters.get(key)
+    if waiter is None:
+        waiter = AWSWaiter(ec2)
+        _waiters[key] = waiter
+    return waiter
@@ -49,4 +49,10 @@ class Inf(object):
         """
         Provision the role as per spec
         """
-        pass
\ No newline at end of file
+        pass
+
+    def terminate_instances(self, domain_spec, stack_spec, instances):
+        """
+        Terminate instances (as listed in the provisioned instance_spec)
+        """
+        pass
@@ -1,9 +1,16 @@
 #! /usr/bin/python
 
+import struct
 import cPickle
 import jsonpickle
+from autopilot.protocol.message import Message
+from autopilot.specifications.apspec import Stackspec, StackDeploy, Rolegroup
+
 
 class Serializer(object):
+    # written between messages of a streamed response
+    separator = "\n"
+
     def __init__(self):
         pass
 
@@ -18,6 +25,9 @@ class cPickleSerializer(Serializer):
     """
     Serialize the messages using cPickle
     """
+    # pickles are self delimiting. A newline between streamed messages breaks the next load
+    separator = ""
+
     def __init__(self):
         Serializer.__init__(self)
 
@@ -41,3 +51,210 @@ class JsonPickleSerializer(Serializer):
 
     def dump(self, stream, message):
         stream.write(jsonpickle.encode(message))
+
+
+class BinarySerializer(Serializer):
+    """
+    Length prefixed binary framing for messages.
+    A frame is MAGIC, a 4 byte big endian body length and the body.
+    The body holds the Message fields (type, identifier, headers, data) in
+    that order, each as a tagged value (msgpack style). Dict keys are written
+    sorted so equal messages encode to equal bytes. Objects that are not
+    plain data (e.g. specs) are only encoded if their class is registered.
+    They travel as the class name and their state dict and decoding never
+    builds anything but registered classes.
+    With zero_copy, byte strings of at least zero_copy_min bytes are decoded
+    as memoryview slices of the frame instead of copies
+    """
+    MAGIC = "APB1"
+    separator = ""
+
+    _header = struct.Struct(">4sI")
+    _len = struct.Struct(">I")
+    _short_len = struct.Struct(">B")
+    _int8 = struct.Struct(">b")
+    _int32 = struct.Struct(">i")
+    _int = struct.Struct(">q")
+    _float = struct.Struct(">d")
+
+    # wire name -> (class, state fields left out)
+    types = {}
+
+    @classmethod
+    def register(cls, type_, exclude=()):
+        """
+        Allow instances of type_ in messages. Fields in exclude
+        (e.g. process local objects) are not sent
+        """
+        cls.types[type_.__name__] = (type_, frozenset(exclude))
+
+    def __init__(self, zero_copy=False, zero_copy_min=64 * 1024):
+        Serializer.__init__(self)
+        self.zero_copy = zero_copy
+        self.zero_copy_min = zero_copy_min
+
+    def dump(self, stream, message):
+        stream.write(self.dumps(message))
+
+    def dumps(self, message):
+        parts = []
+        self._encode(message.type, parts)
+        self._encode(message.identifier, parts)
+        self._encode(message.headers, parts)
+        self._encode(message.data, parts)
+        body = "".join(parts)
+        return self._header.pack(self.MAGIC, len(body)) + body
+
+    def load(self, stream):
+        """
+        Reads one frame from stream. Returns None if the stream does not
+        hold a valid frame
+        """
+        header = stream.read(self._header.size)
+        if len(header) != self._header.size:
+            return None
+        (magic, length) = self._header.unpack(header)
+        if magic != self.MAGIC:
+            return None
+        body = stream.read(length)
+        if len(body) != length:
+            return None
+        return self.loads(body)
+
+    def loads(self, body):
+        try:
+            (mtype, pos) = self._decode(body, 0)
+            (identifier, pos) = self._decode(body, pos)
+            (headers, pos) = self._decode(body, pos)
+            (data, pos) = self._decode(body, pos)
+        except (IndexError, KeyError, ValueError, TypeError, AttributeError, RuntimeError, struct.error):
+            # UnicodeDecodeError is a ValueError, too deep nesting a RuntimeError.
+            # A bad frame is never an exception for the caller
+            return None
+        return Message(type=mtype, data=data, headers=headers, identifier=identifier)
+
+    def _encode(self, value, parts):
+        vtype = type(value)
+        if value is None:
+            parts.append("N")
+        elif vtype is bool:
+            parts.append("T" if value else "F")
+        elif vtype in (int, long):
+            # smallest fixed width that holds the value
+            if -128 <= value < 128:
+                parts.append("c" + self._int8.pack(value))
+            elif -2 ** 31 <= value < 2 ** 31:
+                parts.append("j" + self._int32.pack(value))
+            elif -2 ** 63 <= value < 2 ** 63:
+                parts.append("i" + self._int.pack(value))
+            else:
+                self._encode_bytes("g", str(value), parts)
+        elif vtype is float:
+            parts.append("d" + self._float.pack(value))
+        elif vtype is unicode:
+            self._encode_bytes("u", value.encode("utf-8"), parts)
+        elif vtype is str:
+            self._encode_bytes("s", value, parts)
+        elif vtype in (list, tuple):
+            parts.append(("l" if vtype is list else "t") + self._len.pack(len(value)))
+            for item in value:
+                self._encode(item, parts)
+        elif vtype is dict:
+            parts.append("m" + self._len.pack(len(value)))
+            items = []
+            for (k, v) in value.items():
+                key_parts = []
+                self._encode(k, key_parts)
+                items.append(("".join(key_parts), v))
+            # sort by encoded key for a deterministic encoding
+            items.sort(key=lambda item: item[0])
+            for (k, v) in items:
+                parts.append(k)
+                self._encode(v, parts)
+        else:
+            name = vtype.__name__
+            if self.types.get(name, (None, ))[0] is not vtype:
+                raise TypeError("Cannot encode {0}. Register it with BinarySerializer.register".format(name))
+            exclude = self.types[name][1]
+            state = value.__getstate__() if hasattr(value, "__getstate__") else vars(value)
+            parts.append("o")
+            self._encode(name, parts)
+            self._encode(dict((k, v) for (k, v) in state.items() if k not in exclude), parts)
+
+    def _encode_bytes(self, tag, value, parts):
+        # short values use the upper case tag and a one byte length
+        if len(value) < 256:
+            parts.append(tag.upper() + self._short_len.pack(len(value)))
+        else:
+            parts.append(tag + self._len.pack(len(value)))
+        parts.append(value)
+
+    def _decode(self, body, pos):
+        tag = body[pos]
+        pos += 1
+        if tag == "N":
+            return (None, pos)
+        if tag == "T":
+            return (True, pos)
+        if tag == "F":
+            return (False, pos)
+        if tag == "c":
+            return (self._int8.unpack_from(body, pos)[0], pos + self._int8.size)
+        if tag == "j":
+            return (self._int32.unpack_from(body, pos)[0], pos + self._int32.size)
+        if tag == "i":
+            return (self._int.unpack_from(body, pos)[0], pos + self._int.size)
+        if tag == "d":
+            return (self._float.unpack_from(body, pos)[0], pos + self._float.size)
+        if tag == "o":
+            (name, pos) = self._decode(body, pos)
+            (state, pos) = self._decode(body, pos)
+            (type_, exclude) = self.types[name]
+            value = type_.__new__(type_)
+            state.update((k, None) for k in exclude)
+            if hasattr(value, "__setstate__"):
+                value.__setstate__(state)
+            else:
+                value.__dict__.update(state)
+            return (value, pos)
+        if tag in ("l", "t", "m"):
+            count = self._len.unpack_from(body, pos)[0]
+            pos += self._len.size
+            if tag == "m":
+                value = {}
+                for i in xrange(count):
+                    (k, pos) = self._decode(body, pos)
+                    (value[k], pos) = self._decode(body, pos)
+                return (value, pos)
+            items = []
+            for i in xrange(count):
+                (item, pos) = self._decode(body, pos)
+                items.append(item)
+            return (items if tag == "l" else tuple(items), pos)
+
+        # length prefixed values
+        if tag.isupper():
+            length = self._short_len.unpack_from(body, pos)[0]
+            start = pos + self._short_len.size
+            tag = tag.lower()
+        else:
+            length = self._len.unpack_from(body, pos)[0]
+            start = pos + self._len.size
+        end = start + length
+        if end > len(body):
+            raise IndexError("Truncated value")
+        if tag == "s":
+            if self.zero_copy and length >= self.zero_copy_min:
+                return (memoryview(body)[start:end], end)
+            return (body[start:end], end)
+        if tag == "u":
+            return (body[start:end].decode("utf-8"), end)
+        if tag == "g":
+            return (long(body[start:end]), end)
+        raise KeyError("Unknown tag: {0}".format(tag))
+
+
+# specs are sent to the agents. The environment stays on the controller
+BinarySerializer.register(Stackspec, exclude=("apenv", ))
+BinarySerializer.register(StackDeploy)
+BinarySerializer.register(Rolegroup)
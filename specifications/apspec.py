@@ -1,13 +1,44 @@
 #! /usr/bin/python
 import yaml
+from autopilot.common.exception import SpecValidationError
+from autopilot.workflows.plancache import plan_cache, content_hash
 
+# specs are user input. Only plain yaml types are constructed and the
+# LibYAML based loader is an order of magnitude faster when it is available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-class Apspec(object):
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+class Slotted(object):
+    """
+    __slots__ classes have no __dict__. State is the slot values so that
+    pickle, copy and jsonpickle work the same way as for plain objects
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        for (slot, value) in state.items():
+            setattr(self, slot, value)
+
+
+class Apspec(Slotted):
     """
     Base class for ApSpec
-    todo: We should normalize the spec here into a canonical form
-    by replacing undefined values with defaults
+    Specs are validated when they are loaded. A spec that loads is complete
     """
+    __slots__ = ("org", "domain", "apenv", "type", "inf", "description", "spec_hash")
+
     def __init__(self, apenv, org, domain, type, inf=None, description=None):
         self.org = org
         self.domain = domain
@@ -15,6 +46,8 @@ class Apspec(object):
         self.type = type
         self.inf = inf
         self.description = description
+        # content hash of the document the spec was loaded from
+        self.spec_hash = None
 
     def todict(self):
         d = dict(org=self.org,
@@ -24,11 +57,40 @@ class Apspec(object):
         return dict(apspec=d)
 
     @staticmethod
-    def load(apenv, org, domain, spec_stream):
-        dct = yaml.load(spec_stream)
+    def load(apenv, org, domain, spec_stream, cache=plan_cache):
+        """
+        Parsed documents are cached by content hash so the same spec is
+        only parsed once. Pass cache=None to always parse.
+        Raises SpecValidationError listing every problem in the spec
+        """
+        text = spec_stream.read() if hasattr(spec_stream, "read") else spec_stream
+        spec_hash = content_hash(text)
+        if cache is not None:
+            dct = cache.spec(spec_hash, lambda: Apspec._parse(text))
+        else:
+            dct = Apspec._parse(text)
         spec_dct = dct.get('apspec')
         func = getattr(Apspec, "_resolve_{0}_spec".format(spec_dct.get('type')))
-        return func(apenv, org, domain, spec_dct)
+        spec = func(apenv, org, domain, spec_dct)
+        spec.spec_hash = spec_hash
+        return spec
+
+    @staticmethod
+    def _parse(text):
+        try:
+            dct = load_yaml(text)
+        except yaml.YAMLError as ex:
+            raise SpecValidationError(["yaml: {0}".format(ex)])
+        errors = []
+        if not isinstance(dct, dict) or not isinstance(dct.get("apspec"), dict):
+            errors.append("apspec: missing")
+        elif dct["apspec"].get("type") not in SPEC_SCHEMAS:
+            errors.append("apspec.type: must be one of {0}".format(", ".join(sorted(SPEC_SCHEMAS.keys()))))
+        else:
+            SPEC_SCHEMAS[dct["apspec"]["type"]].validate(dct["apspec"], "apspec", errors)
+        if errors:
+            raise SpecValidationError(errors)
+        return dct
 
     @staticmethod
     def _resolve_stack_spec(apenv, org, domain, spec_dct):
@@ -43,6 +105,8 @@ class Stackspec(Apspec):
     """
     Define the stack
     """
+    __slots__ = ("name", "deploy", "groups")
+
     def __init__(self, apenv, org, domain, type, inf, name, description, deployd, groupsd):
         Apspec.__init__(self, apenv=apenv, org=org, domain=domain,
                         type=type, inf=inf, description=description)
@@ -50,7 +114,6 @@ class Stackspec(Apspec):
         self.deploy = StackDeploy(deployd=deployd)
         self.groups = self._resolve_role_groups(groupsd)
 
-
     def serialize(self):
         rd = dict()
         for k, g in self.groups.items():
@@ -65,30 +128,123 @@ class Stackspec(Apspec):
         return rg
 
 
-class StackDeploy(object):
+class StackDeploy(Slotted):
+    __slots__ = ("git", "branch", "metafile")
+
     def __init__(self, deployd):
         self.git = deployd.get('git')
         self.branch = deployd.get('branch')
         self.metafile = deployd.get('metafile', "meta.yml")
 
-class Rolegroup(object):
+
+class Rolegroup(Slotted):
+    __slots__ = ("name", "order", "instanced", "roles", "rollout")
+
     def __init__(self, name, refsd):
         self.name = name
         self.order = refsd.get('order')
         self.instanced = refsd.get('instance')
         self.roles = refsd.get('roles')
+        # batch sizes of rolling changes, see planner.RolloutPolicy
+        self.rollout = refsd.get('rollout')
 
     def serialize(self):
         return dict(name=self.name,
                     order=self.order,
                     roles=self.roles,
-                    instance=self.instanced)
-
-
-
-
-
-
-
+                    instance=self.instanced,
+                    rollout=self.rollout)
 
 
+class Field(object):
+    """
+    Schema of one value. kinds are the accepted python types.
+    fields (name -> Field) describe the keys of a dict, values the
+    values of a dict with arbitrary keys and items the items of a list
+    """
+    def __init__(self, kinds, required=False, fields=None, values=None, items=None, check=None, nonempty=False):
+        self.kinds = kinds
+        self.required = required
+        self.fields = fields
+        self.values = values
+        self.items = items
+        # check(value) returns an error message or None
+        self.check = check
+        self.nonempty = nonempty
+
+    def validate(self, value, path, errors):
+        if value is None:
+            if self.required:
+                errors.append("{0}: required".format(path))
+            return
+        # bool is an int in python. Only accept it where it is asked for
+        if not isinstance(value, self.kinds) or (isinstance(value, bool) and bool not in self.kinds):
+            errors.append("{0}: expected {1}, got {2}".format(path, "/".join(k.__name__ for k in self.kinds),
+                                                              type(value).__name__))
+            return
+        if self.nonempty and not value:
+            errors.append("{0}: must not be empty".format(path))
+        if self.check:
+            error = self.check(value)
+            if error:
+                errors.append("{0}: {1}".format(path, error))
+        if self.fields:
+            for (name, field) in self.fields.items():
+                field.validate(value.get(name), "{0}.{1}".format(path, name), errors)
+        if self.values:
+            for (key, item) in sorted(value.items()):
+                self.values.validate(item, "{0}.{1}".format(path, key), errors)
+        if self.items:
+            for (i, item) in enumerate(value):
+                self.items.validate(item, "{0}[{1}]".format(path, i), errors)
+
+
+def _port(value):
+    if not 0 < value < 65536:
+        return "not a port number"
+
+
+def _not_negative(value):
+    if value < 0:
+        return "must not be negative"
+
+
+def _batch(value):
+    if isinstance(value, basestring):
+        percent = value[:-1] if value.endswith("%") else None
+        if not percent or not percent.isdigit() or not 0 < int(percent) <= 100:
+            return "expected a count or a percentage like 25%"
+    elif value < 1:
+        return "must be at least 1"
+
+
+_str = (basestring,)
+_int = (int, long)
+_scalar = (basestring, int, long, float, bool)
+
+SPEC_SCHEMAS = dict(
+    stack=Field((dict,), required=True, fields=dict(
+        type=Field(_str, required=True),
+        name=Field(_str, required=True),
+        infrastructure=Field(_str, required=True),
+        org=Field(_str),
+        domain=Field(_str),
+        description=Field(_str),
+        deploy=Field((dict,), required=True, fields=dict(
+            git=Field(_str, required=True),
+            branch=Field(_str),
+            metafile=Field(_str))),
+        **{"role-groups": Field((dict,), required=True, nonempty=True, values=Field((dict,), required=True, fields=dict(
+            order=Field(_int),
+            rollout=Field((dict,), fields=dict(
+                max_surge=Field(_int + _str, check=_batch),
+                max_unavailable=Field(_int + _str, check=_batch))),
+            roles=Field((list,), required=True, nonempty=True, items=Field(_str, required=True)),
+            instance=Field((dict,), required=True, fields=dict(
+                id=Field(_str, required=True),
+                type=Field(_str, required=True),
+                count=Field(_int, required=True, check=_not_negative),
+                key_pair=Field(_str),
+                routable=Field((bool,)),
+                ports=Field((list,), items=Field(_int, required=True, check=_port)),
+                tags=Field((dict,), values=Field(_scalar)))))))})))
@@ -0,0 +1,177 @@
+#! /usr/bin/python
+import math
+from collections import OrderedDict
+
+
+class PlanAction(object):
+    """
+    What a deploy has to do for a role group
+    """
+    Skip = "skip"
+    # no instances yet
+    Provision = "provision"
+    # the instance shape changed. New instances are provisioned
+    Replace = "replace"
+    ScaleOut = "scale_out"
+    ScaleIn = "scale_in"
+    # roles or the deploy source changed. Instances are kept
+    Install = "install"
+
+
+class RolloutPolicy(object):
+    """
+    Batch sizes of a rolling change. max_surge is the number of instances
+    provisioned per batch, max_unavailable the number of instances terminated
+    or reinstalled per batch. Both are counts or percentages ("25%") of the
+    instances changed. None changes all instances in one batch
+    """
+    def __init__(self, max_surge=None, max_unavailable=None):
+        self.max_surge = max_surge
+        self.max_unavailable = max_unavailable
+
+    @staticmethod
+    def for_role_group(role_group, apenv=None):
+        """
+        The role group's rollout spec. Missing values default to
+        ROLLOUT_MAX_SURGE and ROLLOUT_MAX_UNAVAILABLE in apenv
+        """
+        rollout = role_group.rollout or {}
+        defaults = apenv or {}
+        return RolloutPolicy(max_surge=rollout.get("max_surge", defaults.get("ROLLOUT_MAX_SURGE")),
+                             max_unavailable=rollout.get("max_unavailable", defaults.get("ROLLOUT_MAX_UNAVAILABLE")))
+
+    def surge(self, total):
+        return self._batch_size(self.max_surge, total)
+
+    def unavailable(self, total):
+        return self._batch_size(self.max_unavailable, total)
+
+    def batches(self, items, size):
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _batch_size(self, value, total):
+        if value is None:
+            return max(total, 1)
+        if isinstance(value, basestring):
+            # percentages round up so every batch makes progress
+            return max(int(math.ceil(total * float(value.rstrip("%")) / 100)), 1)
+        return max(value, 1)
+
+
+class RoleGroupPlan(object):
+    """
+    Planned change for one role group
+    delta is the number of instances added (scale out) or removed (scale in).
+    install is set when roles have to be (re)installed on the existing instances
+    """
+    def __init__(self, name, action, delta=0, install=False, reasons=None):
+        self.name = name
+        self.action = action
+        self.delta = delta
+        self.install = install
+        self.reasons = reasons or []
+
+    def serialize(self):
+        return dict(name=self.name, action=self.action, delta=self.delta,
+                    install=self.install, reasons=self.reasons)
+
+
+class StackPlan(object):
+    """
+    Minimal set of changes that brings the materialized stack to the desired spec
+    """
+    def __init__(self, domain_init, stack_init, role_groups, removed=None):
+        self.domain_init = domain_init
+        self.stack_init = stack_init
+        self.role_groups = role_groups
+        # materialized role groups that are not in the spec any more
+        self.removed = removed or []
+
+    def changed(self):
+        return [p for p in self.role_groups.values() if p.action != PlanAction.Skip]
+
+    def is_empty(self):
+        return not self.domain_init and not self.stack_init and not self.changed()
+
+    def serialize(self):
+        return dict(domain_init=self.domain_init,
+                    stack_init=self.stack_init,
+                    role_groups=[p.serialize() for p in self.role_groups.values()],
+                    removed=self.removed)
+
+
+class StackPlanner(object):
+    """
+    Diffs a Stackspec against the materialized spec of the stack
+    (dict(domain, stack, role_groups) as kept in the workflow state or StackStore)
+    """
+    # spec instance key -> materialized instance_spec key. A change means new instances
+    shape_fields = (("id", "image_id"), ("type", "instance_type"), ("key_pair", "key_pair_name"))
+
+    def __init__(self, stack_spec, materialized=None):
+        self.stack_spec = stack_spec
+        self.materialized = materialized or {}
+
+    def plan(self):
+        mrole_groups = self.materialized.get("role_groups") or {}
+        role_groups = OrderedDict()
+        for name in sorted(self.stack_spec.groups.keys()):
+            role_groups[name] = self.plan_role_group(self.stack_spec.groups[name], mrole_groups.get(name))
+        removed = sorted(name for name in mrole_groups.keys() if name not in self.stack_spec.groups)
+        return StackPlan(domain_init=not self.materialized.get("domain"),
+                         stack_init=not self.materialized.get("stack"),
+                         role_groups=role_groups,
+                         removed=removed)
+
+    def plan_role_group(self, role_group, mrole_group):
+        name = role_group.name
+        if not mrole_group or not mrole_group.get("instances"):
+            return RoleGroupPlan(name, PlanAction.Provision, install=True, reasons=["not provisioned"])
+
+        instanced = role_group.instanced or {}
+        reasons = []
+        for (field, mfield) in self.shape_fields:
+            if instanced.get(field) != mrole_group.get(mfield):
+                reasons.append("{0} changed".format(field))
+        if self._ports(instanced) != self._materialized_ports(mrole_group):
+            reasons.append("ports changed")
+        if bool(instanced.get("routable")) != bool(mrole_group.get("associate_public_ip")):
+            reasons.append("routable changed")
+        if reasons:
+            return RoleGroupPlan(name, PlanAction.Replace, install=True, reasons=reasons)
+
+        install_reasons = []
+        if mrole_group.get("roles") != role_group.roles:
+            install_reasons.append("roles changed")
+        if mrole_group.get("deploy") != self.deploy_source():
+            install_reasons.append("deploy source changed")
+
+        current = len(mrole_group.get("instances"))
+        target = instanced.get("count", current)
+        if target > current:
+            return RoleGroupPlan(name, PlanAction.ScaleOut, delta=target - current, install=bool(install_reasons),
+                                 reasons=["count {0} -> {1}".format(current, target)] + install_reasons)
+        if target < current:
+            return RoleGroupPlan(name, PlanAction.ScaleIn, delta=current - target, install=bool(install_reasons),
+                                 reasons=["count {0} -> {1}".format(current, target)] + install_reasons)
+        if mrole_group.get("retired_instances"):
+            # a previous rollout did not finish terminating instances
+            return RoleGroupPlan(name, PlanAction.ScaleIn, delta=0, install=bool(install_reasons),
+                                 reasons=["{0} retired instances".format(len(mrole_group["retired_instances"]))] +
+                                 install_reasons)
+        if install_reasons:
+            return RoleGroupPlan(name, PlanAction.Install, install=True, reasons=install_reasons)
+        return RoleGroupPlan(name, PlanAction.Skip)
+
+    def deploy_source(self):
+        """
+        What DeployRole records as the deploy source of installed roles
+        """
+        deploy = self.stack_spec.deploy
+        return dict(git=deploy.git, branch=deploy.branch)
+
+    def _ports(self, instanced):
+        return sorted(instanced.get("ports") or [])
+
+    def _materialized_ports(self, mrole_group):
+        return sorted(auth.get("from") for auth in mrole_group.get("auth_spec") or [])
@@ -1,7 +1,52 @@
 #! /usr/bin/python
+from autopilot.protocol.message import Message
+from autopilot.specifications.planner import PlanAction, RolloutPolicy
+from autopilot.stores.stackstore import StackStore
 from autopilot.workflows.tasks.task import Task, TaskResult, TaskState
 
 
+def get_stack_store(task):
+    """
+    StackStore for the stack of task when a "state_store" is configured in apenv
+    """
+    store = task.apenv.get("state_store")
+    if store is None:
+        return None
+    stack_spec = task.properties.get("stack_spec")
+    return StackStore(stack_spec.org, stack_spec.domain, store=store)
+
+
+def load_materialized(task):
+    """
+    Fills the materialized spec in the workflow state from the stack store
+    if the workflow was started without it. Returns the materialized spec
+    """
+    stack_state = task.workflow_state.get("stack_spec")
+    if not stack_state.get("materialized"):
+        stack_store = get_stack_store(task)
+        if stack_store:
+            materialized = stack_store.get_stack(task.properties.get("stack_spec").name)
+            if materialized:
+                stack_state.update(dict(materialized=materialized))
+    return stack_state.get("materialized")
+
+
+def save_materialized(task, role_group=None):
+    """
+    Writes the materialized spec (or only role_group) to the stack store
+    """
+    stack_store = get_stack_store(task)
+    if not stack_store:
+        return
+    stack_name = task.properties.get("stack_spec").name
+    materialized = task.workflow_state.get("stack_spec").get("materialized")
+    if role_group:
+        stack_store.save_role_group(stack_name, role_group, materialized["role_groups"][role_group])
+    else:
+        stack_store.save_stack(stack_name, materialized)
+    stack_store.flush()
+
+
 class DeployRole(Task):
     """
     Provisions a role to 1 or more instances
@@ -13,66 +58,167 @@ class DeployRole(Task):
         Task.__init__(self, apenv, DeployRole.Name, wf_id, inf, properties, workflow_state)
 
     def serialize(self):
-        return dict(name=self.name,
-                    properties=dict(role_group=self.properties["role_group"].serialize()))
+        properties = dict(role_group=self.properties["role_group"].serialize())
+        if self.properties.get("plan"):
+            properties["plan"] = self.properties["plan"].serialize()
+        return dict(name=self.name, properties=properties)
 
     def on_run(self, callback):
         """
         1. Verifies we have the required materialized domain and stack specs
-        2. Checks if we have instances provisined for the role. If not first provision them
+        2. Provisions, scales or keeps the instances of the role group as planned
+           (properties["plan"], a RoleGroupPlan). Without a plan instances are
+           only provisioned if the role group has none
         3. Call into ap agents on the images to deploy the the images
+
+        Changes roll out in batches (see RolloutPolicy). Every batch of new
+        instances has to answer and install the roles before the next batch
+        starts and replaced or scaled in instances are terminated a batch at
+        a time while the remaining instances stay healthy. Instances waiting
+        to be terminated are kept in "retired_instances" so a failed rollout
+        is finished by the next deploy
         """
         # check what we have materialized (what is already installed and running)
         # in the workflow state.
-        materialized_spec = self.workflow_state.get("stack_spec").get("materialized")
+        materialized_spec = load_materialized(self)
         # todo: Handle the case when domains and stacks are not materialized.
         # Throw exception
 
         mdomain_spec = materialized_spec.get("domain")
         mstack_spec = materialized_spec.get("stack")
         mrole_groups = materialized_spec.get("role_groups")
-
-        #todo: Handle upgrade, scale out and scale back case
+        if not mrole_groups:
+            mrole_groups = {}
+            materialized_spec.update(dict(role_groups=mrole_groups))
 
         # get the target role groups and roles from the properties
         target_role_group = self.properties.get("role_group")
         target_role_group_name = target_role_group.name
+        mrole_group = mrole_groups.get(target_role_group_name)
+        plan = self.properties.get("plan")
+        action = plan.action if plan else None
+        rollout = RolloutPolicy.for_role_group(target_role_group, self.apenv)
+
+        reinstall = []
+        if not mrole_group or action in (PlanAction.Provision, PlanAction.Replace):
+            # new instances for the whole role group. The previous ones are retired
+            retired = (mrole_group.get("retired_instances", []) + mrole_group.get("instances", [])) \
+                if mrole_group else []
+            mrole_group = mrole_groups[target_role_group_name] = self._instance_spec(target_role_group, 0)
+            mrole_group["instances"] = []
+            to_add = target_role_group.instanced["count"]
+        else:
+            retired = mrole_group.get("retired_instances", [])
+            to_add = 0
+            if action == PlanAction.ScaleOut:
+                to_add = plan.delta
+            elif action == PlanAction.ScaleIn:
+                # the newest instances go first
+                keep = len(mrole_group["instances"]) - plan.delta
+                retired = retired + mrole_group["instances"][keep:]
+                mrole_group["instances"] = mrole_group["instances"][:keep]
+                mrole_group["instance_count"] = keep
+            if not plan or plan.install or action == PlanAction.Install:
+                reinstall = list(mrole_group["instances"])
+        mrole_group["retired_instances"] = retired
+        save_materialized(self, role_group=target_role_group_name)
+
+        # agents are only contacted when the controller has a client configured
+        agent_client = self.apenv.get("agent_client")
+        surge = rollout.surge(to_add)
+        unavailable = rollout.unavailable(max(len(retired), len(reinstall)))
+
+        # roles are reinstalled on the running instances max_unavailable at a time
+        for batch in rollout.batches(reinstall, unavailable):
+            error = self._install_batch(agent_client, batch, mdomain_spec)
+            if error:
+                callback(TaskState.Error, *error)
+                return
+
+        while to_add or retired:
+            if to_add:
+                count = min(surge, to_add)
+                rc = self._provision(mdomain_spec, mstack_spec, target_role_group, count)
+                if rc.errors:
+                    callback(TaskState.Error, ["Provisioning {0} instances failed".format(count)], rc.errors)
+                    return
+                added = rc.spec.get("instances", [])
+                instances = mrole_group["instances"] + added
+                mrole_group.update(rc.spec)
+                mrole_group["instances"] = instances
+                mrole_group["instance_count"] = len(instances)
+                to_add -= count
+                save_materialized(self, role_group=target_role_group_name)
+                error = self._install_batch(agent_client, added, mdomain_spec)
+                if error:
+                    callback(TaskState.Error, *error)
+                    return
+
+            if retired:
+                batch = retired[:unavailable]
+                rc = self.inf.terminate_instances(domain_spec=mdomain_spec, stack_spec=mstack_spec, instances=batch)
+                if rc.errors:
+                    callback(TaskState.Error, ["Terminating {0} instances failed".format(len(batch))], rc.errors)
+                    return
+                retired = mrole_group["retired_instances"] = retired[len(batch):]
+                save_materialized(self, role_group=target_role_group_name)
+
+            # health gate. The instances in service have to answer before the next batch
+            if (to_add or retired) and agent_client:
+                missing = self._wait_for_instance_agents(agent_client, mrole_group["instances"])
+                if missing:
+                    callback(TaskState.Error, ["Health gate failed. Agents not reachable on: {0}"
+                                               .format(", ".join(missing))], [])
+                    return
+
+        # what is installed. The planner diffs the next deploy against it
+        deploy = self.properties.get("stack_spec").deploy
+        mrole_group["roles"] = target_role_group.roles
+        mrole_group["deploy"] = dict(git=deploy.git, branch=deploy.branch)
+        save_materialized(self, role_group=target_role_group_name)
+        callback(TaskState.Done, ["Task {0} done".format(self.name)], [])
 
-        # if instances are not materialized then create instances first.
-        if not mrole_groups or not mrole_groups.get(target_role_group_name):
-            # todo: Throw exception if we do not have enough information in target_role_group
-            uname = "{0}_{1}".format(self.properties.get("stack_spec").domain, target_role_group_name)
-            instance_spec = dict(uname=uname)
-
-            auth_spec = []
-            if target_role_group.instanced.get("ports"):
-                for port in target_role_group.instanced.get("ports"):
-                    auth_spec.append({"protocol": "tcp", "from": port, "to": port})
-            instance_spec["auth_spec"] = auth_spec
-            if target_role_group.instanced.get("routable"):
-                instance_spec["associate_public_ip"] = target_role_group.instanced.get("routable")
-
-            instance_spec["instance_count"] = target_role_group.instanced["count"]
-            instance_spec["instance_type"] = target_role_group.instanced["type"]
-            instance_spec["image_id"] = target_role_group.instanced["id"]
-            instance_spec["key_pair_name"] = target_role_group.instanced["key_pair"]
-            instance_spec["tags"] = target_role_group.instanced.get("tags", {})
-            rc_instances = self.inf.provision_instances(domain_spec=mdomain_spec, stack_spec=mstack_spec,
-                                                        instance_spec=instance_spec)
-
-            # update materialized role groups
-            if not mrole_groups:
-                mrole_groups = {}
-                materialized_spec.update(dict(role_groups=mrole_groups))
-            mrole_groups[target_role_group_name] = rc_instances.spec
-
+    def _install_batch(self, agent_client, instances, mdomain_spec):
+        """
+        Waits for the agents on instances and installs the roles.
+        Returns (messages, exceptions) of the failure or None
+        """
+        if not agent_client or not instances:
+            return None
         # verify if agents are running on each instance
-        self._wait_for_instance_agents()
+        missing = self._wait_for_instance_agents(agent_client, instances)
+        if missing:
+            return ["Agents not reachable on: {0}".format(", ".join(missing))], []
 
         # call into the agents and deploy the role
-        self._install_roles()
-
-        callback(TaskState.Done, ["Task {0} done".format(self.name)], [])
+        errors = self._install_roles(agent_client, instances, mdomain_spec)
+        if errors:
+            return ["Role install failed on {0} instances".format(len(errors))], errors
+        return None
+
+    def _instance_spec(self, target_role_group, count):
+        # todo: Throw exception if we do not have enough information in target_role_group
+        uname = "{0}_{1}".format(self.properties.get("stack_spec").domain, target_role_group.name)
+        instance_spec = dict(uname=uname)
+
+        auth_spec = []
+        if target_role_group.instanced.get("ports"):
+            for port in target_role_group.instanced.get("ports"):
+                auth_spec.append({"protocol": "tcp", "from": port, "to": port})
+        instance_spec["auth_spec"] = auth_spec
+        if target_role_group.instanced.get("routable"):
+            instance_spec["associate_public_ip"] = target_role_group.instanced.get("routable")
+
+        instance_spec["instance_count"] = count
+        instance_spec["instance_type"] = target_role_group.instanced["type"]
+        instance_spec["image_id"] = target_role_group.instanced["id"]
+        instance_spec["key_pair_name"] = target_role_group.instanced.get("key_pair")
+        instance_spec["tags"] = target_role_group.instanced.get("tags", {})
+        return instance_spec
+
+    def _provision(self, mdomain_spec, mstack_spec, target_role_group, count):
+        return self.inf.provision_instances(domain_spec=mdomain_spec, stack_spec=mstack_spec,
+                                            instance_spec=self._instance_spec(target_role_group, count))
 
     def on_rollback(self, callback):
         """
@@ -80,21 +226,43 @@ class DeployRole(Task):
         """
         pass
 
-    def _wait_for_instance_agents(self, instances=[]):
+    def _wait_for_instance_agents(self, agent_client, instances=[]):
         """
         Check if instances are up and agents have been registered
+        Returns the hosts without a responding agent
         """
-        pass
+        return agent_client.wait_for_agents([self._agent_host(instance) for instance in instances],
+                                            timeout=self.apenv.get("AGENT_WAIT_TIMEOUT", 300))
 
-    def _install_roles(self):
+    def _install_roles(self, agent_client, instances, domain_spec):
         """
          1. Setup the environment parameters
             - Current role parameters
             - Stack parameters
          2. Wrap into a message
-         3. Send it to the remote agent.
+         3. Send it to the remote agents. Messages go out concurrently
+            through the client's bounded window
+        Returns the exceptions of the failed installs
         """
-        pass
+        target_role_group = self.properties.get("role_group")
+        stack_spec = self.properties.get("stack_spec")
+        messages = []
+        for instance in instances:
+            host = self._agent_host(instance)
+            messages.append((host, Message(type="stack-deploy",
+                                           headers={"domain": domain_spec.get("domain") if domain_spec else None},
+                                           data={"target_role_group": target_role_group.name, "stack": stack_spec},
+                                           identifier="{0}_{1}".format(self.wf_id, host))))
+        errors = []
+        for future in agent_client.send_all(messages):
+            try:
+                future.get()
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def _agent_host(self, instance):
+        return instance.get("private_ip_address") or instance.get("public_dns_name")
 
 
 class DomainInit(Task):
@@ -111,10 +279,11 @@ class DomainInit(Task):
 
     def on_run(self, callback):
         # init domain only if we do not have a materiazlied domain
-        if not self.workflow_state.get("stack_spec").get("materialized"):
+        if not load_materialized(self):
             domain_spec = dict(domain=self.properties.get("stack_spec").domain)
             rc = self.inf.init_domain(domain_spec=domain_spec)
             self.workflow_state["stack_spec"].update(dict(materialized=dict(domain=rc.spec)))
+            save_materialized(self)
 
         callback(TaskState.Done, ["Task {0} done".format(self.name)], [])
 
@@ -141,7 +310,7 @@ class StackInit(Task):
         """
         Initialize stack
         """
-        materialized_spec = self.workflow_state.get("stack_spec").get("materialized")
+        materialized_spec = load_materialized(self)
         if not materialized_spec:
             # todo: throw exception here since we do not have a domain
             pass
@@ -152,6 +321,7 @@ class StackInit(Task):
 
             # update workflow state with updated spec
             materialized_spec.update(dict(stack=rc.spec))
+            save_materialized(self)
 
         callback(TaskState.Done, ["Task {0} done".format(self.name)], [])
 
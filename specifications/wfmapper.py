@@ -3,14 +3,17 @@ import uuid
 from autopilot.common import utils
 from autopilot.workflows.tasks.group import Group, GroupSet
 from autopilot.workflows.workflowmodel import WorkflowModel
+from autopilot.stores.stackstore import StackStore
+from autopilot.specifications.planner import StackPlanner
 from autopilot.specifications.tasks.deployrole import DomainInit, StackInit, DeployRole
 
 
 class StackMapper(object):
     """
     Mapper class that maps stack spec into a workflow spec
+    The workflow only contains the tasks of the plan (see StackPlanner)
     """
-    def __init__(self, apenv, wf_id, org, domain, owner, stack_spec, stack_state={}):
+    def __init__(self, apenv, wf_id, org, domain, owner, stack_spec, stack_state={}, full_deploy=False):
         self.apenv = apenv
         self.wf_id = wf_id
         self.type = 'stack.deploy'
@@ -20,6 +23,8 @@ class StackMapper(object):
         self.domain = domain
         self.stack_spec = stack_spec
         self.stack_state = stack_state
+        self.full_deploy = full_deploy
+        self.plan = None
         self.inf = self._resolve_inf()
         self.taskgroups = self._build_task_groups()
 
@@ -41,49 +46,66 @@ class StackMapper(object):
         return self.apenv.get_inf_resolver(self.wf_id).resolve(apenv=self.apenv, target=target,
                                                                properties=properties)
 
+    def _materialized(self):
+        """
+        Materialized spec from the workflow state or the configured state store
+        """
+        materialized = (self.stack_state.get("stack_spec") or {}).get("materialized")
+        if not materialized and self.apenv.get("state_store"):
+            stack_store = StackStore(self.org, self.domain, store=self.apenv.get("state_store"))
+            materialized = stack_store.get_stack(self.stack_spec.name)
+        return materialized
+
     def _build_task_groups(self):
         """
-        We always add domain init and stack init tasks to task groups even if
-        they might not be needed (eg if there is an existing domain and stack).
-        We will let the inf implementation check if there is one and its
-        healthy.
+        The planner diffs the stack spec against what is materialized.
+        Domain and stack init are only added when they are missing and
+        only role groups that changed get a DeployRole task.
+        With full_deploy every task is added and the tasks check what exists
         """
         groups = []
+        if self.full_deploy:
+            self.plan = StackPlanner(self.stack_spec).plan()
+        else:
+            self.plan = StackPlanner(self.stack_spec, self._materialized()).plan()
+
         #domain init task group
-        domain_init_task = DomainInit(apenv=self.apenv,
-                                      wf_id=self.wf_id,
-                                      inf=self.inf,
-                                      properties=dict(stack_spec=self.stack_spec),
-                                      workflow_state=self.stack_state)
+        if self.plan.domain_init:
+            domain_init_task = DomainInit(apenv=self.apenv,
+                                          wf_id=self.wf_id,
+                                          inf=self.inf,
+                                          properties=dict(stack_spec=self.stack_spec),
+                                          workflow_state=self.stack_state)
 
-        groups.append(Group(wf_id=self.wf_id, apenv=self.apenv, groupid="domain_init", tasks=[domain_init_task]))
+            groups.append(Group(wf_id=self.wf_id, apenv=self.apenv, groupid="domain_init", tasks=[domain_init_task]))
 
         #stack init
-        stack_init_task = StackInit(apenv=self.apenv,
-                                    wf_id=self.wf_id,
-                                    inf=self.inf,
-                                    properties=dict(stack_spec=self.stack_spec),
-                                    workflow_state=self.stack_state)
+        if self.plan.stack_init:
+            stack_init_task = StackInit(apenv=self.apenv,
+                                        wf_id=self.wf_id,
+                                        inf=self.inf,
+                                        properties=dict(stack_spec=self.stack_spec),
+                                        workflow_state=self.stack_state)
 
-        groups.append(Group(wf_id=self.wf_id, apenv=self.apenv, groupid="stack_init", tasks=[stack_init_task]))
+            groups.append(Group(wf_id=self.wf_id, apenv=self.apenv, groupid="stack_init", tasks=[stack_init_task]))
 
         # Deploy roles
         # todo scale units(rolling upgrades). We need a canary role
 
         ordered_role_groups = []
         parallel_role_groups = []
-        for (key, role_group) in self.stack_spec.groups.items():
+        for role_group_plan in self.plan.changed():
+            role_group = self.stack_spec.groups[role_group_plan.name]
             if role_group.order:
                 ordered_role_groups.append(role_group)
             else:
                 # we will add this to a group for parallel execution.
                 parallel_role_groups.append(role_group)
 
-
         def _role_group_cmp(g1, g2):
-            if g1.x == g2.x:
+            if g1.order == g2.order:
                 return 0
-            if g1.x < g2.x:
+            if g1.order < g2.order:
                 return -1
             return 1
 
@@ -91,10 +113,7 @@ class StackMapper(object):
         # after they are sorted
         ordered_role_groups.sort(cmp=_role_group_cmp)
         for role_group in ordered_role_groups:
-            properties = dict(stack_spec=self.stack_spec, role_group=role_group)
-            task = DeployRole(apenv=self.apenv, wf_id=self.wf_id, inf=self.inf,
-                              properties=properties, workflow_state=self.stack_state)
-
+            task = self._deploy_role_task(role_group)
             groups.append(Group(wf_id=self.wf_id, apenv=self.apenv,
                                 groupid="ordered_deploy_roles_{0}".format(role_group.order),
                                 tasks=[task]))
@@ -102,16 +121,18 @@ class StackMapper(object):
         # for parallel role groups we only need one task group
         parallel_tasks = []
         for role_group in parallel_role_groups:
-            properties = dict(stack_spec=self.stack_spec, role_group=role_group)
-
-            task = DeployRole(apenv=self.apenv, wf_id=self.wf_id, inf=self.inf,
-                              properties=properties,
-                              workflow_state=self.stack_state)
-            parallel_tasks.append(task)
+            parallel_tasks.append(self._deploy_role_task(role_group))
 
         if parallel_tasks:
             groups.append(Group(wf_id=self.wf_id, apenv=self.apenv,
                                 groupid="parallel_deploy_roles",
                                 tasks=parallel_tasks))
 
-        return GroupSet(groups)
\ No newline at end of file
+        return GroupSet(groups)
+
+    def _deploy_role_task(self, role_group):
+        properties = dict(stack_spec=self.stack_spec, role_group=role_group)
+        if not self.full_deploy:
+            properties["plan"] = self.plan.role_groups[role_group.name]
+        return DeployRole(apenv=self.apenv, wf_id=self.wf_id, inf=self.inf,
+                          properties=properties, workflow_state=self.stack_state)
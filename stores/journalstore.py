@@ -0,0 +1,99 @@
+#! /usr/bin python
+
+import os
+import json
+import time
+
+
+class JournalStore(object):
+    """
+    Append only journal of workflow state transitions.
+    Records are dicts. Implementations only have to keep them in append order per workflow
+    """
+    def append(self, wf_id, record, sync=False):
+        pass
+
+    def read(self, wf_id):
+        return []
+
+    def flush(self, wf_id=None):
+        pass
+
+    def close(self, wf_id=None):
+        pass
+
+
+class FileJournalStore(JournalStore):
+    """
+    One json-lines file per workflow under journal_dir.
+    fsync is batched: we sync every sync_every records, when sync_interval seconds
+    have passed since the last sync or when the caller asks for it (checkpoints).
+    Records written after the last sync can be lost on a crash which only
+    means the affected tasks are executed again on resume
+    """
+    def __init__(self, journal_dir, sync_every=32, sync_interval=1.0):
+        self.journal_dir = journal_dir
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.files = {}
+        self.pending = {}
+        self.last_sync = {}
+        if not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+
+    def append(self, wf_id, record, sync=False):
+        f = self._open(wf_id)
+        f.write(json.dumps(record, sort_keys=True, default=str))
+        f.write("\n")
+        self.pending[wf_id] += 1
+        if sync or self.pending[wf_id] >= self.sync_every or \
+                time.time() - self.last_sync[wf_id] >= self.sync_interval:
+            self._sync(wf_id)
+
+    def read(self, wf_id):
+        path = self._path(wf_id)
+        if wf_id in self.files:
+            self.files[wf_id].flush()
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # partial record from a crash mid write. Nothing after it was synced
+                    break
+        return records
+
+    def flush(self, wf_id=None):
+        for key in ([wf_id] if wf_id else self.files.keys()):
+            if key in self.files:
+                self._sync(key)
+
+    def close(self, wf_id=None):
+        for key in ([wf_id] if wf_id else self.files.keys()):
+            if key in self.files:
+                self._sync(key)
+                self.files.pop(key).close()
+                self.pending.pop(key, None)
+                self.last_sync.pop(key, None)
+
+    def _open(self, wf_id):
+        f = self.files.get(wf_id)
+        if f is None:
+            f = open(self._path(wf_id), "a")
+            self.files[wf_id] = f
+            self.pending[wf_id] = 0
+            self.last_sync[wf_id] = time.time()
+        return f
+
+    def _sync(self, wf_id):
+        f = self.files[wf_id]
+        f.flush()
+        os.fsync(f.fileno())
+        self.pending[wf_id] = 0
+        self.last_sync[wf_id] = time.time()
+
+    def _path(self, wf_id):
+        return os.path.join(self.journal_dir, "{0}.journal".format(wf_id))
@@ -1,12 +1,59 @@
 #! /usr/bin python
 
+from autopilot.stores.statestore import StateKey, MemoryStateStore
 
-class StackStore(object):
 
-    def __init__(self, org, domain):
+class StackStore(object):
+    """
+    Materialized specs of the stacks of a domain.
+    The domain and stack specs are one document per stack and every
+    role group has its own document, so a deploy only reads and writes
+    the role groups it touches
+    """
+    def __init__(self, org, domain, store=None):
         self.org = org
         self.domain = domain
+        self.store = store or MemoryStateStore()
 
     def get_stack(self, stack_name):
-        pass
+        """
+        Returns the materialized spec dict(domain, stack, role_groups) or None
+        """
+        records = self.store.find(self.org, domain=self.domain, stack=stack_name)
+        if not records:
+            return None
+        materialized = {}
+        role_groups = {}
+        for (key, doc) in records:
+            if key.role_group is None:
+                materialized.update(doc)
+            else:
+                role_groups[key.role_group] = doc
+        if role_groups:
+            materialized["role_groups"] = role_groups
+        return materialized
+
+    def save_stack(self, stack_name, materialized):
+        """
+        Stores the domain and stack specs and every role group in materialized
+        """
+        stack_doc = dict((k, v) for (k, v) in materialized.items() if k != "role_groups")
+        items = [(self._key(stack_name), stack_doc)]
+        for (role_group, spec) in (materialized.get("role_groups") or {}).items():
+            items.append((self._key(stack_name, role_group), spec))
+        self.store.put_many(items)
+
+    def get_role_group(self, stack_name, role_group):
+        return self.store.get(self._key(stack_name, role_group))
+
+    def save_role_group(self, stack_name, role_group, spec):
+        self.store.put(self._key(stack_name, role_group), spec)
+
+    def delete_role_group(self, stack_name, role_group):
+        self.store.delete(self._key(stack_name, role_group))
+
+    def flush(self):
+        self.store.flush()
 
+    def _key(self, stack_name, role_group=None):
+        return StateKey(self.org, self.domain, stack_name, role_group)
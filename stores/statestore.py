@@ -0,0 +1,254 @@
+#! /usr/bin python
+
+import json
+import time
+import sqlite3
+from collections import namedtuple
+from autopilot.common.cache import TTLCache
+from autopilot.common.exception import AutopilotException
+
+
+class StateKey(namedtuple("StateKey", ["org", "domain", "stack", "role_group"])):
+    """
+    Identifies a state document. role_group is None for the stack level
+    document (materialized domain and stack specs)
+    """
+    def __new__(cls, org, domain, stack, role_group=None):
+        return super(StateKey, cls).__new__(cls, org, domain, stack, role_group)
+
+
+class StateStore(object):
+    """
+    Key/document store for materialized specs. Documents are json serializable dicts.
+    find does prefix lookups on (org, domain, stack, role_group)
+    """
+    def get(self, key):
+        return None
+
+    def put(self, key, doc):
+        self.put_many([(key, doc)])
+
+    def put_many(self, items):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def find(self, org, domain=None, stack=None, role_group=None):
+        """
+        Returns [(key, doc)] for the keys that match all given parts
+        """
+        return []
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """
+    Dict backed store. Nothing survives the process
+    """
+    def __init__(self):
+        self.docs = {}
+
+    def get(self, key):
+        doc = self.docs.get(key)
+        return json.loads(doc) if doc is not None else None
+
+    def put_many(self, items):
+        for (key, doc) in items:
+            # stored serialized so callers never share a document with the store
+            self.docs[key] = json.dumps(doc)
+
+    def delete(self, key):
+        self.docs.pop(key, None)
+
+    def find(self, org, domain=None, stack=None, role_group=None):
+        return [(key, json.loads(doc)) for (key, doc) in sorted(self.docs.items())
+                if _matches(key, org, domain, stack, role_group)]
+
+
+class SqliteStateStore(StateStore):
+    """
+    Embedded store in a single sqlite file.
+    The primary key (org, domain, stack, role_group) doubles as the lookup index
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                          "org TEXT NOT NULL, domain TEXT NOT NULL, stack TEXT NOT NULL, "
+                          "role_group TEXT NOT NULL, doc TEXT NOT NULL, updated REAL NOT NULL, "
+                          "PRIMARY KEY (org, domain, stack, role_group))")
+        self.conn.commit()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT doc FROM state WHERE org=? AND domain=? AND stack=? AND role_group=?",
+                                self._row_key(key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, items):
+        now = time.time()
+        # one transaction for the whole batch
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO state (org, domain, stack, role_group, doc, updated) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  [self._row_key(key) + (json.dumps(doc), now) for (key, doc) in items])
+
+    def delete(self, key):
+        with self.conn:
+            self.conn.execute("DELETE FROM state WHERE org=? AND domain=? AND stack=? AND role_group=?",
+                              self._row_key(key))
+
+    def find(self, org, domain=None, stack=None, role_group=None):
+        clauses = ["org=?"]
+        params = [org]
+        for (column, value) in (("domain", domain), ("stack", stack), ("role_group", role_group)):
+            if value is not None:
+                clauses.append("{0}=?".format(column))
+                params.append(value)
+        rows = self.conn.execute("SELECT org, domain, stack, role_group, doc FROM state WHERE {0} "
+                                 "ORDER BY org, domain, stack, role_group".format(" AND ".join(clauses)), params)
+        return [(StateKey(row[0], row[1], row[2], row[3] or None), json.loads(row[4])) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+    def _row_key(self, key):
+        # NULL never compares equal in sqlite so the stack document uses ""
+        return (key.org, key.domain, key.stack, key.role_group or "")
+
+
+class MongoStateStore(StateStore):
+    """
+    Adapter over a mongo collection (find_one, find, update, remove and
+    ensure_index as in pymongo). One document per key with the
+    spec under "doc"
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.ensure_index([("org", 1), ("domain", 1), ("stack", 1), ("role_group", 1)], unique=True)
+
+    @staticmethod
+    def connect(connection, database="autopilot", collection="state"):
+        try:
+            import pymongo
+        except ImportError:
+            raise AutopilotException("pymongo is required for the mongodb state store")
+        return MongoStateStore(pymongo.MongoClient(connection)[database][collection])
+
+    def get(self, key):
+        record = self.collection.find_one(self._spec(key))
+        return record["doc"] if record else None
+
+    def put_many(self, items):
+        for (key, doc) in items:
+            record = self._spec(key)
+            record.update(doc=doc, updated=time.time())
+            self.collection.update(self._spec(key), record, upsert=True)
+
+    def delete(self, key):
+        self.collection.remove(self._spec(key))
+
+    def find(self, org, domain=None, stack=None, role_group=None):
+        spec = dict(org=org)
+        for (field, value) in (("domain", domain), ("stack", stack), ("role_group", role_group)):
+            if value is not None:
+                spec[field] = value
+        records = self.collection.find(spec)
+        keys = [(StateKey(r["org"], r["domain"], r["stack"], r["role_group"] or None), r["doc"]) for r in records]
+        return sorted(keys, key=lambda kv: kv[0])
+
+    def _spec(self, key):
+        return dict(org=key.org, domain=key.domain, stack=key.stack, role_group=key.role_group or "")
+
+
+class CachedStateStore(StateStore):
+    """
+    Write through cache in front of a backend store.
+    Reads are served from a bounded cache. Writes update the cache right away
+    and reach the backend in batches: every batch_size writes, when
+    flush_interval seconds have passed since the last flush or on flush()
+    """
+    def __init__(self, backend, cache_size=1024, cache_ttl=300, batch_size=64, flush_interval=1.0):
+        self.backend = backend
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.last_flush = time.time()
+
+    def get(self, key):
+        if key in self.pending:
+            return _copy(self.pending[key])
+        doc = self.cache.get_or_load(key, lambda: self.backend.get(key))
+        return _copy(doc)
+
+    def put_many(self, items):
+        for (key, doc) in items:
+            doc = _copy(doc)
+            self.pending[key] = doc
+            self.cache.put(key, doc)
+        if len(self.pending) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def delete(self, key):
+        self.flush()
+        self.cache.invalidate(key)
+        self.backend.delete(key)
+
+    def find(self, org, domain=None, stack=None, role_group=None):
+        # the backend indexes the lookup. Pending writes have to be in it first
+        self.flush()
+        return self.backend.find(org, domain=domain, stack=stack, role_group=role_group)
+
+    def flush(self):
+        if self.pending:
+            items = sorted(self.pending.items())
+            self.pending = {}
+            self.backend.put_many(items)
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+
+def create_state_store(settings):
+    """
+    Returns the CachedStateStore named by State_Store_Provider in settings
+    (a dict, ApEnv or settings module, see Settings.py)
+    """
+    if not hasattr(settings, "get"):
+        settings = vars(settings)
+    provider_settings = settings.get(settings.get("State_Store_Provider")) or {}
+    provider = provider_settings.get("Provider")
+    if provider == "memory":
+        backend = MemoryStateStore()
+    elif provider == "sqlite":
+        backend = SqliteStateStore(provider_settings.get("Path"))
+    elif provider == "mongodb":
+        backend = MongoStateStore.connect(provider_settings.get("Connection"),
+                                          database=provider_settings.get("Database", "autopilot"),
+                                          collection=provider_settings.get("Collection", "state"))
+    else:
+        raise AutopilotException("Unknown state store provider: {0}".format(provider))
+    return CachedStateStore(backend,
+                            cache_size=provider_settings.get("CacheSize", 1024),
+                            batch_size=provider_settings.get("BatchSize", 64),
+                            flush_interval=provider_settings.get("FlushInterval", 1.0))
+
+
+def _matches(key, org, domain, stack, role_group):
+    return key.org == org and \
+        (domain is None or key.domain == domain) and \
+        (stack is None or key.stack == stack) and \
+        (role_group is None or key.role_group == role_group)
+
+
+def _copy(doc):
+    # documents are json so a round trip is a cheap deep copy
+    return json.loads(json.dumps(doc)) if doc is not None else None
@@ -0,0 +1,264 @@
+#! /usr/bin/python
+"""
+Workflow engine benchmarks. Runs offline: tasks are no-ops or sleeps
+on the taskpool, no infrastructure is touched.
+
+    python engine_bench.py                   # run and compare with baseline.json
+    python engine_bench.py --save-baseline   # run and record baseline.json
+    python engine_bench.py --only execute_throughput --tasks-per-group 1000
+
+Exits with 1 when a result is worse than its baseline by more than the
+benchmark threshold
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import argparse
+import resource
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.common.apenv import ApEnv
+from autopilot.common.asyncpool import taskpool
+from autopilot.workflows.tasks.task import Task, TaskState
+from autopilot.workflows.tasks.group import Group, GroupSet
+from autopilot.workflows.workflowmodel import WorkflowModel
+from autopilot.workflows.workflowexecutor import WorkflowExecutor
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# allowed relative regression before a benchmark fails
+DEFAULT_THRESHOLD = 0.25
+
+
+class NoopTask(Task):
+    """
+    Finishes right away. done_at is when it handed its result back
+    """
+    def __init__(self, apenv, wf_id, properties):
+        Task.__init__(self, apenv, "Noop", wf_id, None, properties, {})
+        self.done_at = None
+
+    def on_run(self, callback):
+        self.done_at = time.time()
+        callback(TaskState.Done, [], [])
+
+    def on_rollback(self, callback):
+        callback(TaskState.Rolledback, [], [])
+
+
+class SleepTask(NoopTask):
+    """
+    Yields to the hub for properties["sleep"] seconds
+    """
+    def on_run(self, callback):
+        taskpool.doyield(seconds=self.properties.get("sleep", 0))
+        NoopTask.on_run(self, callback)
+
+
+def build_model(wf_id, groups, tasks_per_group, task_class=NoopTask, properties=None, pool_size=None,
+                domain_pool_size=None):
+    env = {}
+    if pool_size:
+        env.update(WORKFLOW_POOL_SIZE=pool_size)
+    if domain_pool_size:
+        env.update(DOMAIN_POOL_SIZE=domain_pool_size)
+    apenv = ApEnv(env)
+    groupset = GroupSet([Group(wf_id, apenv, "group{0}".format(g),
+                               [task_class(apenv, wf_id, properties or {}) for t in range(tasks_per_group)])
+                         for g in range(groups)])
+    model = WorkflowModel(wf_id=wf_id, type="benchmark", target="local", domain="benchmark",
+                          inf=None, groupset=groupset, workflow_state={})
+    return apenv, model
+
+
+def execute(apenv, model):
+    ex = WorkflowExecutor(apenv=apenv, model=model)
+    ex.execute().get()
+    if not ex.success:
+        raise Exception("benchmark workflow {0} failed".format(model.wf_id))
+    return ex
+
+
+def bench_execute_throughput(args):
+    """
+    Tasks per second through WorkflowExecutor.execute with no-op tasks
+    """
+    ntasks = args.groups * args.tasks_per_group
+    apenv, model = build_model("bench_throughput", args.groups, args.tasks_per_group, pool_size=args.pool_size)
+    start = time.time()
+    execute(apenv, model)
+    elapsed = time.time() - start
+    return dict(tasks_per_second=ntasks / elapsed, elapsed=elapsed, tasks=ntasks)
+
+
+def bench_scheduling_overhead(args):
+    """
+    Engine time per task on top of the task's own sleep. A group runs its
+    sleeps in waves as wide as the smallest of the workflow, domain and
+    global pool sizes, so the ideal wall time is groups * waves * sleep
+    """
+    sleep = 0.01
+    ntasks = args.groups * args.tasks_per_group
+    apenv, model = build_model("bench_overhead", args.groups, args.tasks_per_group, task_class=SleepTask,
+                               properties=dict(sleep=sleep), pool_size=args.tasks_per_group,
+                               domain_pool_size=args.tasks_per_group)
+    start = time.time()
+    ex = execute(apenv, model)
+    elapsed = time.time() - start
+    concurrency = min(ex.pool.capacity, ex.pool.parent.capacity, taskpool.capacity)
+    waves = int(math.ceil(args.tasks_per_group / float(concurrency)))
+    overhead = max(elapsed - args.groups * waves * sleep, 0.0)
+    return dict(overhead_us_per_task=overhead / ntasks * 1e6, elapsed=elapsed, tasks=ntasks, concurrency=concurrency)
+
+
+def bench_callback_latency(args):
+    """
+    Time from a task handing back its result to GroupExecutionContext
+    counting it, and from the last task to the group's final callback
+    """
+    latencies = []
+    final_latencies = []
+    apenv, model = build_model("bench_callback", args.groups, args.tasks_per_group, pool_size=args.pool_size)
+    for group in model.groupset.groups:
+        get_execution_context = group.get_execution_context
+
+        def _timed_context(pool=None, get_execution_context=get_execution_context):
+            ec = get_execution_context(pool=pool)
+            task_callback = ec._task_callback
+
+            def _timed_task_callback(task):
+                latencies.append(time.time() - task.done_at)
+                task_callback(task)
+            ec._task_callback = _timed_task_callback
+            run = ec.run
+
+            def _timed_run(callback):
+                def _final(tasks):
+                    final_latencies.append(time.time() - max(t.done_at for t in tasks))
+                    callback(tasks)
+                run(_final)
+            ec.run = _timed_run
+            return ec
+        group.get_execution_context = _timed_context
+    execute(apenv, model)
+    latencies.sort()
+    return dict(p50_us=_percentile(latencies, 0.5) * 1e6,
+                p99_us=_percentile(latencies, 0.99) * 1e6,
+                max_us=latencies[-1] * 1e6,
+                group_final_us=sum(final_latencies) / len(final_latencies) * 1e6)
+
+
+def bench_memory_per_task(args):
+    """
+    Resident memory added per task by building a model
+    """
+    ntasks = args.groups * args.tasks_per_group
+    gc.collect()
+    before = _rss_bytes()
+    apenv, model = build_model("bench_memory", args.groups, args.tasks_per_group)
+    gc.collect()
+    after = _rss_bytes()
+    del model
+    return dict(bytes_per_task=float(after - before) / ntasks, tasks=ntasks)
+
+
+# name -> (function, metric compared with the baseline, True if higher is better)
+BENCHMARKS = [("execute_throughput", bench_execute_throughput, "tasks_per_second", True),
+              ("scheduling_overhead", bench_scheduling_overhead, "overhead_us_per_task", False),
+              ("callback_latency", bench_callback_latency, "p99_us", False),
+              ("memory_per_task", bench_memory_per_task, "bytes_per_task", False)]
+
+
+def compare(results, baseline):
+    """
+    Returns the list of (name, metric, value, baseline value) that regressed
+    more than their threshold
+    """
+    regressions = []
+    for (name, func, metric, higher_is_better) in BENCHMARKS:
+        if name not in results or name not in baseline:
+            continue
+        expected = baseline[name]
+        value = results[name][metric]
+        reference = expected["value"]
+        threshold = expected.get("threshold", DEFAULT_THRESHOLD)
+        if higher_is_better:
+            regressed = value < reference * (1 - threshold)
+        else:
+            regressed = value > reference * (1 + threshold)
+        if regressed:
+            regressions.append((name, metric, value, reference))
+    return regressions
+
+
+def to_baseline(results, previous=None):
+    baseline = {}
+    for (name, func, metric, higher_is_better) in BENCHMARKS:
+        if name in results:
+            threshold = (previous or {}).get(name, {}).get("threshold", DEFAULT_THRESHOLD)
+            baseline[name] = dict(metric=metric, value=results[name][metric],
+                                  higher_is_better=higher_is_better, threshold=threshold)
+    return baseline
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # peak rather than current but good enough where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Workflow engine benchmarks")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--tasks-per-group", type=int, default=250)
+    parser.add_argument("--pool-size", type=int, default=None, help="WORKFLOW_POOL_SIZE for the run")
+    parser.add_argument("--only", action="append", help="run only the named benchmark")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for (name, func, metric, higher_is_better) in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        results[name] = func(args)
+        print("{0}: {1}".format(name, json.dumps(results[name], sort_keys=True)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    previous = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            previous = json.load(f)
+    if args.save_baseline:
+        baseline = previous or {}
+        baseline.update(to_baseline(results, previous))
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("baseline saved to {0}".format(args.baseline))
+        return 0
+    if previous is None:
+        print("no baseline at {0}. Run with --save-baseline to record one".format(args.baseline))
+        return 0
+    regressions = compare(results, previous)
+    for (name, metric, value, reference) in regressions:
+        print("REGRESSION {0}: {1} {2:.2f} vs baseline {3:.2f}".format(name, metric, value, reference))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,8 @@ from autopilot.workflows.workflowmodel import WorkflowModel
 from autopilot.workflows.workflowexecutor import WorkflowExecutor
 from autopilot.specifications.apspec import Apspec
 
+logger.configure(dict(LOG_DIR="/tmp/", LOG_SINKS=["file"], LOG_COMPRESS=False))
+
 
 class APtest(unittest.TestCase):
     """ Base class for all autopilot unit tests
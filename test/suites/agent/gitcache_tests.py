@@ -0,0 +1,81 @@
+#! /usr/bin python
+
+import os
+import sys
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.common import utils
+from autopilot.agent.installers.gitcache import GitCache
+
+
+class GitCacheTest(APtest):
+    """
+    Git mirror cache tests. Uses local repositories only
+    """
+    def setUp(self):
+        self.root = '/tmp/test_git_cache/'
+        self.resetdir(self.root)
+        self.origin = self._make_repo("origin")
+
+    def test_clone_from_mirror(self):
+        cache = GitCache(utils.path_join(self.root, "cache"), fetch_interval=60)
+        dest1 = utils.path_join(self.root, "hdfs")
+        dest2 = utils.path_join(self.root, "yarn")
+        cache.clone(self.origin, "master", dest1)
+        cache.clone(self.origin, "master", dest2)
+
+        self.at(os.path.exists(os.path.join(dest1, "README")))
+        self.at(os.path.exists(os.path.join(dest2, "README")))
+        self.at(os.path.isdir(cache.mirror_path(self.origin)))
+        # working copies point upstream, not at the mirror
+        (code, out, err) = utils.subprocess_cmd("git config --get remote.origin.url", working_dir=dest2)
+        self.ae(self.origin, out.strip())
+
+    def test_fetch_picks_up_new_commits(self):
+        cache = GitCache(utils.path_join(self.root, "cache"), fetch_interval=0)
+        cache.clone(self.origin, "master", utils.path_join(self.root, "first"))
+        self._commit(self.origin, "NEWFILE")
+        cache.clone(self.origin, "master", utils.path_join(self.root, "second"))
+        self.at(os.path.exists(os.path.join(self.root, "second", "NEWFILE")))
+
+    def test_evict_lru(self):
+        other = self._make_repo("other")
+        cache = GitCache(utils.path_join(self.root, "cache"), max_bytes=1)
+        cache.clone(self.origin, "master", utils.path_join(self.root, "a"))
+        cache.clone(other, "master", utils.path_join(self.root, "b"))
+        # over budget: only the mirror in use survives
+        self.af(os.path.exists(cache.mirror_path(self.origin)))
+        self.at(os.path.exists(cache.mirror_path(other)))
+
+    def test_evict_skips_mirrors_in_use(self):
+        other = self._make_repo("other")
+        cache = GitCache(utils.path_join(self.root, "cache"), max_bytes=1)
+        cache.clone(self.origin, "master", utils.path_join(self.root, "a"))
+        # a clone or fetch of origin is in progress
+        with cache._url_lock(self.origin):
+            cache.clone(other, "master", utils.path_join(self.root, "b"))
+        self.at(os.path.exists(cache.mirror_path(self.origin)))
+        self.at(os.path.exists(cache.mirror_path(other)))
+
+    def test_evict_uses_known_sizes(self):
+        cache = GitCache(utils.path_join(self.root, "cache"))
+        cache.clone(self.origin, "master", utils.path_join(self.root, "a"))
+        self.at(cache.sizes[cache.mirror_path(self.origin)] > 0)
+
+        def disk_usage(path):
+            self.fail("mirror sizes are measured on clone and fetch only")
+        cache._disk_usage = disk_usage
+        cache.evict()
+
+    def _make_repo(self, name):
+        path = utils.path_join(self.root, name)
+        utils.mkdir(path)
+        utils.subprocess_cmd("git init -q && git checkout -q -b master", working_dir=path)
+        self._commit(path, "README")
+        return path
+
+    def _commit(self, path, filename):
+        with open(os.path.join(path, filename), 'w') as f:
+            f.write(filename)
+        utils.subprocess_cmd("git add {0} && git -c user.name=ap -c user.email=ap@test "
+                             "commit -q -m {0}".format(filename), working_dir=path)
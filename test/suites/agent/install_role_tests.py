@@ -10,6 +10,7 @@ sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
 from autopilot.test.common.aptest import APtest
 from autopilot.common import exception
 from autopilot.common import utils
+from autopilot.common.asyncpool import taskpool
 from autopilot.common.apenv import ApEnv
 from autopilot.specifications.apspec import Apspec
 from autopilot.agent.tasks.InstallRoleTask import InstallRoleTask
@@ -39,7 +40,7 @@ class InstallRoleTest(APtest):
 
         wf_id = "InstallRole_test_wf_id"
         task = InstallRoleTask(self.get_default_apenv(wf_id), wf_id, None, properties, None)
-        task.run()
+        self._run_task(task)
         self.ae(TaskState.Done, task.result.state, "Task should be in done state")
 
         with open(os.path.join(working_dir, 'autopilot/hadoop-base/hdfs/dump_stack.out')) as f:
@@ -70,7 +71,7 @@ class InstallRoleTest(APtest):
 
         wf_id = "InstallRole_test_wf_id"
         task = InstallRoleTask(self.get_default_apenv(wf_id), wf_id, None, properties, None)
-        task.run()
+        self._run_task(task)
 
         self.ae(TaskState.Error, task.result.state, "Task should be error")
         self.ae(exception.GitInstallProviderException, type(task.result.exceptions[0]))
@@ -95,4 +96,10 @@ class InstallRoleTest(APtest):
         current_file_path = os.path.join(status_dir, "hadoop-base/hdfs/current")
         with open(current_file_path) as f:
             stack_name = f.readline().strip()
-            self.ae("hadoop-base", stack_name)
\ No newline at end of file
+            self.ae("hadoop-base", stack_name)
+
+    def _run_task(self, task, timeout=120):
+        # installs run on the role install pool. Wait for the task callback
+        done = taskpool.callable_future()
+        task.run(callback=done)
+        done.get(timeout=timeout)
@@ -6,12 +6,14 @@ sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
 import requests
 import StringIO
 from autopilot.common import utils
+from autopilot.common import metrics
 from autopilot.test.common.aptest import APtest
 from autopilot.common.apenv import ApEnv
 from autopilot.specifications.apspec import Apspec
 from autopilot.protocol.message import Message
 from autopilot.protocol.serializer import JsonPickleSerializer
 from autopilot.common.server import Server
+from autopilot.common.client import AgentClient
 from autopilot.common.asyncpool import taskpool
 from autopilot.agent.handlers.stackdeployhandler import StackDeployHandler
 
@@ -108,6 +110,61 @@ class ServerTest(APtest):
         (status_code, response) = clientg.get()
         self.ae(200, status_code)
 
+    def test_gevent_server_large_response(self):
+        # multiple chunks and embedded newlines must all reach the client
+        data = dict(text="line\n" * 50000)
+        m = Message(type="stack_deploy", data=data, identifier="test_gevent_large")
+
+        clientg = taskpool.spawn(func=self._single_message_client, args=dict(message=m))
+        self._start_server(handler=ServerTest.DefaultAsyncHandler())
+
+        (status_code, response_text) = clientg.get()
+        self.ae(200, status_code)
+        rm = JsonPickleSerializer().load(StringIO.StringIO(response_text))
+        self.ae(data, rm.data)
+
+    def test_gevent_server_progress(self):
+        m = Message(type="stack_deploy", headers={"stream_progress": True},
+                    data=dict(name="test_gevent_progress"), identifier="test_gevent_progress")
+
+        clientg = taskpool.spawn(func=self._single_message_client, args=dict(message=m))
+        self._start_server(handler=ServerTest.DefaultAsyncHandler(progress=["started", "running"]))
+
+        (status_code, response_text) = clientg.get()
+        self.ae(200, status_code)
+        messages = [JsonPickleSerializer().load(StringIO.StringIO(line))
+                    for line in response_text.splitlines() if line]
+        self.ae(["progress", "progress", "stack_deploy"], [rm.type for rm in messages])
+        self.ae(["started", "running"], [rm.data for rm in messages[:2]])
+
+    def test_gevent_server_early_progress(self):
+        m = Message(type="stack_deploy", headers={"stream_progress": True},
+                    data=dict(name="test_gevent_early_progress"), identifier="test_gevent_early_progress")
+
+        clientg = taskpool.spawn(func=self._single_message_client, args=dict(message=m))
+        self._start_server(handler=ServerTest.DefaultAsyncHandler(progress=["running"], early_progress=["accepted"]))
+
+        (status_code, response_text) = clientg.get()
+        self.ae(200, status_code)
+        messages = [JsonPickleSerializer().load(StringIO.StringIO(line))
+                    for line in response_text.splitlines() if line]
+        self.ae(["accepted", "running"], [rm.data for rm in messages[:2]])
+
+    def test_agent_client(self):
+        client = AgentClient(serializer=JsonPickleSerializer(), max_in_flight=2)
+        messages = [("localhost", Message(type="stack_deploy", data=dict(index=i), identifier=str(i)))
+                    for i in range(4)]
+
+        def _send():
+            return [f.get() for f in client.send_all(messages, timeout=10)]
+        clientg = taskpool.spawn(func=_send)
+
+        self._start_server(handler=ServerTest.DefaultAsyncHandler(), stop_delay=6)
+
+        results = clientg.get()
+        client.close()
+        self.ae([dict(index=i) for i in range(4)], [r.data for r in results])
+
     def test_gevent_handled_error(self):
         m = Message(type="stack_deploy",
                     data=dict(name="test_gevent_async"),
@@ -151,6 +208,20 @@ class ServerTest(APtest):
         (status_code, response) = clientg.get()
         self.ae(400, status_code)
 
+    def test_gevent_metrics_endpoint(self):
+        metrics.registry.inc("server_test_total", kind="ping")
+
+        def _metrics_client():
+            r = requests.get(url="http://localhost:9191/metrics")
+            return (r.status_code, r.headers.get("Content-Type"), r.text)
+
+        clientg = taskpool.spawn(func=_metrics_client)
+        self._start_server(handler=ServerTest.DefaultAsyncHandler())
+        (status_code, content_type, text) = clientg.get()
+        self.ae(200, status_code)
+        self.at(content_type.startswith("text/plain"))
+        self.at('autopilot_server_test_total{kind="ping"} 1' in text)
+
     def _start_server(self, handler, stop_delay=3):
         s = Server(serializer=JsonPickleSerializer(), handler_resolver=lambda msg: handler)
         taskpool.spawn(func=lambda: s.stop(), delay=stop_delay)
@@ -169,13 +240,18 @@ class ServerTest(APtest):
         return (r.status_code, r.text)
 
     class DefaultAsyncHandler(object):
-        def __init__(self, exception=None, unhandled=False):
+        def __init__(self, exception=None, unhandled=False, progress=None, early_progress=None):
             self.waiter = taskpool.new_queue()
             self.exception = exception
             self.unhandled = unhandled
+            self.progress = progress or []
+            # reported inside process() before the server can listen
+            self.early_progress = early_progress or []
 
         def work(self, process_future, message):
             self.waiter.get(block=True, timeout=5)
+            for event in self.progress:
+                process_future.progress(event)
             taskpool.doyield(1)
             process_future(result=message, exception=self.exception)
 
@@ -183,6 +259,8 @@ class ServerTest(APtest):
             process_future = taskpool.callable_future()
             if self.unhandled:
                 raise Exception()
+            for event in self.early_progress:
+                process_future.progress(event)
             taskpool.spawn(func=self.work, args={"process_future": process_future, "message": message})
             taskpool.spawn(func=self.waiter.put, args={"item": 2})
             return process_future
@@ -0,0 +1,120 @@
+#! /usr/bin/python
+
+import os
+import sys
+import boto.exception
+from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.inf.aws.awsutils import EasyAWS, EasyEC2, ConnectionRegistry
+from autopilot.inf.aws import awsutils
+from autopilot.test.common.aptest import APtest
+
+
+class AwsConnectionTests(APtest):
+    """
+    Connection registry and tagging tests. No AWS calls are made
+    """
+    def setUp(self):
+        awsutils.connections.clear()
+        EasyEC2._image_cache.clear()
+        EasyEC2._bdmap_cache.clear()
+
+    def tearDown(self):
+        awsutils.connections.clear()
+        EasyEC2._image_cache.clear()
+        EasyEC2._bdmap_cache.clear()
+
+    def test_connections_shared(self):
+        created = []
+
+        def connect(key, secret, **kwargs):
+            conn = type('', (object, ), {"args": kwargs})()
+            created.append(conn)
+            return conn
+
+        a1 = EasyAWS("key1", "secret1", connect, port=443, validate_certs=False)
+        a2 = EasyAWS("key1", "secret1", connect, port=443, validate_certs=False)
+        a3 = EasyAWS("key2", "secret2", connect, port=443, validate_certs=False)
+        self.at(a1.conn is a2.conn)
+        self.af(a1.conn is a3.conn)
+        self.ae(2, len(created))
+
+        # reload replaces the shared connection without closing it under a2
+        old = a1.conn
+        old.close = lambda: created.remove(old)
+        self.af(a1.reload() is old)
+        self.ae(3, len(created))
+        self.at(a2.conn is a1.conn)
+
+    def test_idle_eviction(self):
+        closed = []
+        registry = ConnectionRegistry(idle_timeout=0)
+        conn = type('', (object, ), {"close": lambda s: closed.append(s)})()
+        registry.get("k", lambda: conn)
+        self.ae(1, len(registry))
+        self.doyield(0.01)
+        registry.evict_idle()
+        self.ae(0, len(registry))
+        self.ae([conn], closed)
+
+    def test_used_connection_not_evicted(self):
+        closed = []
+        registry = awsutils.connections
+        registry.idle_timeout = 0.05
+        try:
+            conn = type('', (object, ), {"close": lambda s: closed.append(s)})()
+            aws = EasyAWS("key1", "secret1", lambda key, secret, **kwargs: conn, validate_certs=False)
+            for i in range(4):
+                # every use marks the connection as used
+                self.at(aws.conn is conn)
+                self.doyield(0.02)
+                registry.evict_idle()
+            self.ae([], closed)
+            self.doyield(0.1)
+            registry.evict_idle()
+            self.ae([conn], closed)
+        finally:
+            registry.idle_timeout = awsutils.CONNECTION_IDLE_TIMEOUT
+
+    def test_bulk_tags(self):
+        calls = []
+
+        def create_tags(resource_ids, tags):
+            calls.append(list(resource_ids))
+            if len(calls) == 1:
+                # instances not yet visible to the API
+                e = boto.exception.EC2ResponseError(400, "Bad Request")
+                e.error_code = "InvalidInstanceID.NotFound"
+                raise e
+
+        aws = EasyAWS("key1", "secret1", None)
+        aws._conn = type('', (object, ), {"create_tags": staticmethod(create_tags)})()
+        instances = [type('', (object, ), {"id": "i-{0}".format(i), "tags": {}})() for i in range(5)]
+        tags = {"Name": "web", "stack": "s1", "role": "r1", "domain": "d1"}
+        aws.add_tags(instances, tags)
+        # one retried bulk call instead of 20 add_tag calls
+        self.ae(2, len(calls))
+        self.ae(["i-0", "i-1", "i-2", "i-3", "i-4"], calls[1])
+        self.ae(tags, instances[0].tags)
+
+    def test_image_cache_per_account(self):
+        described = []
+
+        def ec2(key):
+            aws = EasyEC2(key, "secret")
+            aws.get_image = lambda image_id: described.append((key, image_id)) or (key, image_id)
+            return aws
+
+        self.ae(("key1", "ami-1"), ec2("key1").get_cached_image("ami-1"))
+        self.ae(("key1", "ami-1"), ec2("key1").get_cached_image("ami-1"))
+        # the same image id in another account is described again
+        self.ae(("key2", "ami-1"), ec2("key2").get_cached_image("ami-1"))
+        self.ae([("key1", "ami-1"), ("key2", "ami-1")], described)
+
+    def test_block_device_map_copied(self):
+        aws = EasyEC2("key1", "secret")
+        bdmap = BlockDeviceMapping()
+        bdmap["/dev/sda1"] = BlockDeviceType(size=8, delete_on_termination=True)
+        aws._create_runtime_block_device_map = lambda image_id, instance_type: bdmap
+        aws.get_block_device_map("ami-1", "m1.large")["/dev/sda1"].size = 100
+        self.ae(8, aws.get_block_device_map("ami-1", "m1.large")["/dev/sda1"].size)
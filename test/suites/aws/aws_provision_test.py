@@ -3,10 +3,13 @@
 import os
 import os.path
 import sys
+import socket
 sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
 import gevent
 import gevent.monkey
 from autopilot.inf.aws.awsinf import AwsInfProvisionResponseContext
+from autopilot.inf.aws.awswaiter import AWSWaiter
+from autopilot.common.exception import AWSWaiterTimeout
 from autopilot.test.common.utils import Utils
 from autopilot.test.suites.aws.awstest import AWStest
 # monkey patch
@@ -18,23 +21,76 @@ class AwsProvisionTests(AWStest):
     AWS Tests
     """
     def test_aws_provision_response_context(self):
-        def update(*args, **kwargs):
-            pass
-        instance1 = type('', (object, ), {"state": "pending", "update": update})()
-        instance2 = type('', (object, ), {"state": "success", "update": update})()
+        polls = []
+
+        class FakeEC2(object):
+            def __init__(self, instances):
+                self.instances = instances
+                self.waiter = AWSWaiter(self)
+
+            def get_all_instances(self, filters={}):
+                polls.append(filters.get("instance-id"))
+                return [type('', (object, ), {"id": i.id, "state": i.state})() for i in self.instances]
+
+        instance1 = type('', (object, ), {"id": "i-1", "state": "pending"})()
+        instance2 = type('', (object, ), {"id": "i-2", "state": "success"})()
         reservation = type('', (object, ), {"instances": [instance1, instance2]})()
-        response = AwsInfProvisionResponseContext({}, reservation=reservation)
+        response = AwsInfProvisionResponseContext({}, reservation=reservation,
+                                                  ec2_conn=FakeEC2(reservation.instances))
         self.af(self.pool(response.close_on_instances_ready,
                           args=dict(timeout=1, interval=1), wait_timeout=3).get())
+        # every poll describes the whole reservation at once
+        self.at(len(polls) > 1)
+        self.ae(["i-1", "i-2"], polls[0])
 
-        instance1 = type('', (object, ), {"state": "running", "update": update})()
-        instance2 = type('', (object, ), {"state": "running", "update": update})()
+        instance1 = type('', (object, ), {"id": "i-1", "state": "running"})()
+        instance2 = type('', (object, ), {"id": "i-2", "state": "running"})()
         reservation = type('', (object, ), {"instances": [instance1, instance2]})()
-        response = AwsInfProvisionResponseContext({}, reservation=reservation)
+        response = AwsInfProvisionResponseContext({}, reservation=reservation,
+                                                  ec2_conn=FakeEC2(reservation.instances))
         self.log("Waiting for response to finish")
         self.at(self.pool(response.close_on_instances_ready,
                           args=dict(timeout=1, interval=1), wait_timeout=3).get())
 
+    def test_waiter_batches_waits(self):
+        polls = []
+        states = {"i-1": "pending", "i-2": "pending", "i-3": "pending"}
+
+        class FakeEC2(object):
+            def get_all_instances(self, filters={}):
+                polls.append(filters.get("instance-id"))
+                found = [type('', (object, ), {"id": i, "state": states[i]})() for i in filters["instance-id"]]
+                # everything is running after the first describe
+                for i in states:
+                    states[i] = "running"
+                return found
+
+        waiter = AWSWaiter(FakeEC2())
+        running = lambda instance: instance.state == "running"
+        f1 = waiter.wait("instance", ["i-1", "i-2"], condition=running, timeout=5, interval=0.1)
+        f2 = waiter.wait("instance", ["i-3"], condition=running, timeout=5, interval=0.1)
+        self.ae(["i-1", "i-2"], [i.id for i in f1.get(timeout=3)])
+        self.ae(["i-3"], [i.id for i in f2.get(timeout=3)])
+        # two ticks, each a single describe covering both waits
+        self.ae([["i-1", "i-2", "i-3"], ["i-1", "i-2", "i-3"]], polls)
+
+    def test_waiter_describe_error(self):
+        class FakeEC2(object):
+            def get_all_instances(self, filters={}):
+                raise socket.error("connection reset")
+
+        waiter = AWSWaiter(FakeEC2())
+        f = waiter.wait("instance", ["i-1"], timeout=0.3, interval=0.1)
+        # the poller keeps running and the wait times out at its deadline
+        self.assertRaises(AWSWaiterTimeout, f.get, timeout=3)
+        self.ae([], waiter.waits)
+
+    def test_waiter_tick_error(self):
+        waiter = AWSWaiter(object())
+        waiter._tick = lambda: 1 / 0
+        f = waiter.wait("instance", ["i-1"], timeout=0.3, interval=0.1)
+        self.assertRaises(AWSWaiterTimeout, f.get, timeout=3)
+
     def test_init_domain(self):
         a = self.get_aws_inf()
         domain_spec = {
@@ -0,0 +1,57 @@
+#! /usr/bin/python
+
+import os
+import sys
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.common.asyncpool import taskpool
+
+
+class AsyncPoolTest(APtest):
+    """
+    Sub pool tests
+    """
+    def test_sub_pool_bound(self):
+        sp = taskpool.sub_pool("test_sub_pool_bound", size=2)
+        running = dict(now=0, max=0)
+
+        def work():
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            taskpool.doyield(seconds=0.2)
+            running["now"] -= 1
+
+        greenlets = [sp.spawn(work) for i in range(6)]
+        self.ae(4, sp.stats()["queue_depth"])
+        for g in greenlets:
+            g.get(timeout=5)
+        self.ae(2, running["max"])
+        self.ae(6, sp.stats()["waits"])
+        sp.release()
+
+    def test_sub_pool_weighted_share(self):
+        parent = taskpool.sub_pool("test_sub_pool_weighted_share", size=1)
+        heavy = parent.sub_pool("heavy", weight=2)
+        light = parent.sub_pool("light", weight=1)
+        order = []
+
+        def work(name):
+            order.append(name)
+            taskpool.doyield(seconds=0.05)
+
+        # the first heavy item starts right away. The rest are queued
+        greenlets = [heavy.spawn(work, args=dict(name="heavy")) for i in range(6)]
+        greenlets.extend([light.spawn(work, args=dict(name="light")) for i in range(3)])
+        for g in greenlets:
+            g.get(timeout=5)
+        # heavy gets two starts for every light start while both have work queued
+        self.ae(["light", "heavy", "heavy", "light", "heavy", "heavy"], order[1:7])
+        parent.release()
+
+    def test_sub_pool_callback(self):
+        sp = taskpool.sub_pool("test_sub_pool_callback", size=1)
+        results = []
+        sp.spawn(lambda: 5, callback=lambda result, ex: results.append(result)).get(timeout=5)
+        taskpool.doyield(seconds=0.1)
+        self.ae([5], results)
+        sp.release()
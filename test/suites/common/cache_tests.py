@@ -0,0 +1,71 @@
+#! /usr/bin/python
+
+import os
+import sys
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.common.cache import TTLCache
+from autopilot.common.asyncpool import taskpool
+
+
+class CacheTest(APtest):
+    """
+    TTLCache tests
+    """
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # touch a so that b is the least recently used
+        self.ae(1, cache.get("a"))
+        cache.put("c", 3)
+        self.ae(None, cache.get("b"))
+        self.ae(1, cache.get("a"))
+        self.ae(3, cache.get("c"))
+
+    def test_ttl_expiry(self):
+        now = dict(t=0)
+        cache = TTLCache(maxsize=10, ttl=5, timer=lambda: now["t"])
+        loads = []
+        load = lambda: loads.append(1) or len(loads)
+        self.ae(1, cache.get_or_load("k", load))
+        self.ae(1, cache.get_or_load("k", load))
+        now["t"] = 6
+        self.ae(2, cache.get_or_load("k", load))
+        self.ae(2, len(loads))
+
+    def test_invalidate(self):
+        cache = TTLCache()
+        cache.put(("ami-1", "m1.small"), 1)
+        cache.put(("ami-1", "m1.large"), 2)
+        cache.put(("ami-2", "m1.small"), 3)
+        cache.invalidate_if(lambda key: key[0] == "ami-1")
+        self.af(("ami-1", "m1.small") in cache)
+        self.at(("ami-2", "m1.small") in cache)
+
+    def test_single_flight(self):
+        cache = TTLCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            taskpool.doyield(seconds=0.05)
+            return "image"
+
+        greenlets = [taskpool.spawn(cache.get_or_load, args=dict(key="ami-1", load=load)) for i in range(5)]
+        self.ae(["image"] * 5, [g.get(timeout=5) for g in greenlets])
+        self.ae(1, len(loads))
+        self.ae({}, cache.loading)
+
+    def test_single_flight_error(self):
+        cache = TTLCache()
+
+        def load():
+            taskpool.doyield(seconds=0.05)
+            raise ValueError("describe failed")
+
+        greenlets = [taskpool.spawn(cache.get_or_load, args=dict(key="ami-1", load=load)) for i in range(3)]
+        for g in greenlets:
+            self.assertRaises(ValueError, g.get, timeout=5)
+        # a failed load is not cached
+        self.ae(1, cache.get_or_load("ami-1", lambda: 1))
@@ -0,0 +1,166 @@
+#! /usr/bin/python
+
+import os
+import sys
+import gzip
+import json
+import logging
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.common import logger
+from autopilot.agent import settings
+from autopilot.common.logger import WfLogger, StructuredMessage, JsonLinesFormatter, AsyncQueueHandler
+from autopilot.common.logger import RotatingSink, WorkflowFileHandler, OutputStreamLogger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+
+class LoggerTest(APtest):
+    """
+    Workflow logger tests
+    """
+    def test_structured_message_is_lazy(self):
+        calls = []
+
+        class Field(object):
+            def __format__(self, spec):
+                calls.append(1)
+                return "field"
+
+        pylogger = logging.getLogger("logger_test_lazy")
+        pylogger.setLevel(logging.INFO)
+        pylogger.propagate = False
+        handler = ListHandler()
+        pylogger.addHandler(handler)
+        log = WfLogger(pylogger)
+        log.debug("value {v}", wf_id="wf1", v=Field())
+        self.ae(0, len(calls))
+        self.ae(0, len(handler.records))
+        log.info("value {v}", wf_id="wf1", v=Field())
+        self.ae(1, len(calls))
+        self.at("value field" in handler.records[0])
+
+    def test_json_lines(self):
+        handler = ListHandler()
+        handler.setFormatter(JsonLinesFormatter())
+        pylogger = logging.getLogger("logger_test_json")
+        pylogger.propagate = False
+        pylogger.addHandler(handler)
+        WfLogger(pylogger).warning("group {groupid} done", wf_id="wf1", groupid="g1", exc_info=False)
+        d = json.loads(handler.records[0])
+        self.ae("wf1", d["wf_id"])
+        self.ae("g1", d["groupid"])
+        self.ae("group g1 done", d["msg"])
+        self.ae("WARNING", d["level"])
+
+    def test_bad_format_keeps_message(self):
+        self.ae("missing {x}", StructuredMessage("wf1", "missing {x}", dict(y=1)).text())
+
+    def test_configure_replaces_default_sinks(self):
+        # aptest configured a single test file sink at import
+        self.ae(1, len(logger._sinks))
+        self.ae("/tmp/autopilot.log", logger._sinks[0].target.baseFilename)
+        self.at(all(sink in logging.getLogger().handlers for sink in logger._sinks))
+
+    def test_default_sinks_from_settings(self):
+        log_dir = settings.LOG_DIR
+        # a file where the log directory should be
+        settings.LOG_DIR = "/tmp/autopilot_logger_test_file"
+        open(settings.LOG_DIR, "w").close()
+        try:
+            logger._configure_default()
+            self.ae(["RotatingSink", "WorkflowFileHandler"], [type(sink.target).__name__ for sink in logger._sinks])
+            self.ae(os.path.join(logger.FALLBACK_LOG_DIR, "autopilot.log"), logger._sinks[0].target.baseFilename)
+        finally:
+            settings.LOG_DIR = log_dir
+            logger.configure(dict(LOG_DIR="/tmp/", LOG_SINKS=["file"], LOG_COMPRESS=False))
+
+    def test_output_lines_are_not_formatted(self):
+        handler = ListHandler()
+        pylogger = logging.getLogger("logger_test_output")
+        pylogger.setLevel(logging.INFO)
+        pylogger.propagate = False
+        pylogger.addHandler(handler)
+        OutputStreamLogger(WfLogger(pylogger), "wf1", "hdfs", "stdout")("{role} {x.y}\n")
+        self.at("{role} {x.y}" in handler.records[0])
+
+    def test_async_handler_drains_and_drops(self):
+        target = ListHandler()
+        handler = AsyncQueueHandler(target, maxsize=100)
+        pylogger = logging.getLogger("logger_test_async")
+        pylogger.propagate = False
+        pylogger.addHandler(handler)
+        for i in range(10):
+            pylogger.info("line {0}".format(i))
+        handler.close()
+        self.ae(10, len(target.records))
+        self.ae(0, handler.dropped)
+
+    def test_async_handler_lock_contention(self):
+        target = ListHandler()
+        handler = AsyncQueueHandler(target, maxsize=100)
+        pylogger = logging.getLogger("logger_test_async_lock")
+        pylogger.propagate = False
+        pylogger.addHandler(handler)
+        # the writer thread waits for the lock held here without a hub
+        with target.lock:
+            for i in range(5):
+                pylogger.info("line {0}".format(i))
+            self.doyield(0.1)
+            self.ae(0, len(target.records))
+        handler.close()
+        self.ae(5, len(target.records))
+
+    def test_rotating_sink_compresses_segments(self):
+        log_dir = "/tmp/autopilot_logger_test/"
+        self.resetdir(log_dir)
+        sink = RotatingSink(os.path.join(log_dir, "ap.log"), max_bytes=100, backup_count=2)
+        record = logging.LogRecord("t", logging.INFO, __file__, 0, "x" * 60, None, None)
+        for i in range(4):
+            sink.handle(record)
+        sink.close()
+        self.at(os.path.exists(os.path.join(log_dir, "ap.log")))
+        self.at(os.path.exists(os.path.join(log_dir, "ap.log.1.gz")))
+        self.at(os.path.exists(os.path.join(log_dir, "ap.log.2.gz")))
+        self.af(os.path.exists(os.path.join(log_dir, "ap.log.3.gz")))
+        with gzip.open(os.path.join(log_dir, "ap.log.1.gz")) as f:
+            self.ae("x" * 60 + "\n", f.read())
+
+    def test_rotating_sink_interval(self):
+        log_dir = "/tmp/autopilot_logger_test/"
+        self.resetdir(log_dir)
+        now = dict(t=0)
+        sink = RotatingSink(os.path.join(log_dir, "ap.log"), interval=10, compress=False, timer=lambda: now["t"])
+        record = logging.LogRecord("t", logging.INFO, __file__, 0, "line", None, None)
+        sink.handle(record)
+        now["t"] = 11
+        sink.handle(record)
+        sink.close()
+        self.at(os.path.exists(os.path.join(log_dir, "ap.log.1")))
+
+    def test_workflow_files(self):
+        log_dir = "/tmp/autopilot_logger_test/"
+        self.resetdir(log_dir)
+        handler = WorkflowFileHandler(log_dir, max_open=1, compress=False)
+        handler.setFormatter(JsonLinesFormatter())
+        pylogger = logging.getLogger("logger_test_wf")
+        pylogger.propagate = False
+        pylogger.setLevel(logging.INFO)
+        pylogger.addHandler(handler)
+        log = WfLogger(pylogger)
+        log.info("first", wf_id="wf1")
+        log.info("second", wf_id="wf2")
+        log.info("third", wf_id="wf1")
+        pylogger.info("no workflow")
+        handler.close()
+        with open(os.path.join(log_dir, "wf1.log")) as f:
+            self.ae(["first", "third"], [json.loads(line)["msg"] for line in f])
+        with open(os.path.join(log_dir, "wf2.log")) as f:
+            self.ae(["second"], [json.loads(line)["msg"] for line in f])
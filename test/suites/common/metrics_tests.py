@@ -0,0 +1,77 @@
+#! /usr/bin/python
+
+import os
+import sys
+import json
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.common import metrics
+from autopilot.common.metrics import MetricsRegistry, FileSink, to_prometheus_text
+from autopilot.agent import settings
+
+
+class MetricsTest(APtest):
+    """
+    Metrics registry tests
+    """
+    def test_span_records_histogram_and_trace(self):
+        now = dict(t=100.0)
+        registry = MetricsRegistry(timer=lambda: now["t"])
+        span = registry.span("task_run", wf_id="wf1", task="t1")
+        now["t"] = 102.5
+        span.finish(state="DONE")
+        # finishing twice does not count twice
+        span.finish(state="DONE")
+        histogram = registry.histograms[("task_run_seconds", (("state", "DONE"), ("task", "t1")))]
+        self.ae(1, histogram.count)
+        self.ae(2.5, histogram.sum)
+        trace = registry.trace("wf1")
+        self.ae(1, len(trace))
+        self.ae(2.5, trace[0]["duration"])
+
+    def test_traces_are_bounded(self):
+        registry = MetricsRegistry(max_traces=2)
+        for wf_id in ("wf1", "wf2", "wf3"):
+            registry.span("workflow_run", wf_id=wf_id).finish()
+        self.ae([], registry.trace("wf1"))
+        self.ae(1, len(registry.trace("wf3")))
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.inc("task_state_total", state="DONE")
+        registry.inc("task_state_total", state="ERROR")
+        registry.inc("task_state_total", state="DONE")
+        registry.observe("taskpool_wait_seconds", 0.2)
+        text = to_prometheus_text(registry)
+        self.at("# TYPE autopilot_task_state_total counter" in text)
+        self.at('autopilot_task_state_total{state="DONE"} 2' in text)
+        self.at('autopilot_task_state_total{state="ERROR"} 1' in text)
+        self.at('autopilot_taskpool_wait_seconds_bucket{le="0.1"} 0' in text)
+        self.at('autopilot_taskpool_wait_seconds_bucket{le="0.5"} 1' in text)
+        self.at('autopilot_taskpool_wait_seconds_bucket{le="+Inf"} 1' in text)
+        self.at("autopilot_taskpool_wait_seconds_count 1" in text)
+
+    def test_file_sink(self):
+        path = "/tmp/autopilot_metrics_test.jsonl"
+        if os.path.exists(path):
+            os.remove(path)
+        registry = MetricsRegistry()
+        sink = registry.add_sink(FileSink(path))
+        registry.span("group_run", wf_id="wf1", group="g1").finish()
+        registry.export()
+        registry.remove_sink(sink)
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.ae(["span", "snapshot"], [r["type"] for r in records])
+        self.ae("g1", records[0]["span"]["labels"]["group"])
+
+    def test_default_sinks_from_settings(self):
+        path = settings.METRICS_FILE
+        settings.METRICS_FILE = "/tmp/autopilot_metrics_default.jsonl"
+        try:
+            metrics._configure_default()
+            sink = metrics.registry.sinks[-1]
+            self.ae("/tmp/autopilot_metrics_default.jsonl", sink.path)
+            metrics.registry.remove_sink(sink)
+        finally:
+            settings.METRICS_FILE = path
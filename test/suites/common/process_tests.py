@@ -0,0 +1,67 @@
+#! /usr/bin/python
+
+import os
+import sys
+import time
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.common import utils
+from autopilot.common import process
+from autopilot.common import logger
+
+
+class ProcessTest(APtest):
+    """
+    Async process runner tests
+    """
+    def test_streams_lines(self):
+        lines = []
+        result = process.run_async("echo one; sleep 0.2; echo two; echo err 1>&2",
+                                   on_stdout=lines.append).get(timeout=5)
+        self.ae(0, result.return_code)
+        self.ae(["one\n", "two\n"], lines)
+        self.ae("one\ntwo\n", result.out)
+        self.ae("err\n", result.error)
+
+    def test_timeout_kills_process_group(self):
+        start = time.time()
+        (code, out, error) = utils.subprocess_cmd("sleep 30 | cat", timeout=0.5)
+        self.ae(process.TIMEOUT_RETURN_CODE, code)
+        self.at(time.time() - start < 5)
+
+    def test_sigkill_escalation(self):
+        # ignores SIGTERM so only SIGKILL ends it
+        result = process.run_async("trap '' TERM; sleep 30", timeout=0.5, kill_grace=0.5).get(timeout=5)
+        self.at(result.timed_out)
+        self.ae(process.TIMEOUT_RETURN_CODE, result.return_code)
+
+    def test_sigkill_after_shell_exits(self):
+        # the shell exits on SIGTERM, its child ignores it and keeps stdout open
+        result = process.run_async("(trap '' TERM; sleep 30) & wait", timeout=0.5, kill_grace=0.5).get(timeout=5)
+        self.at(result.timed_out)
+        self.ae(process.TIMEOUT_RETURN_CODE, result.return_code)
+
+    def test_exit_code(self):
+        (code, out, error) = utils.subprocess_cmd("exit 3")
+        self.ae(3, code)
+
+    def test_output_tail(self):
+        tail = logger.OutputTail(max_lines=3)
+        wflog = logger.get_workflow_logger("ProcessTest")
+        result = process.run_async("for i in 1 2 3 4 5; do echo $i; done; sleep 0.2; echo bad 1>&2",
+                                   on_stdout=logger.OutputStreamLogger(wflog, "wf_id1", "hdfs", "stdout", tail=tail),
+                                   on_stderr=logger.OutputStreamLogger(wflog, "wf_id1", "hdfs", "stderr", tail=tail),
+                                   output_lines=0).get(timeout=5)
+        # nothing is buffered by the runner, the tail keeps the last lines.
+        # stderr is written a moment later so it is read after the stdout lines
+        self.ae("", result.out)
+        self.ae(3, len(tail.lines))
+        self.at("[stdout] 5" in tail.text())
+        self.at("[stderr] bad" in tail.text())
+
+    def test_cpu_limit(self):
+        # a busy loop is stopped by SIGXCPU once it used its cpu seconds
+        (code, out, error) = utils.subprocess_cmd("while :; do :; done", timeout=20,
+                                                  preexec_fn=process.limits_preexec(cpu_seconds=1))
+        self.at(code != 0)
+        self.at(code != process.TIMEOUT_RETURN_CODE)
@@ -0,0 +1,100 @@
+#! /usr/bin/python
+
+import os
+import sys
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+import StringIO
+from autopilot.test.common.aptest import APtest
+from autopilot.protocol.message import Message
+from autopilot.protocol.serializer import BinarySerializer, JsonPickleSerializer, cPickleSerializer
+from autopilot.specifications.apspec import Apspec
+from autopilot.common.apenv import ApEnv
+
+
+class SomeObject(object):
+    def __init__(self, value=2):
+        self.value = value
+
+
+class SerializerTest(APtest):
+    """
+    Serializer tests
+    """
+    def test_binary_round_trip(self):
+        data = {"wf_id": "wf-1", "count": 3, "big": 2 ** 70, "ratio": 0.5, "ok": True,
+                "none": None, "roles": ["a", u"b\u00e9"], "pair": (1, 2), "nested": {"x": "line\nline"}}
+        m = Message(type="stack_deploy", headers={"domain": "dev.contoso.org"},
+                    data=data, identifier="id-1")
+        s = BinarySerializer()
+        stream = StringIO.StringIO()
+        s.dump(stream=stream, message=m)
+        stream.seek(0)
+        rm = s.load(stream)
+        self.ae("stack_deploy", rm.type)
+        self.ae("id-1", rm.identifier)
+        self.ae({"domain": "dev.contoso.org"}, rm.headers)
+        self.ae(data, rm.data)
+
+    def test_binary_deterministic(self):
+        s = BinarySerializer()
+        d1 = dict((str(i), i) for i in range(100))
+        d2 = dict((str(i), i) for i in reversed(range(100)))
+        self.ae(s.dumps(Message(type="t", data=d1)), s.dumps(Message(type="t", data=d2)))
+
+    def test_binary_registered_object(self):
+        s = BinarySerializer()
+        self.assertRaises(TypeError, s.dumps, Message(type="t", data=SomeObject(5)))
+        BinarySerializer.register(SomeObject)
+        try:
+            rm = s.loads(s.dumps(Message(type="t", data=SomeObject(5)))[8:])
+            self.ae(5, rm.data.value)
+        finally:
+            BinarySerializer.types.pop("SomeObject")
+        # unknown classes are never constructed
+        self.ae(None, s.loads("S\x01t" + "N" + "N" + "o" + "S\x06system" + "m\x00\x00\x00\x00"))
+
+    def test_binary_spec(self):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec1.yml'))
+        s = BinarySerializer()
+        rm = s.loads(s.dumps(Message(type="stack-deploy", data={"stack": sspec}))[8:])
+        stack = rm.data["stack"]
+        self.ae(sspec.serialize(), stack.serialize())
+        self.ae(sspec.deploy.git, stack.deploy.git)
+        self.ae(None, stack.apenv)
+
+    def test_binary_zero_copy(self):
+        payload = "x" * (128 * 1024)
+        s = BinarySerializer(zero_copy=True)
+        rm = s.loads(s.dumps(Message(type="t", data={"blob": payload, "small": "y"}))[8:])
+        self.at(isinstance(rm.data["blob"], memoryview))
+        self.ae(payload, rm.data["blob"].tobytes())
+        self.ae("y", rm.data["small"])
+
+    def test_binary_bad_frame(self):
+        self.ae(None, BinarySerializer().load(StringIO.StringIO("bad_message_format")))
+        s = BinarySerializer()
+        # a bad utf-8 string and a jsonpickle value as older encoders wrote them
+        self.ae(None, s.loads("S\x01t" + "U\x02\xff\xfe" + "NN"))
+        self.ae(None, s.loads("S\x01t" + "N" + "N" + "X\x02{}"))
+        # registered objects with a state that is not a dict or has unknown fields
+        self.ae(None, s.loads("S\x01t" + "N" + "N" + "o" + "S\x09Rolegroup" + "l\x00\x00\x00\x00"))
+        self.ae(None, s.loads("S\x01t" + "N" + "N" + "o" + "S\x09Rolegroup" + "m\x00\x00\x00\x01" + "S\x05bogus" + "N"))
+        # nested deeper than the recursion limit
+        self.ae(None, s.loads("S\x01t" + "N" + "N" + "l\x00\x00\x00\x01" * 5000 + "N"))
+
+    def test_binary_smaller_than_jsonpickle(self):
+        m = Message(type="stack_deploy", headers={"domain": "dev.contoso.org"},
+                    data=dict(("role{0}".format(i), {"state": i, "ok": True}) for i in range(100)))
+        stream = StringIO.StringIO()
+        JsonPickleSerializer().dump(stream=stream, message=m)
+        self.at(len(BinarySerializer().dumps(m)) < len(stream.getvalue()))
+
+    def test_streamed_messages(self):
+        # progress messages followed by the response, written the way the server streams them
+        for s in (cPickleSerializer(), BinarySerializer(), JsonPickleSerializer()):
+            stream = StringIO.StringIO()
+            for i in range(3):
+                s.dump(stream=stream, message=Message(type="progress", data={"step": i}))
+                stream.write(s.separator)
+            stream.seek(0)
+            self.ae([0, 1, 2], [s.load(stream).data["step"] for i in range(3)])
@@ -0,0 +1,140 @@
+#! /usr/bin/python
+
+import os
+import sys
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.stores.statestore import StateKey, StateStore, MemoryStateStore, SqliteStateStore
+from autopilot.stores.statestore import MongoStateStore, CachedStateStore, create_state_store
+from autopilot.stores.stackstore import StackStore
+
+
+class LocalCollection(object):
+    """
+    Local stand-in for a mongo collection with the calls MongoStateStore makes
+    """
+    def __init__(self):
+        self.records = []
+        self.indexes = []
+
+    def ensure_index(self, keys, unique=False):
+        self.indexes.append((keys, unique))
+
+    def find_one(self, spec):
+        for record in self.find(spec):
+            return record
+        return None
+
+    def find(self, spec):
+        return [dict(r) for r in self.records if all(r.get(k) == v for (k, v) in spec.items())]
+
+    def update(self, spec, document, upsert=False):
+        self.remove(spec)
+        self.records.append(dict(document))
+
+    def remove(self, spec):
+        self.records = [r for r in self.records if not all(r.get(k) == v for (k, v) in spec.items())]
+
+
+class CountingStore(MemoryStateStore):
+    def __init__(self):
+        MemoryStateStore.__init__(self)
+        self.gets = 0
+        self.batches = []
+
+    def get(self, key):
+        self.gets += 1
+        return MemoryStateStore.get(self, key)
+
+    def put_many(self, items):
+        self.batches.append(len(items))
+        MemoryStateStore.put_many(self, items)
+
+
+class StateStoreTest(APtest):
+    """
+    State store and stack store tests
+    """
+    def test_memory_backend(self):
+        self._check_backend(MemoryStateStore())
+
+    def test_sqlite_backend(self):
+        path = "/tmp/autopilot_statestore_test.db"
+        if os.path.exists(path):
+            os.remove(path)
+        store = SqliteStateStore(path)
+        self._check_backend(store)
+        store.close()
+        # documents survive a reopen
+        store = SqliteStateStore(path)
+        self.ae(dict(instances=["i-2"]), store.get(StateKey("org1", "d1", "s1", "rg2")))
+        store.close()
+
+    def test_mongo_backend(self):
+        collection = LocalCollection()
+        self._check_backend(MongoStateStore(collection))
+        self.ae(1, len(collection.indexes))
+
+    def test_cached_store_batches_writes(self):
+        backend = CountingStore()
+        store = CachedStateStore(backend, batch_size=3, flush_interval=60)
+        key = StateKey("org1", "d1", "s1", "rg1")
+        store.put(key, dict(count=1))
+        store.put(StateKey("org1", "d1", "s1", "rg2"), dict(count=2))
+        # not written yet but served from the cache
+        self.ae([], backend.batches)
+        self.ae(dict(count=1), store.get(key))
+        store.put(StateKey("org1", "d1", "s1", "rg3"), dict(count=3))
+        self.ae([3], backend.batches)
+        # reads after the write come from the cache
+        store.get(key)
+        store.get(key)
+        self.ae(0, backend.gets)
+        # callers get copies
+        doc = store.get(key)
+        doc["count"] = 100
+        self.ae(dict(count=1), store.get(key))
+
+    def test_cached_store_find_sees_pending_writes(self):
+        store = CachedStateStore(MemoryStateStore(), batch_size=100, flush_interval=60)
+        store.put(StateKey("org1", "d1", "s1", "rg1"), dict(a=1))
+        self.ae(1, len(store.find("org1", domain="d1")))
+
+    def test_stack_store(self):
+        stack_store = StackStore("org1", "d1", store=CachedStateStore(MemoryStateStore()))
+        self.ae(None, stack_store.get_stack("s1"))
+        stack_store.save_stack("s1", dict(domain=dict(vpc_id="vpc-1"), stack=dict(cidr="10.0.0.0/24")))
+        stack_store.save_role_group("s1", "web", dict(instances=[dict(id="i-1")]))
+        materialized = stack_store.get_stack("s1")
+        self.ae("vpc-1", materialized["domain"]["vpc_id"])
+        self.ae("10.0.0.0/24", materialized["stack"]["cidr"])
+        self.ae(["web"], materialized["role_groups"].keys())
+        stack_store.delete_role_group("s1", "web")
+        self.af("role_groups" in stack_store.get_stack("s1"))
+
+    def test_create_from_settings(self):
+        store = create_state_store(dict(State_Store_Provider="Local", Local=dict(Provider="memory", BatchSize=8)))
+        self.ae(8, store.batch_size)
+        self.at(isinstance(store.backend, MemoryStateStore))
+
+    def _check_backend(self, store):
+        store.put_many([(StateKey("org1", "d1", "s1"), dict(domain=dict(vpc_id="vpc-1"))),
+                        (StateKey("org1", "d1", "s1", "rg1"), dict(instances=["i-1"])),
+                        (StateKey("org1", "d1", "s1", "rg2"), dict(instances=["i-2"])),
+                        (StateKey("org1", "d2", "s1", "rg1"), dict(instances=["i-3"]))])
+        self.ae(dict(instances=["i-1"]), store.get(StateKey("org1", "d1", "s1", "rg1")))
+        self.ae(dict(domain=dict(vpc_id="vpc-1")), store.get(StateKey("org1", "d1", "s1")))
+        self.ae(None, store.get(StateKey("org1", "d1", "s1", "missing")))
+        # overwrite
+        store.put(StateKey("org1", "d1", "s1", "rg1"), dict(instances=["i-1", "i-4"]))
+        self.ae(dict(instances=["i-1", "i-4"]), store.get(StateKey("org1", "d1", "s1", "rg1")))
+
+        keys = [key for (key, doc) in store.find("org1", domain="d1", stack="s1")]
+        self.ae([StateKey("org1", "d1", "s1"), StateKey("org1", "d1", "s1", "rg1"),
+                 StateKey("org1", "d1", "s1", "rg2")], keys)
+        self.ae(2, len(store.find("org1", role_group="rg1")))
+        self.ae(4, len(store.find("org1")))
+        self.ae(0, len(store.find("org2")))
+
+        store.delete(StateKey("org1", "d1", "s1", "rg1"))
+        self.ae(None, store.get(StateKey("org1", "d1", "s1", "rg1")))
@@ -0,0 +1,23 @@
+#! /usr/bin/python
+
+import os
+import sys
+import json
+sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
+from autopilot.test.common.aptest import APtest
+from autopilot.test.benchmarks import engine_bench
+
+
+class EngineBenchTest(APtest):
+    """
+    Smoke run of the benchmark harness with a tiny workflow
+    """
+    def test_smoke(self):
+        output = "/tmp/engine_bench_smoke.json"
+        rc = engine_bench.main(["--groups", "2", "--tasks-per-group", "5",
+                                "--baseline", "/tmp/engine_bench_smoke_missing.json", "--output", output])
+        self.ae(0, rc)
+        with open(output) as f:
+            results = json.load(f)
+        self.ae(sorted(b[0] for b in engine_bench.BENCHMARKS), sorted(results.keys()))
+        os.remove(output)
@@ -4,14 +4,21 @@ import os
 import os.path
 import sys
 import json
+import pickle
 
 sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
 from autopilot.test.common.aptest import APtest
 from autopilot.specifications.apspec import Apspec
 from autopilot.common.apenv import ApEnv
+from autopilot.common.exception import SpecValidationError, AgentClientException
+from autopilot.protocol.message import Message
 from autopilot.specifications.wfmapper import StackMapper
+from autopilot.specifications.planner import StackPlanner, PlanAction, RoleGroupPlan
+from autopilot.workflows.plancache import PlanCache
 from autopilot.specifications.tasks.deployrole import DeployRole, DomainInit, StackInit
 from autopilot.workflows.workflowexecutor import WorkflowExecutor
+from autopilot.workflows.tasks.task import TaskState
+from autopilot.inf.inf import Inf, InfResponseContext
 
 
 class StackSpecTest(APtest):
@@ -42,10 +49,231 @@ class StackSpecTest(APtest):
 
         workflow = mapper.build_workflow()
         json.dump(workflow.serialize(), open('/tmp/wf.sz', 'w'))
-        self.ae(4, len(workflow.groupset.groups))
+        # domain and stack are materialized already. Only the role groups are deployed
+        self.ae(2, len(workflow.groupset.groups))
+        self.ae("ordered_deploy_roles_1", workflow.groupset.groups[0].groupid)
         gp = filter(lambda g: g.groupid=="parallel_deploy_roles", workflow.groupset.groups).pop()
         self.ae(2, len(gp.tasks))
 
+    def test_stack_mapper_full_deploy(self):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'))
+        wf_id = self.get_unique_wf_id()
+        apenv = self.get_default_apenv(wf_id=wf_id)
+        mapper = StackMapper(apenv=apenv, wf_id=wf_id, org="contoso.org", domain="dev.marketing.contoso.org",
+                             owner="apuser", stack_spec=sspec, stack_state=self.get_aws_default_workflow_state(),
+                             full_deploy=True)
+        workflow = mapper.build_workflow()
+        self.ae(["domain_init", "stack_init", "ordered_deploy_roles_1", "parallel_deploy_roles"],
+                [g.groupid for g in workflow.groupset.groups])
+
+    def test_stack_planner(self):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'))
+        materialized = self.get_aws_default_workflow_state()["stack_spec"]["materialized"]
+        materialized["role_groups"] = dict(hdfs=self._materialized_role_group(sspec, "hdfs"),
+                                           zk=self._materialized_role_group(sspec, "zk"),
+                                           monitoring=self._materialized_role_group(sspec, "monitoring"),
+                                           spark=self._materialized_role_group(sspec, "hdfs"))
+        # scale out hdfs, new roles for zk, new image for monitoring
+        sspec.groups["hdfs"].instanced["count"] = 3
+        sspec.groups["zk"].roles = ["zookeeper", "exhibitor"]
+        sspec.groups["monitoring"].instanced["id"] = "ami-00000001"
+        plan = StackPlanner(sspec, materialized).plan()
+        self.af(plan.domain_init)
+        self.af(plan.stack_init)
+        self.ae(PlanAction.ScaleOut, plan.role_groups["hdfs"].action)
+        self.ae(2, plan.role_groups["hdfs"].delta)
+        self.af(plan.role_groups["hdfs"].install)
+        self.ae(PlanAction.Install, plan.role_groups["zk"].action)
+        self.ae(PlanAction.Replace, plan.role_groups["monitoring"].action)
+        self.ae(["spark"], plan.removed)
+
+        sspec.groups["hdfs"].instanced["count"] = 1
+        sspec.groups["zk"].roles = ["zookeeper"]
+        sspec.groups["monitoring"].instanced["id"] = "ami-a8d369c0"
+        plan = StackPlanner(sspec, materialized).plan()
+        self.ae([], plan.changed())
+
+        sspec.deploy.branch = "release"
+        self.ae(3, len(StackPlanner(sspec, materialized).plan().changed()))
+
+    def test_stack_mapper_skips_unchanged(self):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'))
+        wf_id = self.get_unique_wf_id()
+        apenv = self.get_default_apenv(wf_id=wf_id)
+        workflow_state = self.get_aws_default_workflow_state()
+        workflow_state["stack_spec"]["materialized"]["role_groups"] = \
+            dict((name, self._materialized_role_group(sspec, name)) for name in sspec.groups.keys())
+        sspec.groups["zk"].instanced["count"] = 0
+        mapper = StackMapper(apenv=apenv, wf_id=wf_id, org="contoso.org", domain="dev.marketing.contoso.org",
+                             owner="apuser", stack_spec=sspec, stack_state=workflow_state)
+        workflow = mapper.build_workflow()
+        self.ae(["parallel_deploy_roles"], [g.groupid for g in workflow.groupset.groups])
+        task = workflow.groupset.groups[0].tasks[0]
+        self.ae("zk", task.properties["role_group"].name)
+        self.ae(PlanAction.ScaleIn, task.properties["plan"].action)
+
+    def _materialized_role_group(self, sspec, name):
+        instanced = sspec.groups[name].instanced
+        return dict(image_id=instanced["id"], instance_type=instanced["type"], key_pair_name=instanced["key_pair"],
+                    associate_public_ip=instanced.get("routable"),
+                    auth_spec=[{"protocol": "tcp", "from": p, "to": p} for p in instanced.get("ports", [])],
+                    instances=[dict(instance_id="i-{0}{1}".format(name, i)) for i in range(instanced["count"])],
+                    roles=list(sspec.groups[name].roles),
+                    deploy=dict(git=sspec.deploy.git, branch=sspec.deploy.branch))
+
+    def test_spec_cache(self):
+        cache = PlanCache()
+        spec1 = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'),
+                            cache=cache)
+        spec2 = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'),
+                            cache=cache)
+        self.ae(1, cache.specs.misses)
+        self.ae(1, cache.specs.hits)
+        self.ae(spec1.spec_hash, spec2.spec_hash)
+        # specs loaded from the cache do not share state
+        spec1.groups["hdfs"].instanced["count"] = 10
+        self.ae(1, spec2.groups["hdfs"].instanced["count"])
+        spec3 = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec1.yml'),
+                            cache=cache)
+        self.at(spec3.spec_hash != spec1.spec_hash)
+        self.ae(2, cache.specs.misses)
+
+    def test_spec_validation(self):
+        spec = """
+apspec:
+    type: stack
+    name: hadoop-base
+    deploy:
+        branch: dev
+    role-groups:
+        hdfs:
+            order: first
+            instance:
+                id: ami-a8d369c0
+                count: -1
+                ports: [50070, 80000]
+            roles: []
+        zk:
+            roles: [zookeeper]
+"""
+        try:
+            Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", spec, cache=None)
+            self.fail("invalid spec loaded")
+        except SpecValidationError as ex:
+            self.ae(sorted(["apspec.infrastructure: required",
+                            "apspec.deploy.git: required",
+                            "apspec.role-groups.hdfs.order: expected int/long, got str",
+                            "apspec.role-groups.hdfs.roles: must not be empty",
+                            "apspec.role-groups.hdfs.instance.type: required",
+                            "apspec.role-groups.hdfs.instance.count: must not be negative",
+                            "apspec.role-groups.hdfs.instance.ports[1]: not a port number",
+                            "apspec.role-groups.zk.instance: required"]), sorted(ex.errors))
+
+    def test_spec_validation_safe_yaml(self):
+        # yaml tags that construct python objects are rejected
+        spec = "apspec: !!python/object/apply:os.system ['true']"
+        try:
+            Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", spec, cache=None)
+            self.fail("unsafe yaml loaded")
+        except SpecValidationError as ex:
+            self.ae(1, len(ex.errors))
+            self.at(ex.errors[0].startswith("yaml:"))
+
+    def test_spec_pickle(self):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec1.yml'))
+        self.at(not hasattr(sspec, "__dict__"))
+        copied = pickle.loads(pickle.dumps(sspec))
+        self.ae(sspec.serialize(), copied.serialize())
+        self.ae(sspec.spec_hash, copied.spec_hash)
+        self.ae(sspec.deploy.git, copied.deploy.git)
+
+    def test_deploy_role_scale_out(self):
+        inf = RecordingInf()
+        agent_client = RecordingAgentClient()
+        (task, mrole_group) = self._scaling_task(inf, agent_client, count=5, current=1,
+                                                 plan=RoleGroupPlan("hdfs", PlanAction.ScaleOut, delta=4),
+                                                 rollout=dict(max_surge=2))
+        results = []
+        task.on_run(lambda state, messages, exceptions: results.append(state))
+        self.ae([TaskState.Done], results)
+        # two batches of two. Each batch is installed before the next one starts
+        self.ae([2, 2], inf.provisioned)
+        self.ae(5, len(mrole_group["instances"]))
+        self.ae(5, mrole_group["instance_count"])
+        self.ae([2, 2], [len(hosts) for hosts in agent_client.installed])
+        self.ae([], inf.terminated)
+
+    def test_deploy_role_scale_in(self):
+        inf = RecordingInf()
+        (task, mrole_group) = self._scaling_task(inf, None, count=1, current=5,
+                                                 plan=RoleGroupPlan("hdfs", PlanAction.ScaleIn, delta=4),
+                                                 rollout=dict(max_unavailable="50%"))
+        results = []
+        task.on_run(lambda state, messages, exceptions: results.append(state))
+        self.ae([TaskState.Done], results)
+        self.ae([["i-hdfs1", "i-hdfs2"], ["i-hdfs3", "i-hdfs4"]], inf.terminated)
+        self.ae(["i-hdfs0"], [i["instance_id"] for i in mrole_group["instances"]])
+        self.ae([], mrole_group["retired_instances"])
+        self.ae([], inf.provisioned)
+
+    def test_deploy_role_health_gate(self):
+        inf = RecordingInf()
+        # agents of the second batch never answer
+        agent_client = RecordingAgentClient(down=["10.0.0.3"])
+        (task, mrole_group) = self._scaling_task(inf, agent_client, count=5, current=1,
+                                                 plan=RoleGroupPlan("hdfs", PlanAction.ScaleOut, delta=4),
+                                                 rollout=dict(max_surge=2))
+        results = []
+        task.on_run(lambda state, messages, exceptions: results.append((state, messages)))
+        self.ae(TaskState.Error, results[0][0])
+        self.ae(1, len(results))
+        # the rollout stops at the failed batch
+        self.ae([2, 2], inf.provisioned)
+        self.ae(5, len(mrole_group["instances"]))
+        self.ae(1, len(agent_client.installed))
+
+    def test_deploy_role_install_failed(self):
+        inf = RecordingInf()
+        agent_client = RecordingAgentClient(failing=["10.0.0.2"])
+        (task, mrole_group) = self._scaling_task(inf, agent_client, count=5, current=1,
+                                                 plan=RoleGroupPlan("hdfs", PlanAction.ScaleOut, delta=4),
+                                                 rollout=dict(max_surge=2))
+        results = []
+        task.on_run(lambda state, messages, exceptions: results.append((state, messages, exceptions)))
+        self.ae(1, len(results))
+        (state, messages, exceptions) = results[0]
+        self.ae(TaskState.Error, state)
+        self.ae(["Role install failed on 1 instances"], messages)
+        self.ae(["10.0.0.2"], [e.host for e in exceptions])
+        # the rollout stops at the batch that failed to install
+        self.ae([2], inf.provisioned)
+        self.ae([["10.0.0.1", "10.0.0.2"]], agent_client.installed)
+        self.ae(3, len(mrole_group["instances"]))
+
+    def test_planner_retired_instances(self):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'))
+        mrole_group = self._materialized_role_group(sspec, "hdfs")
+        mrole_group["retired_instances"] = [dict(instance_id="i-old")]
+        plan = StackPlanner(sspec, dict(role_groups=dict(hdfs=mrole_group))).plan_role_group(sspec.groups["hdfs"],
+                                                                                             mrole_group)
+        self.ae(PlanAction.ScaleIn, plan.action)
+        self.ae(0, plan.delta)
+        self.af(plan.install)
+
+    def _scaling_task(self, inf, agent_client, count, current, plan, rollout):
+        sspec = Apspec.load(ApEnv(), "contoso.org", "dev.marketing.contoso.org", self.openf('stack_spec2.yml'))
+        sspec.groups["hdfs"].rollout = rollout
+        mrole_group = self._materialized_role_group(sspec, "hdfs")
+        sspec.groups["hdfs"].instanced["count"] = count
+        mrole_group["instances"] = [inf.instance() for i in range(current)]
+        workflow_state = self.get_aws_default_workflow_state()
+        workflow_state["stack_spec"]["materialized"]["role_groups"] = dict(hdfs=mrole_group)
+        wf_id = self.get_unique_wf_id()
+        apenv = self.get_default_apenv(wf_id=wf_id, properties=dict(agent_client=agent_client))
+        task = DeployRole(apenv, wf_id, inf, dict(stack_spec=sspec, role_group=sspec.groups["hdfs"], plan=plan),
+                          workflow_state)
+        return task, mrole_group
+
     def get_DeployRole(self, apenv, inf, wf_id, properties, workflow_state):
         return DeployRole(apenv, wf_id, inf, properties, workflow_state)
 
@@ -53,4 +281,65 @@ class StackSpecTest(APtest):
         return DomainInit(apenv, wf_id, inf, properties, workflow_state)
 
     def get_StackInit(self, apenv, inf, wf_id, properties, workflow_state):
-        return RStackInit(apenv, wf_id, inf, properties, workflow_state)
\ No newline at end of file
+        return StackInit(apenv, wf_id, inf, properties, workflow_state)
+
+
+class RecordingInf(Inf):
+    """
+    Inf that hands out instances without provisioning anything
+    """
+    def __init__(self):
+        self.provisioned = []
+        self.terminated = []
+        self.next_id = 0
+
+    def instance(self):
+        instance = dict(instance_id="i-hdfs{0}".format(self.next_id),
+                        private_ip_address="10.0.0.{0}".format(self.next_id))
+        self.next_id += 1
+        return instance
+
+    def provision_instances(self, domain_spec, stack_spec, instance_spec):
+        count = instance_spec["instance_count"]
+        self.provisioned.append(count)
+        instance_spec["instances"] = [self.instance() for i in range(count)]
+        return InfResponseContext(spec=instance_spec)
+
+    def terminate_instances(self, domain_spec, stack_spec, instances):
+        self.terminated.append([instance["instance_id"] for instance in instances])
+        return InfResponseContext(spec=dict(instances=instances))
+
+
+class RecordingAgentClient(object):
+    """
+    Agent client where every agent but the hosts in down answers and
+    installs. Installs on the hosts in failing fail
+    """
+    def __init__(self, down=None, failing=None):
+        self.down = down or []
+        self.failing = failing or []
+        self.installed = []
+
+    def wait_for_agents(self, hosts, timeout=300, interval=5):
+        return [host for host in hosts if host in self.down]
+
+    def send_all(self, messages):
+        self.installed.append([host for (host, message) in messages])
+        return [InstalledFuture(host, message, host in self.failing) for (host, message) in messages]
+
+
+class InstalledFuture(object):
+    """
+    Resolved future. Like CallableFuture.get it returns the response
+    message or raises the failure
+    """
+    def __init__(self, host, message, failed):
+        self.host = host
+        self.message = message
+        self.failed = failed
+
+    def get(self):
+        if self.failed:
+            raise AgentClientException("Install failed", host=self.host, status_code=500)
+        return Message(type=self.message.type, data=dict(state=TaskState.Done),
+                       identifier=self.message.identifier)
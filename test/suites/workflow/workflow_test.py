@@ -6,7 +6,14 @@ import sys
 sys.path.append(os.environ['AUTOPILOT_HOME'] + '/../')
 from autopilot.test.common.aptest import APtest
 from autopilot.test.common.tasks import TouchfileTask, TouchfileFailTask
+from autopilot.common import metrics
+from autopilot.common.metrics import MemorySink
+from autopilot.common.asyncpool import taskpool
+from autopilot.common.exception import WorkflowException
 from autopilot.workflows.tasks.task import TaskState
+from autopilot.workflows.workflowexecutor import WorkflowExecutor
+from autopilot.workflows.workflowmodel import WorkflowModel
+from autopilot.stores.journalstore import FileJournalStore
 
 
 class WorkflowTests(APtest):
@@ -67,6 +74,145 @@ class WorkflowTests(APtest):
         finally:
             self._remove_files_if_exists(model)
 
+    def test_parallel_rollback(self):
+        (model, ex) = self.get_default_model("testwf_parallel_rollback.wf")
+        self._remove_files_if_exists(model)
+        try:
+            self.execute_workflow(ex)
+            self.ae(False, ex.success)
+            self.ae(2, len(ex.executed_groups))
+            # both groups are independent so they are rolled back together
+            self.ae(1, len(ex._rollback_batches()))
+            rollback_future = taskpool.callable_future()
+            ex.rollback(callback=rollback_future)
+            rollback_future.wait(timeout=10)
+            for group in ex.groupset.groups:
+                for task in group.tasks:
+                    self.ae(TaskState.Rolledback, task.result.state, "task should be rolledback")
+                    self.af(os.path.isfile(task.properties["file_path"]))
+        finally:
+            self._remove_files_if_exists(model)
+
+    def test_resume_from_journal(self):
+        journal_dir = '/tmp/test_resume_from_journal'
+        self.resetdir(journal_dir)
+        journal = FileJournalStore(journal_dir)
+        (model, ex) = self.get_default_model("testwf1.wf")
+        ex = WorkflowExecutor(apenv=ex.apenv, model=model, journal=journal)
+        self._remove_files_if_exists(model)
+        try:
+            self.execute_workflow(ex)
+            self.at(ex.success)
+
+            # simulate a crash right after the canary group was checkpointed
+            records = journal.read(model.wf_id)
+            canary_index = [i for (i, r) in enumerate(records)
+                            if r["type"] == "checkpoint" and r["groupid"] == "canary"][0]
+            self.resetdir(journal_dir + '/crashed')
+            crashed = FileJournalStore(journal_dir + '/crashed')
+            # a task done after the checkpoint has no workflow_state in it and runs again
+            done_after = [r for r in records[canary_index + 1:]
+                          if r["type"] == "task" and r["state"] == TaskState.Done][:1]
+            for record in records[:canary_index + 1] + done_after:
+                crashed.append(model.wf_id, record)
+            crashed.flush()
+            self._remove_files_if_exists(model)
+
+            (model, ex) = self.get_default_model("testwf1.wf")
+            ex = WorkflowExecutor(apenv=ex.apenv, model=model, journal=crashed)
+            ex.resume(model.wf_id).wait(timeout=10)
+            self.at(ex.success)
+            for group in ex.groupset.groups:
+                for task in group.tasks:
+                    self.ae(TaskState.Done, task.result.state)
+                    # only the full group is run again
+                    self.ae(group.groupid == "full", os.path.isfile(task.properties["file_path"]))
+        finally:
+            self._remove_files_if_exists(model)
+            journal.close()
+
+    def test_journal_closed_after_rollback(self):
+        journal_dir = '/tmp/test_journal_closed_after_rollback'
+        self.resetdir(journal_dir)
+        journal = FileJournalStore(journal_dir)
+        (model, ex) = self.get_default_model("testwf_serial_fail.wf")
+        ex = WorkflowExecutor(apenv=ex.apenv, model=model, journal=journal)
+        self._remove_files_if_exists(model)
+        try:
+            self.execute_workflow(ex)
+            self.af(ex.success)
+            rollback_future = taskpool.callable_future()
+            ex.rollback(callback=rollback_future)
+            rollback_future.wait(timeout=10)
+            self.ae({}, journal.files)
+            self.ae("workflow", journal.read(model.wf_id)[-1]["type"])
+        finally:
+            self._remove_files_if_exists(model)
+            journal.close()
+
+    def test_group_graph(self):
+        (model, ex) = self.get_default_model("testwf_graph.wf")
+        self._remove_files_if_exists(model)
+        try:
+            self.at(model.groupset.is_graph())
+            self.execute_workflow(ex)
+            self.at(ex.success)
+            self.ae(3, len(ex.executed_groups))
+            # full depends on both the other groups so it always starts last
+            self.ae("full", ex.executed_groups[-1].groupid)
+            for group in ex.groupset.groups:
+                for task in group.tasks:
+                    self.ae(TaskState.Done, task.result.state)
+                    self.at(os.path.isfile(task.properties["file_path"]))
+        finally:
+            self._remove_files_if_exists(model)
+
+    def test_group_graph_cycle(self):
+        self.assertRaises(WorkflowException, self.get_default_model, "testwf_graph_cycle.wf")
+
+    def test_workflow_trace(self):
+        (model, ex) = self.get_default_model("testwf1.wf")
+        self._remove_files_if_exists(model)
+        # other tests run the same workflow id. Only this run's spans are checked
+        metrics.registry.traces.pop(model.wf_id, None)
+        sink = metrics.registry.add_sink(MemorySink())
+        try:
+            self.execute_workflow(ex)
+            spans = metrics.registry.trace(model.wf_id)
+            names = [span["name"] for span in spans]
+            self.ae(3, names.count("task_run"))
+            self.ae(2, names.count("group_run"))
+            # the workflow span finishes last
+            self.ae("workflow_run", names[-1])
+            self.ae(True, spans[-1]["labels"]["success"])
+            self.ae(len(spans), len(sink.spans))
+            self.at(sink.snapshot is not None)
+            result = ex.groupset.groups[0].tasks[0].result.serialize()
+            self.ae("DONE", result["state"])
+            self.ae(["INITIALIZED", "STARTED", "DONE"], result["states"])
+        finally:
+            metrics.registry.remove_sink(sink)
+            self._remove_files_if_exists(model)
+
+    def test_workflow_pool_released(self):
+        (model, ex) = self.get_default_model("testwf1.wf")
+        self._remove_files_if_exists(model)
+        try:
+            self.execute_workflow(ex)
+            self.at(ex.success)
+            # the pool is detached once the last task greenlet has exited
+            for i in range(100):
+                if not self._workflow_pool_attached(model):
+                    break
+                taskpool.doyield(seconds=0.01)
+            self.af(self._workflow_pool_attached(model))
+        finally:
+            self._remove_files_if_exists(model)
+
+    def _workflow_pool_attached(self, model):
+        domain_pool = taskpool.root.children.get(model.domain or "default")
+        return domain_pool is not None and model.wf_id in domain_pool.children
+
     def get_Touchfile(self, apenv, inf, wf_id, properties, workflow_state):
         return TouchfileTask("Touchfile", apenv, wf_id, inf, properties, workflow_state)
 
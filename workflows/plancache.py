@@ -0,0 +1,42 @@
+#! /usr/bin/python
+import copy
+import json
+import hashlib
+from autopilot.common.cache import TTLCache
+
+
+def content_hash(*parts):
+    """
+    sha1 over the parts. Dicts and lists are hashed in canonical json form
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, basestring):
+            part = json.dumps(part, sort_keys=True, default=str)
+        if isinstance(part, unicode):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update("\0")
+    return h.hexdigest()
+
+
+class PlanCache(object):
+    """
+    LRU cache for the work that repeats between deploys:
+    parsed spec documents keyed by content hash.
+    Callers get a copy of the cached document
+    """
+    def __init__(self, maxsize=128, ttl=3600):
+        self.specs = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def spec(self, spec_hash, parse):
+        return copy.deepcopy(self.specs.get_or_load(spec_hash, parse))
+
+    def clear(self):
+        self.specs.clear()
+
+    def stats(self):
+        return dict(specs=dict(size=len(self.specs), hits=self.specs.hits, misses=self.specs.misses))
+
+
+plan_cache = PlanCache()
@@ -1,28 +1,94 @@
 #! /usr/bin/python
+import re
 from tornado import gen
 from autopilot.common.asyncpool import taskpool
+from autopilot.common import metrics
 from autopilot.common.logger import wflog
+from autopilot.common.exception import WorkflowException
+from autopilot.workflows.tasks.task import TaskState
+
+class RollbackPolicy(object):
+    """
+    How the tasks of a group are rolled back
+    serial: one task at a time in reverse order
+    parallel: all tasks at once
+    bounded(k): at most k tasks at once
+    """
+    Serial = "serial"
+    Parallel = "parallel"
+    Bounded = "bounded"
+
+    _bounded_re = re.compile(r"^bounded\((\d+)\)$")
+
+    def __init__(self, mode=Serial, limit=None):
+        self.mode = mode
+        self.limit = limit
+
+    def serialize(self):
+        if self.mode == RollbackPolicy.Bounded:
+            return "{0}({1})".format(self.mode, self.limit)
+        return self.mode
+
+    @staticmethod
+    def parse(policy):
+        """
+        Returns a RollbackPolicy from "serial", "parallel" or "bounded(k)".
+        Returns None if policy cannot be parsed
+        """
+        if policy is None:
+            return RollbackPolicy()
+        if isinstance(policy, RollbackPolicy):
+            return policy
+        policy = policy.strip().lower()
+        if policy in (RollbackPolicy.Serial, RollbackPolicy.Parallel):
+            return RollbackPolicy(mode=policy)
+        match = RollbackPolicy._bounded_re.match(policy)
+        if match and int(match.group(1)) > 0:
+            return RollbackPolicy(mode=RollbackPolicy.Bounded, limit=int(match.group(1)))
+        return None
+
 
 class Group(object):
     """
     Groups execute all tasks in parallel
+    depends_on lists the groupids that have to finish before this group
+    can run. None means the group was not declared as part of a dependency graph
+    independent_rollback marks groups that can be rolled back together with
+    other independent groups
     """
-    def __init__(self, wf_id, apenv, groupid, tasks):
+    def __init__(self, wf_id, apenv, groupid, tasks, depends_on=None,
+                 rollback_policy=None, independent_rollback=False):
         self.wf_id = wf_id
         self.apenv = apenv
         self.groupid = groupid
         self.tasks = tasks
+        self.depends_on = depends_on
+        self.rollback_policy = RollbackPolicy.parse(rollback_policy)
+        if self.rollback_policy is None:
+            raise WorkflowException("Invalid rollback policy {0} for group {1}"
+                                    .format(rollback_policy, groupid), wf_id)
+        self.independent_rollback = independent_rollback
 
     def serialize(self):
-        return dict(groupid=self.groupid,
-                    tasks=[t.serialize() for t in self.tasks if t]
-                    )
+        d = dict(groupid=self.groupid,
+                 tasks=[t.serialize() for t in self.tasks if t]
+                 )
+        if self.depends_on is not None:
+            d["depends_on"] = list(self.depends_on)
+        if self.rollback_policy.mode != RollbackPolicy.Serial:
+            d["rollback"] = self.rollback_policy.serialize()
+        if self.independent_rollback:
+            d["independent_rollback"] = True
+        return d
 
-    def get_execution_context(self):
+    def get_execution_context(self, pool=None):
         """
         Returns a fresh execution context
+        Tasks are spawned on pool. Defaults to the shared taskpool
         """
-        return GroupExecutionContext(self.wf_id, self.groupid, self.tasks)
+        return GroupExecutionContext(self.wf_id, self.groupid, self.tasks, pool=pool,
+                                     rollback_policy=self.rollback_policy,
+                                     independent_rollback=self.independent_rollback)
 
 
 class GroupSet(object):
@@ -35,39 +101,140 @@ class GroupSet(object):
     def serialize(self):
         return [g.serialize() for g in self.groups if g]
 
+    def is_graph(self):
+        """
+        True if any group declares depends_on edges. Otherwise groups
+        are executed serially in the order they are listed
+        """
+        for group in self.groups:
+            if group.depends_on is not None:
+                return True
+        return False
+
+    def dependencies(self):
+        """
+        Returns a dict of groupid -> list of groupids it depends on.
+        A group without depends_on depends on the group listed before it
+        so that mixing serial and graph groups keeps the serial ordering.
+        Raises WorkflowException on unknown groups or cycles
+        """
+        deps = {}
+        previous = None
+        for group in self.groups:
+            if group.groupid in deps:
+                raise WorkflowException("Duplicate groupid: {0}".format(group.groupid), group.wf_id)
+            if group.depends_on is not None:
+                deps[group.groupid] = list(group.depends_on)
+            else:
+                deps[group.groupid] = [previous.groupid] if previous else []
+            previous = group
+
+        for group in self.groups:
+            for dep in deps[group.groupid]:
+                if dep not in deps:
+                    raise WorkflowException("Group {0} depends on unknown group {1}"
+                                            .format(group.groupid, dep), group.wf_id)
+        self._check_cycles(deps)
+        return deps
+
+    def _check_cycles(self, deps):
+        # Kahn's algorithm. Anything left unvisited is part of a cycle
+        remaining = dict((groupid, set(d)) for (groupid, d) in deps.items())
+        ready = [groupid for (groupid, d) in remaining.items() if not d]
+        while ready:
+            done = ready.pop()
+            remaining.pop(done)
+            for (groupid, d) in remaining.items():
+                if done in d:
+                    d.discard(done)
+                    if not d:
+                        ready.append(groupid)
+        if remaining:
+            wf_id = self.groups[0].wf_id if self.groups else None
+            raise WorkflowException("Cycle in group dependencies: {0}"
+                                    .format(", ".join(sorted(remaining.keys()))), wf_id)
+
 
 class GroupExecutionContext(object):
-    def __init__(self, wf_id, groupid, tasks):
+    def __init__(self, wf_id, groupid, tasks, pool=None, rollback_policy=None, independent_rollback=False):
         self.wf_id = wf_id
         self.groupid = groupid
         self.tasks = tasks
+        self.pool = pool or taskpool
+        self.rollback_policy = rollback_policy or RollbackPolicy()
+        self.independent_rollback = independent_rollback
         self.tasksdone = 0
         self.finalcallback = None
         self.rolledback = False
+        self.span = None
 
     def run(self, callback):
         """
         Schedule all tasks in this group to run in parallel
         """
         self.finalcallback = callback
-        for task in self.tasks:
+        self.span = metrics.registry.span("group_run", wf_id=self.wf_id, group=self.groupid)
+        # tasks restored as done from a journal are not run again
+        pending = [task for task in self.tasks if task.result.state == TaskState.Initialized]
+        self.tasksdone = len(self.tasks) - len(pending)
+        if not pending:
+            self.span.finish()
+            callback(self.tasks)
+            return
+        for task in pending:
             # schedule both the tasks to execute
-            taskpool.spawn(task.run, args=dict(callback=self._task_callback))
+            self.pool.spawn(task.run, args=dict(callback=self._task_callback))
 
     def _task_callback(self, task):
         self.tasksdone += 1
-        wflog.info(wf_id=self.wf_id, msg="in gec _task_callback for: {0}".format(self.tasksdone))
+        wflog.debug("group {groupid}: {done}/{total} tasks done", wf_id=self.wf_id,
+                    groupid=self.groupid, done=self.tasksdone, total=len(self.tasks))
         if self.tasksdone == len(self.tasks):
-            wflog.info(wf_id=self.wf_id, msg="in gec. Final callback: {0}".format(self.tasksdone))
-            wflog.info(wf_id=self.wf_id, msg="in gec. finalcallback type: {0}".format(type(self.finalcallback)))
+            self.span.finish()
             self.finalcallback(self.tasks)
 
-    @gen.engine
     def rewind(self, callback):
         """
-        Tasks will be rolled back in a reverse order synchronously
+        Roll back the tasks as per the rollback policy of the group
         """
         self.rolledback = True
+        span = metrics.registry.span("group_rollback", wf_id=self.wf_id, group=self.groupid)
+
+        def _rewound(ec):
+            span.finish()
+            callback(ec)
+
+        if self.rollback_policy.mode == RollbackPolicy.Serial:
+            self._rewind_serial(_rewound)
+        else:
+            self._rewind_concurrent(_rewound)
+
+    @gen.engine
+    def _rewind_serial(self, callback):
+        """
+        Tasks will be rolled back in a reverse order synchronously
+        """
         for t in self.tasks[::-1]:
             yield gen.Task(t.rollback)
-        callback(self)
\ No newline at end of file
+        callback(self)
+
+    def _rewind_concurrent(self, callback):
+        """
+        Tasks are scheduled for rollback in reverse order on a sub pool
+        bounded by the policy limit (unbounded for parallel)
+        """
+        if not self.tasks:
+            callback(self)
+            return
+        rollback_pool = self.pool.sub_pool(name="{0}_rollback".format(self.groupid),
+                                           size=self.rollback_policy.limit)
+        state = dict(done=0)
+
+        def _task_rolledback(task):
+            state["done"] += 1
+            if state["done"] == len(self.tasks):
+                rollback_pool.release()
+                callback(self)
+
+        for t in self.tasks[::-1]:
+            rollback_pool.spawn(t.rollback, args=dict(callback=_task_rolledback))
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 from autopilot.common import utils
 from autopilot.common import logger
+from autopilot.common import metrics
 
 class TaskState(object):
     """
@@ -39,6 +40,17 @@ class TaskResult(object):
         self.exceptions = []
         self.messages = []
         self.result_data = {}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        listener(task, state) is called on every state change
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
 
     def update(self, next_state, messages=None, exceptions=None):
         if messages:
@@ -48,9 +60,25 @@ class TaskResult(object):
         if self.state != next_state:
             self.state = next_state
             self.state_change_stack.append(next_state)
+            metrics.registry.inc("task_state_total", state=TaskState.to_string(next_state))
+            for listener in self.listeners:
+                listener(self.tracked_task, next_state)
 
     def serialize(self):
-        pass
+        task = self.tracked_task
+        duration = None
+        if task and task.starttime and task.endtime:
+            duration = task.endtime - task.starttime
+        return dict(wf_id=self.workflow,
+                    task=task.name if task else None,
+                    state=TaskState.to_string(self.state),
+                    states=[TaskState.to_string(s) for s in self.state_change_stack],
+                    messages=list(self.messages),
+                    exceptions=[str(ex) for ex in self.exceptions],
+                    starttime=task.starttime if task else None,
+                    endtime=task.endtime if task else None,
+                    duration=duration,
+                    result_data=self.result_data)
 
 
 class Task(object):
@@ -79,10 +107,12 @@ class Task(object):
         if self.result.state is not TaskState.Initialized:
             # todo exceptions
             raise Exception("Task {0} is not in Initialized state. State: {1}".format(self.name, self.result.state))
+        span = metrics.registry.span("task_run", wf_id=self.wf_id, task=self.name)
 
         def _run_callback(final_state, messages=[], exceptions=[]):
-            self.log.info(wf_id=self.wf_id, msg="Executing run callback for task: {0}. Final state: {1}"
-                          .format(self.name, TaskState.to_string(final_state)))
+            span.finish(state=TaskState.to_string(final_state))
+            self.log.info("Executing run callback for task: {task}. Final state: {state}", wf_id=self.wf_id,
+                          task=self.name, state=TaskState.to_string(final_state))
             self.result.update(final_state, messages, exceptions)
             self._finalize()
             # original callback
@@ -91,12 +121,12 @@ class Task(object):
 
         self.result.update(TaskState.Started, messages=["Task {0} Started".format(self.name)])
 
-        self.log.info(wf_id=self.wf_id, msg="begin task run: {0}".format(self.name))
+        self.log.info("begin task run: {task}", wf_id=self.wf_id, task=self.name)
 
         try:
             self.on_run(_run_callback)
         except Exception as ex:
-            self.log.error(wf_id=self.wf_id, msg="Error executing task: {0}".format(self.name),
+            self.log.error("Error executing task: {task}", wf_id=self.wf_id, task=self.name,
                            exc_info=ex)
             _run_callback(TaskState.Error, [], [ex])
 
@@ -106,10 +136,13 @@ class Task(object):
         # do not do anything
         if self.result.state == TaskState.Initialized:
             callback(self)
+            return
+        span = metrics.registry.span("task_rollback", wf_id=self.wf_id, task=self.name)
 
         def _rollback_callback(final_state, messages=[], exceptions=[]):
-            self.log.info(wf_id=self.wf_id, msg="Executing rollback callback for task: {0}. Final state: {1}"
-                          .format(self.name, TaskState.to_string(final_state)))
+            span.finish(state=TaskState.to_string(final_state))
+            self.log.info("Executing rollback callback for task: {task}. Final state: {state}", wf_id=self.wf_id,
+                          task=self.name, state=TaskState.to_string(final_state))
             self.result.update(final_state, messages, exceptions)
             self._finalize()
             # call the original callback
@@ -118,11 +151,11 @@ class Task(object):
 
         self.result.update(TaskState.Rolledback, ["Task {0} Started".format(self.name)])
 
-        self.log.info(wf_id=self.wf_id, msg="begin task rollback: {0}".format(self.name))
+        self.log.info("begin task rollback: {task}", wf_id=self.wf_id, task=self.name)
         try:
             self.on_rollback(_rollback_callback)
         except Exception as ex:
-            self.log.error(wf_id=self.wf_id, msg="Error rolling back task: {0}".format(self.name), exc_info=ex)
+            self.log.error("Error rolling back task: {task}", wf_id=self.wf_id, task=self.name, exc_info=ex)
             _rollback_callback(TaskState.RolledbackError, [], [ex])
 
     # override in derived class
@@ -142,4 +175,5 @@ class Task(object):
         send relevant events
         """
         self.endtime = utils.get_utc_now_seconds()
-        self.log.info(wf_id=self.wf_id, msg="Task {0} done. Final state: {1}".format(self.name, TaskState.to_string(self.result.state)))
\ No newline at end of file
+        self.log.info("Task {task} done. Final state: {state}", wf_id=self.wf_id,
+                      task=self.name, state=TaskState.to_string(self.result.state))
\ No newline at end of file
@@ -9,12 +9,22 @@ class TaskResolver(object):
     """
     def __init__(self, container_class):
         self.container_class = container_class
+        self.factories = {}
 
     def resolve(self, task_name, apenv, wf_id, inf, properties, workflow_state):
         """
         Override this method to give custom implementations
         """
-        func = getattr(self.container_class, "get_{0}".format(task_name))
-        if callable(func):
-            return func(apenv, inf, wf_id, properties, workflow_state)
-        raise AutopilotException("Only callables are allowed")
\ No newline at end of file
+        return self.factory(task_name)(apenv, inf, wf_id, properties, workflow_state)
+
+    def factory(self, task_name):
+        """
+        Returns the callable that creates task_name tasks. Looked up once per name
+        """
+        func = self.factories.get(task_name)
+        if func is None:
+            func = getattr(self.container_class, "get_{0}".format(task_name))
+            if not callable(func):
+                raise AutopilotException("Only callables are allowed")
+            self.factories[task_name] = func
+        return func
\ No newline at end of file
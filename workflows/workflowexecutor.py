@@ -2,24 +2,38 @@
 from autopilot.common.asyncpool import taskpool
 from tornado import gen
 from autopilot.common import logger
+from autopilot.common import metrics
+from autopilot.common import utils
+from autopilot.common.exception import WorkflowException
 from autopilot.workflows.tasks.task import TaskState
 
 
 class WorkflowExecutor(object):
     """
     Executes a given workflow and manages its life cycle
+    Task state transitions and group checkpoints are recorded in the journal
+    (a JournalStore) if one is given or configured as "workflow_journal" in apenv
     """
-    def __init__(self, apenv, model):
+    def __init__(self, apenv, model, journal=None):
         self.log = logger.get_workflow_logger("WorkflowExecutor")
         self.apenv = apenv
         self.model = model
         self.workflow_state = model.workflow_state
         self.inf = model.inf
         self.groupset = model.groupset
+        # bounded per workflow share of the taskpool nested under the domain share
+        self.pool = taskpool.workflow_pool(domain=model.domain, wf_id=model.wf_id,
+                                           size=apenv.get("WORKFLOW_POOL_SIZE"),
+                                           weight=apenv.get("WORKFLOW_POOL_WEIGHT", 1),
+                                           domain_size=apenv.get("DOMAIN_POOL_SIZE"))
+        self.journal = journal or apenv.get("workflow_journal")
+        self.journal_wf_id = model.wf_id
+        self.journal_listeners = []
         self.executed_groups = []
         self.success = True
         self.executed = False
         self.value = self
+        self.span = None
 
     def execute(self):
         """
@@ -30,26 +44,32 @@ class WorkflowExecutor(object):
             raise Exception("Execution of a workflow is only allowed once")
         execute_future = taskpool.callable_future()
         self.executed = True
-        self._execute_groups(execute_future=execute_future)
+        self.span = metrics.registry.span("workflow_run", wf_id=self.model.wf_id)
+        if self.journal:
+            self._attach_journal()
+        if self.groupset.is_graph():
+            self._execute_group_graph(execute_future=execute_future)
+        else:
+            self._execute_groups(execute_future=execute_future)
         return execute_future
 
     @gen.engine
     def _execute_groups(self, execute_future):
         """
-        Groups are always executed in a serial fashion.
+        Groups are executed in a serial fashion when no group declares depends_on.
         Individual tasks within groups maybe executed in parallel
         """
         groupset = self.groupset
         for group in groupset.groups:
             # track each group execution context so that we can rollback if needed
             # execution of tasks within the group is parallel
-            ec = group.get_execution_context()
+            ec = group.get_execution_context(pool=self.pool)
             self.executed_groups.append(ec)
 
             # this will yield to gen.engine
             # gen.engine will continue execution once task callback
             # function is executed
-            self.log.info(wf_id=self.model.wf_id, msg="begin group execution: {0}".format(group.groupid))
+            self.log.info("begin group execution: {groupid}", wf_id=self.model.wf_id, groupid=group.groupid)
             yield gen.Task(ec.run)
 
             if not self._check_group_success(group):
@@ -60,21 +80,175 @@ class WorkflowExecutor(object):
                 self.success = False
                 break
 
-            self.log.info(wf_id=self.model.wf_id, msg="finished group execution: {0}".format(group.groupid))
+            self._checkpoint(group)
+            self.log.info("finished group execution: {groupid}", wf_id=self.model.wf_id, groupid=group.groupid)
 
-        self.log.info(wf_id=self.model.wf_id, msg="finished execution of all groups. Success: {0}".format(self.success))
+        self.log.info("finished execution of all groups. Success: {success}", wf_id=self.model.wf_id,
+                      success=self.success)
 
         # Signal future
         self.log.info(wf_id=self.model.wf_id, msg="Signalling execute_future")
+        self._finish_journal()
+        self.pool.release()
+        self._finish_span()
         execute_future(self)
 
+    def _execute_group_graph(self, execute_future):
+        """
+        Groups declare depends_on edges. Every group whose dependencies
+        have finished is started right away so independent groups overlap.
+        Once a group fails no new groups are started. We wait for the
+        running groups to finish before signalling the caller
+        """
+        deps = self.groupset.dependencies()
+        finished = set()
+        started = set()
+        state = dict(running=0, signalled=False)
+
+        def _group_done(group, tasks):
+            state["running"] -= 1
+            if self._check_group_success(group):
+                finished.add(group.groupid)
+                self._checkpoint(group)
+                self.log.info("finished group execution: {groupid}", wf_id=self.model.wf_id, groupid=group.groupid)
+            else:
+                self.success = False
+            _schedule()
+
+        def _schedule():
+            if self.success:
+                # preserve declaration order when several groups become ready together
+                for group in self.groupset.groups:
+                    if group.groupid in started:
+                        continue
+                    if not all(dep in finished for dep in deps[group.groupid]):
+                        continue
+                    started.add(group.groupid)
+                    state["running"] += 1
+                    ec = group.get_execution_context(pool=self.pool)
+                    self.executed_groups.append(ec)
+                    self.log.info("begin group execution: {groupid}", wf_id=self.model.wf_id, groupid=group.groupid)
+                    ec.run(callback=lambda tasks, g=group: _group_done(g, tasks))
+
+            if state["running"] == 0 and not state["signalled"]:
+                state["signalled"] = True
+                self._finish_journal()
+                self.pool.release()
+                self.log.info("finished execution of group graph. Success: {success}", wf_id=self.model.wf_id,
+                              success=self.success)
+                self._finish_span()
+                execute_future(self)
+
+        _schedule()
+
+    def resume(self, wf_id=None):
+        """
+        Continue a workflow from its journal.
+        The workflow state is restored from the last checkpoint and tasks
+        recorded as done before it are not run again. Returns the execute future
+        """
+        wf_id = wf_id or self.model.wf_id
+        if not self.journal:
+            raise WorkflowException("No journal configured. Cannot resume workflow", wf_id)
+        self.journal_wf_id = wf_id
+        task_states = {}
+        checkpoint = None
+        # only tasks done before the last checkpoint have their workflow_state changes in it
+        checkpointed = {}
+        for record in self.journal.read(wf_id):
+            if record.get("type") == "task":
+                task_states[record.get("key")] = record.get("state")
+            elif record.get("type") == "checkpoint":
+                checkpoint = record
+                checkpointed = dict(task_states)
+
+        if checkpoint:
+            self.workflow_state.update(checkpoint.get("workflow_state") or {})
+        restored = 0
+        for (key, task) in self._task_keys():
+            if checkpointed.get(key) == TaskState.Done and task.result.state == TaskState.Initialized:
+                task.result.update(TaskState.Done, messages=["Task {0} restored from journal".format(task.name)])
+                restored += 1
+        self.log.info("resuming workflow. Tasks restored from journal: {restored}", wf_id=wf_id, restored=restored)
+        return self.execute()
+
+    def _task_keys(self):
+        """
+        Task names are not unique within a workflow so tasks are
+        identified by their group and position
+        """
+        for group in self.groupset.groups:
+            for (index, task) in enumerate(group.tasks):
+                yield ("{0}/{1}/{2}".format(group.groupid, index, task.name), task)
+
+    def _attach_journal(self):
+        def _journal_listener(key):
+            def _record(task, state):
+                self.journal.append(self.journal_wf_id, dict(type="task", key=key, state=state,
+                                                             ts=utils.get_utc_now_seconds()))
+            return _record
+
+        for (key, task) in self._task_keys():
+            listener = _journal_listener(key)
+            task.result.add_listener(listener)
+            self.journal_listeners.append((task, listener))
+
+    def _checkpoint(self, group):
+        if self.journal:
+            self.journal.append(self.journal_wf_id, dict(type="checkpoint", groupid=group.groupid,
+                                                         workflow_state=self.workflow_state,
+                                                         ts=utils.get_utc_now_seconds()), sync=True)
+
+    def _finish_journal(self):
+        if self.journal:
+            self.journal.append(self.journal_wf_id, dict(type="workflow", success=self.success,
+                                                         ts=utils.get_utc_now_seconds()), sync=True)
+            self.journal.close(self.journal_wf_id)
+            # the workflow record is the last one. Rollback is not journaled
+            for (task, listener) in self.journal_listeners:
+                task.result.remove_listener(listener)
+            self.journal_listeners = []
+
+    def _finish_span(self):
+        self.span.finish(success=self.success)
+        metrics.registry.export()
+
     @gen.engine
-    def rollback(self):
+    def rollback(self, callback=None):
         """
-        Calls rollback on the executed groups in the reverse order
+        Calls rollback on the executed groups in the reverse order.
+        Consecutive groups that declare independent_rollback are rolled back together
         """
-        for g in self.executed_groups[::-1]:
-            yield gen.Task(g.rewind)
+        span = metrics.registry.span("workflow_rollback", wf_id=self.model.wf_id)
+        for batch in self._rollback_batches():
+            if len(batch) == 1:
+                yield gen.Task(batch[0].rewind)
+            else:
+                yield gen.Task(self._rewind_together, batch)
+        span.finish()
+        metrics.registry.export()
+        if callback:
+            callback(self)
+
+    def _rollback_batches(self):
+        batches = []
+        for ec in self.executed_groups[::-1]:
+            if ec.independent_rollback and batches and batches[-1][-1].independent_rollback:
+                batches[-1].append(ec)
+            else:
+                batches.append([ec])
+        return batches
+
+    def _rewind_together(self, batch, callback):
+        state = dict(done=0)
+
+        def _rewound(ec):
+            state["done"] += 1
+            if state["done"] == len(batch):
+                callback(batch)
+
+        for ec in batch:
+            ec.rewind(callback=_rewound)
 
     def _all_tasks_succeeded(self):
         for group in self.model.taskgroups:
@@ -59,7 +59,11 @@ class WorkflowModel(object):
         for groupd in groupsetd:
             groups.append(WorkflowModel._resolve_group(apenv=apenv, wf_id=wf_id, inf=inf,
                                                        workflow_state=workflow_state, groupd=groupd))
-        return GroupSet(groups)
+        groupset = GroupSet(groups)
+        if groupset.is_graph():
+            # fail on bad edges before anything is executed
+            groupset.dependencies()
+        return groupset
 
     @staticmethod
     def _resolve_group(apenv, wf_id, inf, workflow_state, groupd):
@@ -67,13 +71,16 @@ class WorkflowModel(object):
         Resolve tasks within a group
         """
         groupid = groupd.get("groupid")
+        depends_on = groupd.get("depends_on")
         tasksd = groupd.get("tasks")
         tasks = []
         task_resolver = apenv.get_task_resolver(wf_id)
         for taskd in tasksd:
             tasks.append(task_resolver.resolve(taskd.get("name"), apenv, wf_id,
                                                inf, taskd.get("properties"), workflow_state))
-        return Group(wf_id, apenv, groupid, tasks)
+        return Group(wf_id, apenv, groupid, tasks, depends_on=depends_on,
+                     rollback_policy=groupd.get("rollback"),
+                     independent_rollback=groupd.get("independent_rollback", False))
 
     @staticmethod
     def get_next_workflow_id(domain, owner):